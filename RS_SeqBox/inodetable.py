@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import os
+from array import array
+
+#name length of a node without a path (free, or unlinked while still known)
+NO_NAME = 0xFFFF
+
+class InodeMap():
+    """inode -> node index, an open addressing hash table in two flat arrays:
+    no Python object is kept per entry. Inode 0 marks an empty slot"""
+
+    def __init__(self, size=1024):
+        self._keys = array('Q', [0]) * size
+        self._values = array('i', [0]) * size
+        self._count = 0
+
+    def _home(self, key):
+        return ((key * 0x9E3779B97F4A7C15) >> 24) & (len(self._keys) - 1)
+
+    def _slot(self, key):
+        mask = len(self._keys) - 1
+        i = self._home(key)
+        while self._keys[i] and self._keys[i] != key:
+            i = (i + 1) & mask
+        return i
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self._keys[self._slot(key)] == key
+
+    def get(self, key, default=None):
+        i = self._slot(key)
+        return self._values[i] if self._keys[i] == key else default
+
+    def __getitem__(self, key):
+        i = self._slot(key)
+        if self._keys[i] != key:
+            raise KeyError(key)
+        return self._values[i]
+
+    def __setitem__(self, key, value):
+        i = self._slot(key)
+        if self._keys[i] != key:
+            if 2 * (self._count + 1) > len(self._keys):
+                self._grow()
+                i = self._slot(key)
+            self._keys[i] = key
+            self._count += 1
+        self._values[i] = value
+
+    def __delitem__(self, key):
+        mask = len(self._keys) - 1
+        i = self._slot(key)
+        if self._keys[i] != key:
+            raise KeyError(key)
+        #shift back the entries after it that would no longer be found
+        j = i
+        while True:
+            j = (j + 1) & mask
+            if not self._keys[j]:
+                break
+            home = self._home(self._keys[j])
+            if (i < home <= j) if i <= j else (home > i or home <= j):
+                continue
+            self._keys[i] = self._keys[j]
+            self._values[i] = self._values[j]
+            i = j
+        self._keys[i] = 0
+        self._count -= 1
+
+    def _grow(self):
+        keys, values = self._keys, self._values
+        self._keys = array('Q', [0]) * (2 * len(keys))
+        self._values = array('i', [0]) * (2 * len(keys))
+        for key, value in zip(keys, values):
+            if key:
+                i = self._slot(key)
+                self._keys[i] = key
+                self._values[i] = value
+
+class InodeTable():
+    """Paths and lookup counts of the inodes known to the kernel.
+
+    Every path is a node of a tree: the index of its parent node and its last
+    component. The nodes live in flat arrays and their names in one byte
+    buffer, a freed node is reused. An inode maps to one node; the other paths
+    of a hardlinked inode are in a side table. A directory node that is
+    forgotten while its children are still known stays in the tree, without
+    an inode, until the last of them goes."""
+
+    def __init__(self, root_path, root_inode):
+        self._parent = array('i')
+        self._inode = array('Q')
+        self._lookups = array('I')
+        self._children = array('I')
+        self._name_start = array('I')
+        self._name_len = array('H')
+        self._names = bytearray()
+        #bytes of the names buffer no node uses anymore
+        self._garbage = 0
+        self._free = array('i')
+        self._node_of = InodeMap()
+        #inode -> extra nodes of its other hardlinks
+        self._links = {}
+        self.root_path = root_path
+        self.root_inode = root_inode
+        self._node_of[root_inode] = self._new_node(-1, b"", root_inode)
+
+    def _set_name(self, node, name):
+        if self._name_len[node] != NO_NAME:
+            self._garbage += self._name_len[node]
+        if name is None:
+            self._name_len[node] = NO_NAME
+            return
+        if self._garbage > 1024*1024 and 2 * self._garbage > len(self._names):
+            self._compact()
+        self._name_start[node] = len(self._names)
+        self._name_len[node] = len(name)
+        self._names += name
+
+    def _name(self, node):
+        start = self._name_start[node]
+        return bytes(self._names[start:start+self._name_len[node]])
+
+    def _compact(self):
+        names = bytearray()
+        for node in range(len(self._parent)):
+            if self._name_len[node] != NO_NAME:
+                start = self._name_start[node]
+                self._name_start[node] = len(names)
+                names += self._names[start:start+self._name_len[node]]
+        self._names = names
+        self._garbage = 0
+
+    def _new_node(self, parent, name, inode):
+        if self._free:
+            node = self._free.pop()
+            self._parent[node] = parent
+            self._inode[node] = inode
+            self._lookups[node] = 0
+            self._children[node] = 0
+        else:
+            node = len(self._parent)
+            self._parent.append(parent)
+            self._inode.append(inode)
+            self._lookups.append(0)
+            self._children.append(0)
+            self._name_start.append(0)
+            self._name_len.append(NO_NAME)
+        self._set_name(node, name)
+        if parent >= 0:
+            self._children[parent] += 1
+        return node
+
+    def _free_node(self, node):
+        #a directory still holding known children only loses its inode
+        self._inode[node] = 0
+        if self._children[node]:
+            return
+        parent = self._parent[node]
+        self._set_name(node, None)
+        self._parent[node] = -1
+        self._free.append(node)
+        self._drop_child(parent)
+
+    def _drop_child(self, parent):
+        if parent < 0:
+            return
+        self._children[parent] -= 1
+        #an orphaned directory goes with its last child
+        if not self._children[parent] and not self._inode[parent]:
+            self._free_node(parent)
+
+    def _detach(self, node):
+        #the node keeps its inode and lookups, but has no path anymore
+        parent = self._parent[node]
+        self._set_name(node, None)
+        self._parent[node] = -1
+        self._drop_child(parent)
+
+    def _path_of(self, node):
+        if self._name_len[node] == NO_NAME:
+            raise KeyError(node)
+        names = []
+        while self._parent[node] >= 0:
+            names.append(self._name(node))
+            node = self._parent[node]
+        return os.path.join(self.root_path, *(os.fsdecode(name) for name in reversed(names)))
+
+    def _nodes(self, inode):
+        return [self._node_of[inode]] + self._links.get(inode, [])
+
+    def _find(self, inode, parent, name):
+        for node in self._nodes(inode):
+            if self._parent[node] == parent and self._name_len[node] != NO_NAME and self._name(node) == name:
+                return node
+        return None
+
+    def __contains__(self, inode):
+        """Known through a lookup, the root is always known but never counted"""
+        node = self._node_of.get(inode)
+        return node is not None and (inode == self.root_inode or self._lookups[node] > 0)
+
+    def __len__(self):
+        return len(self._node_of)
+
+    def path(self, inode):
+        """One of the paths of an inode, KeyError if it is not known"""
+        return self._path_of(self._node_of[inode])
+
+    def paths(self, inode):
+        return [self._path_of(node) for node in self._nodes(inode)
+                if self._name_len[node] != NO_NAME]
+
+    def lookups(self, inode):
+        node = self._node_of.get(inode)
+        return 0 if node is None else self._lookups[node]
+
+    def add(self, inode, parent_inode, name):
+        """Count a lookup of parent_inode/name, which is inode"""
+        parent = self._node_of[parent_inode]
+        name = os.fsencode(name)
+        node = self._node_of.get(inode)
+        if node is None:
+            self._node_of[inode] = node = self._new_node(parent, name, inode)
+        elif self._name_len[node] == NO_NAME:
+            #unlinked while known, and found again under another name
+            self._parent[node] = parent
+            self._set_name(node, name)
+            self._children[parent] += 1
+        elif self._find(inode, parent, name) is None:
+            self._links.setdefault(inode, []).append(self._new_node(parent, name, inode))
+        self._lookups[node] += 1
+
+    def forget(self, inode, nlookup):
+        """Drop nlookup lookups, and the inode with all its paths at zero; True if
+        it is gone"""
+        node = self._node_of.get(inode)
+        if node is None or inode == self.root_inode:
+            return False
+        if self._lookups[node] > nlookup:
+            self._lookups[node] -= nlookup
+            return False
+        for node in self._nodes(inode):
+            self._free_node(node)
+        del self._node_of[inode]
+        self._links.pop(inode, None)
+        return True
+
+    def remove(self, inode, parent_inode, name):
+        """Drop one path of an inode, after an unlink; an inode without any other
+        path stays counted, without a path, until it is forgotten"""
+        if inode not in self._node_of:
+            return
+        node = self._find(inode, self._node_of.get(parent_inode, -2), os.fsencode(name))
+        if node is None:
+            return
+        links = self._links.get(inode)
+        if not links:
+            self._detach(node)
+            return
+        if node == self._node_of[inode]:
+            #another hardlink becomes the main path, and takes over the count
+            other = links.pop()
+            self._lookups[other] = self._lookups[node]
+            self._node_of[inode] = other
+        else:
+            links.remove(node)
+        if not links:
+            del self._links[inode]
+        self._free_node(node)
+
+    def move(self, inode, parent_inode_old, name_old, parent_inode_new, name_new):
+        """Rename a path of an inode, the paths below it follow"""
+        if inode not in self._node_of:
+            return
+        parent_old = self._node_of.get(parent_inode_old, -2)
+        node = self._find(inode, parent_old, os.fsencode(name_old))
+        if node is None:
+            return
+        parent_new = self._node_of[parent_inode_new]
+        self._children[parent_new] += 1
+        self._parent[node] = parent_new
+        self._set_name(node, os.fsencode(name_new))
+        self._drop_child(parent_old)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#Reed-Solomon encoding of many messages at once. The parity of a message is the
+#remainder of a polynomial division by the generator: the division runs as an
+#LFSR, one step per message byte, and every step is done for all the messages
+#together with a table lookup and an XOR over the whole batch
+
+class BatchEncoder():
+    """Encoder for messages of the same length, same codewords as RSCodec.encode"""
+
+    def __init__(self, nsym, nsize=255, fcr=0, prim=0x11d, generator=2, c_exp=8):
+        self.nsym = nsym
+        self.nsize = nsize
+        field = 1 << c_exp
+        def clmul(a, b):
+            #carry-less multiplication, reduced by the primitive polynomial
+            product = 0
+            while b:
+                if b & 1:
+                    product ^= a
+                a <<= 1
+                if a & field:
+                    a ^= prim
+                b >>= 1
+            return product
+        gf_exp = [0] * (2 * field)
+        gf_log = [0] * field
+        x = 1
+        for i in range(field - 1):
+            gf_exp[i] = x
+            gf_log[x] = i
+            x = clmul(x, generator)
+        for i in range(field - 1, 2 * field):
+            gf_exp[i] = gf_exp[i - (field - 1)]
+        def mul(a, b):
+            return 0 if a == 0 or b == 0 else gf_exp[gf_log[a] + gf_log[b]]
+        #generator polynomial, highest coefficient first
+        gen = [1]
+        for i in range(nsym):
+            root = gf_exp[(fcr + i) % (field - 1)]
+            product = gen + [0]
+            for j, coef in enumerate(gen):
+                product[j + 1] ^= mul(coef, root)
+            gen = product
+        #row c: what a feedback of c adds to the register
+        self.table = np.array([[mul(c, coef) for coef in gen[1:]] for c in range(field)],
+                              dtype=np.uint8)
+
+    def parity(self, messages):
+        """ECC symbols of the rows of a 2-D uint8 array, each at most nsize-nsym long"""
+        rows, k = messages.shape
+        register = np.zeros((rows, k + self.nsym), dtype=np.uint8)
+        register[:, :k] = messages
+        feedback = np.empty((rows, self.nsym), dtype=np.uint8)
+        for i in range(k):
+            np.take(self.table, register[:, i], axis=0, out=feedback)
+            register[:, i+1:i+1+self.nsym] ^= feedback
+        return register[:, k:]
+
+    def encode(self, messages, interleave=False):
+        """Codewords of a list of messages of the same length, cut in chunks of
+        nsize-nsym bytes like RSCodec does; with interleave, symbol i of every
+        codeword of a message is stored next to each other"""
+        count = len(messages)
+        array = np.frombuffer(b"".join(messages), dtype=np.uint8).reshape(count, -1)
+        chunk = self.nsize - self.nsym
+        length = array.shape[1]
+        full = length - length % chunk
+        parts = []
+        if full:
+            pieces = array[:, :full].reshape(-1, chunk)
+            parts.append(np.concatenate([pieces, self.parity(pieces)], axis=1).reshape(count, -1))
+        if full < length:
+            #the shorter last codeword
+            pieces = array[:, full:]
+            parts.append(np.concatenate([pieces, self.parity(pieces)], axis=1))
+        codewords = np.concatenate(parts, axis=1) if len(parts) > 1 else parts[0]
+        if interleave:
+            n = length // chunk
+            codewords = codewords.reshape(count, n, self.nsize).transpose(0, 2, 1).reshape(count, -1)
+        return [row.tobytes() for row in codewords]
+
+#batch encoders shared by the whole process, like seqbox.rscodec
+_encoders = {}
+def encoder(nsym, nsize=255, fcr=0, prim=0x11d, generator=2, c_exp=8):
+    """The batch encoder for nsym ECC symbols, None without NumPy"""
+    if np is None:
+        return None
+    key = (nsym, nsize, fcr, prim, generator, c_exp)
+    batch = _encoders.get(key)
+    if batch is None:
+        batch = BatchEncoder(nsym, nsize=nsize, fcr=fcr, prim=prim, generator=generator, c_exp=c_exp)
+        _encoders[key] = batch
+    return batch
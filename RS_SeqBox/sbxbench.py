@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import os
+import sys
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxenc as sbxenc
+except ImportError:
+    pass
+try:
+    import sbxenc as sbxenc
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxdec as sbxdec
+except ImportError:
+    pass
+try:
+    import sbxdec as sbxdec
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxscan as sbxscan
+except ImportError:
+    pass
+try:
+    import sbxscan as sbxscan
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxreco as sbxreco
+except ImportError:
+    pass
+try:
+    import sbxreco as sbxreco
+except ImportError:
+    pass
+
+PROGRAM_VER = "1.0.0"
+
+OPERATIONS = ["encode", "decode", "scan", "reco"]
+PASSWORD = "benchmark"
+
+def get_cmdline():
+    """Evaluate command line parameters, usage & help."""
+    parser = argparse.ArgumentParser(
+             description="measure the throughput of the SeqBox tools",
+             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+             prefix_chars='-+')
+    parser.add_argument("-v", "--version", action='version',
+                        version='SeqBox - Sequenced Box container - ' +
+                        'Benchmark v%s' % PROGRAM_VER)
+    parser.add_argument("-op", "--ops", type=str, default=",".join(OPERATIONS),
+                        help="operations to measure")
+    parser.add_argument("-s", "--sizes", type=str, default="1K,1M,16M",
+                        help="file sizes (K, M and G suffixes)")
+    parser.add_argument("-sv", "--sbxver", type=str, default="1,2",
+                        help="SBX blocks versions")
+    parser.add_argument("-p", "--password", type=str, default="both",
+                        choices=["on", "off", "both"], help="measure with/without password")
+    parser.add_argument("-raid", "--raid", type=str, default="both",
+                        choices=["on", "off", "both"], help="measure with/without raid")
+    parser.add_argument("-d", "--damage", type=str, default="0,1,10",
+                        help="percent of damaged bytes for decode and scan")
+    parser.add_argument("-w", "--warmup", type=int, default=1,
+                        help="runs before measuring", metavar="n")
+    parser.add_argument("-r", "--repetitions", type=int, default=3,
+                        help="measured runs per case", metavar="n")
+    parser.add_argument("-j", "--json", type=str, default=None, metavar="filename",
+                        help="write the results as JSON")
+    parser.add_argument("-b", "--baseline", type=str, default=None, metavar="filename",
+                        help="compare with the results of a previous run")
+    parser.add_argument("-t", "--tolerance", type=float, default=10,
+                        help="allowed throughput loss in percent before it is a regression",
+                        metavar="n")
+    parser.add_argument("-tmp", "--tempdir", type=str, default=None, metavar="path",
+                        help="where to create the test files")
+    res = parser.parse_args()
+    return res
+
+def errexit(errlev=1, mess=""):
+    """Display an error and exit."""
+    if mess != "":
+        sys.stderr.write("%s: error: %s\n" %
+                         (os.path.split(sys.argv[0])[1], mess))
+    sys.exit(errlev)
+
+def parse_size(text):
+    units = {"K":1024, "M":1024**2, "G":1024**3}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def parse_onoff(value):
+    return {"on":[True], "off":[False], "both":[False, True]}[value]
+
+def case_key(case):
+    return "%s v%i %iB pw=%i raid=%i damage=%g%%" % (case["op"], case["version"], case["size"],
+                                                     case["password"], case["raid"], case["damage"])
+
+def create_file(filename, size):
+    """Random (incompressible) data, written in chunks so GB sizes do not need the RAM"""
+    rnd = random.Random(size)
+    with open(filename, "wb") as fout:
+        while size > 0:
+            chunk = min(size, 1024*1024)
+            fout.write(rnd.randbytes(chunk))
+            size -= chunk
+
+def damage_file(filename, percent, seed):
+    """Overwrite a percentage of the bytes of a file at random positions"""
+    if percent <= 0:
+        return
+    rnd = random.Random(seed)
+    filesize = os.path.getsize(filename)
+    count = int(filesize * percent / 100)
+    #the damage of each chunk is applied in memory and written back at once
+    with open(filename, "r+b") as f:
+        pos = 0
+        while pos < filesize and count > 0:
+            buffer = bytearray(f.read(1024*1024))
+            #the damaged bytes spread evenly over the chunks left
+            damaged = min(len(buffer), -(-count * len(buffer) // (filesize - pos)))
+            for offset, value in zip(rnd.sample(range(len(buffer)), damaged), rnd.randbytes(damaged)):
+                buffer[offset] = value
+            f.seek(pos)
+            f.write(buffer)
+            pos += len(buffer)
+            count -= damaged
+
+class Case():
+    """Set up the files needed by one measurement and run the operation"""
+
+    def __init__(self, case, workdir):
+        self.case = case
+        self.workdir = workdir
+        self.filename = os.path.join(workdir, "bench.bin")
+        self.sbxfilename = self.filename + ".sbx"
+        self.dbfilename = os.path.join(workdir, "bench.db3")
+        self.destpath = os.path.join(workdir, "reco")
+        self.password = PASSWORD if case["password"] else ""
+
+    def setup(self):
+        if not os.path.exists(self.filename):
+            create_file(self.filename, self.case["size"])
+        if self.case["op"] != "encode":
+            sbxenc.encode(self.filename, sbxfilename=self.sbxfilename, overwrite=True,
+                          sbx_ver=self.case["version"], raid=self.case["raid"],
+                          password=self.password)
+            damage_file(self.sbxfilename, self.case["damage"], 1)
+            if self.case["raid"]:
+                damage_file(self.sbxfilename+".raid", self.case["damage"], 2)
+        if self.case["op"] == "reco":
+            sbxscan.scan([self.sbxfilename], dbfilename=self.dbfilename,
+                         sbx_ver=self.case["version"])
+            os.makedirs(self.destpath, exist_ok=True)
+
+    def run(self):
+        op = self.case["op"]
+        if op == "encode":
+            sbxenc.encode(self.filename, sbxfilename=self.sbxfilename, overwrite=True,
+                          sbx_ver=self.case["version"], raid=self.case["raid"],
+                          password=self.password)
+        elif op == "decode":
+            sbxdec.decode(self.sbxfilename, filename=self.filename+".out", overwrite=True,
+                          sbx_ver=self.case["version"], raid=self.case["raid"],
+                          password=self.password)
+        elif op == "scan":
+            #blocks magic is never masked by the password, so the scan runs without it
+            sbxscan.scan([self.sbxfilename], dbfilename=self.dbfilename,
+                         sbx_ver=self.case["version"])
+        elif op == "reco":
+            sbxreco.recover(self.dbfilename, destpath=self.destpath, recover_all=True, overwrite=True)
+
+def run_case(case, warmup, repetitions, tempdir, conn):
+    """Child process: measure one case, so peak RSS and CPU time are its own"""
+    workdir = tempfile.mkdtemp(prefix="sbxbench", dir=tempdir)
+    result = dict(case)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+             contextlib.redirect_stderr(devnull):
+            bench = Case(case, workdir)
+            bench.setup()
+            times = []
+            cputimes = []
+            ok = True
+            for i in range(warmup + repetitions):
+                starttime = time.perf_counter()
+                startcpu = time.process_time()
+                try:
+                    bench.run()
+                except (SystemExit, seqbox.ReedSolomonError, seqbox.SbxError):
+                    #too much damage is a valid outcome, it is still timed
+                    ok = False
+                if i >= warmup:
+                    times.append(time.perf_counter() - starttime)
+                    cputimes.append(time.process_time() - startcpu)
+        sbx = seqbox.SbxBlock(ver=case["version"])
+        blocks = -(-case["size"] // sbx.raw_data_size_read_into_1_block) + 1
+        wall = statistics.median(times)
+        result.update({"ok":ok,
+                       "wall_s":wall,
+                       "wall_min_s":min(times),
+                       "cpu_s":statistics.median(cputimes),
+                       "mbps":case["size"] / (1024*1024) / wall if wall > 0 else 0,
+                       "us_per_block":wall * 1e6 / blocks,
+                       "peak_rss_kb":resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+    except Exception as err:
+        result.update({"ok":False, "error":repr(err)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    conn.send(result)
+    conn.close()
+
+def build_cases(ops, sizes, versions, passwords, raids, damages):
+    cases = []
+    for op, size, version, password, raid in itertools.product(ops, sizes, versions, passwords, raids):
+        #damage only matters to the operations reading containers
+        for damage in (damages if op in ("decode", "scan") else [0]):
+            cases.append({"op":op, "size":size, "version":version,
+                          "password":password, "raid":raid, "damage":damage})
+    return cases
+
+def benchmark(cases, warmup=1, repetitions=3, tempdir=None):
+    results = []
+    ctx = multiprocessing.get_context("fork")
+    for case in cases:
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=run_case, args=(case, warmup, repetitions, tempdir, child_conn))
+        p.start()
+        child_conn.close()
+        result = parent_conn.recv()
+        p.join()
+        results.append(result)
+        print_result(result)
+    return results
+
+def print_result(result):
+    if "error" in result:
+        print("%-50s error: %s" % (case_key(result), result["error"]))
+        return
+    print("%-50s %9.2f MB/s %10.1f us/block %8.3f s cpu %8i KB rss%s" %
+          (case_key(result), result["mbps"], result["us_per_block"], result["cpu_s"],
+           result["peak_rss_kb"], "" if result["ok"] else "  (failed)"))
+
+def compare(results, baseline, tolerance):
+    """List the cases that got slower than the baseline by more than tolerance percent"""
+    reference = {case_key(r):r for r in baseline["results"] if "mbps" in r}
+    regressions = []
+    for result in results:
+        old = reference.get(case_key(result))
+        if not old or "mbps" not in result or old["mbps"] <= 0:
+            continue
+        change = (result["mbps"] - old["mbps"]) * 100.0 / old["mbps"]
+        if change < -tolerance:
+            regressions.append((case_key(result), old["mbps"], result["mbps"], change))
+    return regressions
+
+def main():
+    cmdline = get_cmdline()
+    ops = [op.strip() for op in cmdline.ops.split(",")]
+    for op in ops:
+        if op not in OPERATIONS:
+            errexit(1, "unknown operation '%s'" % op)
+    versions = [int(v) for v in cmdline.sbxver.split(",")]
+    for v in versions:
+        if not seqbox.supported_vers.__contains__(v):
+            errexit(1, "sbx version %i not supported" % v)
+    cases = build_cases(ops, [parse_size(s) for s in cmdline.sizes.split(",")], versions,
+                        parse_onoff(cmdline.password), parse_onoff(cmdline.raid),
+                        [float(d) for d in cmdline.damage.split(",")])
+
+    results = benchmark(cases, cmdline.warmup, cmdline.repetitions, cmdline.tempdir)
+    report = {"program_ver":PROGRAM_VER,
+              "python":sys.version.split()[0],
+              "time":int(time.time()),
+              "warmup":cmdline.warmup,
+              "repetitions":cmdline.repetitions,
+              "results":results}
+    if cmdline.json:
+        with open(cmdline.json, "w") as fout:
+            json.dump(report, fout, indent=1)
+
+    if cmdline.baseline:
+        with open(cmdline.baseline) as fin:
+            baseline = json.load(fin)
+        regressions = compare(results, baseline, cmdline.tolerance)
+        for key, old, new, change in regressions:
+            print("REGRESSION %s: %.2f -> %.2f MB/s (%.1f%%)" % (key, old, new, change))
+        if regressions:
+            errexit(1, "%i regression(s) against '%s'" % (len(regressions), cmdline.baseline))
+        print("no regressions against '%s'" % cmdline.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -24,10 +24,11 @@
 #SOFTWARE.
 #----------------------------------------------------------------------------------
 
-import creedsolo.creedsolo as crs
 import os
 import argparse
 import hashlib
+import sqlite3
+import time
 from functools import partial
 
 try:
@@ -50,66 +51,84 @@ try:
     import RS_SeqBox.sbxdec as sbxdec
 except ImportError:
     pass
+try:
+    import RS_SeqBox.sbxmerkle as sbxmerkle
+except ImportError:
+    pass
+try:
+    import sbxmerkle as sbxmerkle
+except ImportError:
+    pass
 
 PROGRAM_VER = "1.0.2"
 
-def decode_header_block_with_rsc(buffer, sbx_version):
-    sbx = seqbox.SbxBlock(ver=sbx_version)
-    rsc=crs.RSCodec(sbx.redsym)
-    decoded = bytes(rsc.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
-    return decoded
+LEDGER_FILENAME = ".sbxcheck.db3"
 
-def get_hash_of_sbx_file(path_to_file, sbx_version):
-    if not os.path.exists(path_to_file):
-        print(1, "sbx file '%s' not found" % (path_to_file))
-        return
-    
-    sbx = seqbox.SbxBlock(ver=sbx_version)
-    fin = open(path_to_file, "rb", buffering=1024*1024)
-    
-    buffer = fin.read(sbx.blocksize)
+class Ledger():
+    """Helper class to access the Sqlite3 DB with verification results"""
+
+    def __init__(self, dbfilename):
+        self.connection = sqlite3.connect(dbfilename)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS sbx_ledger (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, sbxsize INTEGER, sbxmtime INTEGER, sbxinode INTEGER, verified REAL, hash BLOB, sbxhash BLOB)")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS sbx_state (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.commit()
+
+    def GetEntry(self, path):
+        c = self.cursor
+        c.execute("SELECT size, mtime, inode, sbxsize, sbxmtime, sbxinode, verified, hash, sbxhash from sbx_ledger where path = ?", (path,))
+        res = c.fetchone()
+        if res:
+            return {"signature":tuple(res[:6]),
+                    "verified":res[6],
+                    "hash":res[7],
+                    "sbxhash":res[8]}
+
+    def SetEntry(self, path, signature, hash_of_file, hash_inside_sbx_file):
+        c = self.cursor
+        c.execute("INSERT OR REPLACE INTO sbx_ledger (path, size, mtime, inode, sbxsize, sbxmtime, sbxinode, verified, hash, sbxhash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                  (path,) + tuple(signature) + (time.time(), hash_of_file, hash_inside_sbx_file))
+
+    def RemoveEntry(self, path):
+        c = self.cursor
+        c.execute("DELETE FROM sbx_ledger where path = ?", (path,))
 
-    buffer = bytes(decode_header_block_with_rsc(buffer, sbx_version))
+    def GetState(self, key, default=None):
+        c = self.cursor
+        c.execute("SELECT value from sbx_state where key = ?", (key,))
+        res = c.fetchone()
+        if res:
+            return res[0]
+        return default
 
-    header = buffer[:3]
+    def SetState(self, key, value):
+        c = self.cursor
+        c.execute("INSERT OR REPLACE INTO sbx_state (key, value) VALUES (?, ?)", (key, str(value)))
 
-    data = buffer[16:]
-    if header[:3] != b"SBx":
-        print(1, "not a SeqBox file!")
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.cursor.close()
+        self.connection.close()
+
+def get_signature(path_to_file):
+    """stat signature of a file and its sbx container, used to detect changes"""
+    st = os.stat(path_to_file)
+    st_sbx = os.stat(path_to_file+".sbx")
+    return (st.st_size, st.st_mtime_ns, st.st_ino,
+            st_sbx.st_size, st_sbx.st_mtime_ns, st_sbx.st_ino)
+
+def get_hash_of_sbx_file(path_to_file, sbx_version):
+    if not os.path.exists(path_to_file):
+        print(1, "sbx file '%s' not found" % (path_to_file))
         return
-    metadata = {}
-    p=0
-    while p < (len(data)-3):
-                metaid = data[p:p+3]
-                p+=3
-                if metaid == b"\x1a\x1a\x1a":
-                    break
-                else:
-                    metalen = data[p]
-                    metabb = data[p+1:p+1+metalen]
-                    p = p + 1 + metalen    
-                    if metaid == b'FNM':
-                        metadata["filename"] = metabb.decode('utf-8')
-                    if metaid == b'SNM':
-                        metadata["sbxname"] = metabb.decode('utf-8')
-                    if metaid == b'FSZ':
-                        metadata["filesize"] = int.from_bytes(metabb, byteorder='big')
-                    if metaid == b'FDT':
-                        metadata["filedatetime"] = int.from_bytes(metabb, byteorder='big')
-                    if metaid == b'SDT':
-                        metadata["sbxdatetime"] = int.from_bytes(metabb, byteorder='big')
-                    if metaid == b'HSH':
-                        metadata["hash"] = metabb
-                        break
-    if "hash" in metadata:
-        hashtype = metadata["hash"][0]
-        if hashtype == 0x12:
-            hashlen = metadata["hash"][1]
-            hash_of_sbx_file_decoded = metadata["hash"][2:2+hashlen]  
-            d = hashlib.sha256()
-            return hash_of_sbx_file_decoded
-    else:
-        return ""
+    header = seqbox.read_sbx_header(path_to_file, ver=sbx_version)
+    if header is None:
+        print(1, "not a readable SeqBox file!")
+        return b""
+    return seqbox.header_digest(header.metadata)
     
 def get_cmdline():
     """Evaluate command line parameters, usage & help."""
@@ -134,6 +153,15 @@ def get_cmdline():
                         help="SBX blocks version", metavar="n")
     parser.add_argument("-p", "--password", type=str, default="",
                         help="decrypt with password if password used", metavar="pass")
+    parser.add_argument("-rp", "--repair", action="store_true", default=False,
+                        help="rewrite damaged blocks of the sbx (and raid) files in place")
+    parser.add_argument("-inc", "--incremental", action="store_true", default=False,
+                        help="only hash files changed since the last verification")
+    parser.add_argument("-ma", "--max-age", type=float, default=None, dest="max_age",
+                        help="re-read files verified more than n days ago even if unchanged", metavar="n")
+    parser.add_argument("-l", "--ledger", type=str, default=None,
+                        help="verification ledger (default: %s in the checked folder)" % LEDGER_FILENAME,
+                        metavar="filename")
     res = parser.parse_args()
     return res
 
@@ -145,7 +173,7 @@ def get_hash_of_normal_file(path_to_file):
             d.update(buf)
     return d.digest()
 
-def check_whole_directory(path_to_directory, sbx_ver, recursively = False, raid = False, password="", auto=False):
+def check_whole_directory(path_to_directory, sbx_ver, recursively = False, raid = False, password="", auto=False, incremental=False, max_age=None, ledger=None, repair=False):
     if not os.path.exists(path_to_directory) or not os.path.isdir(path_to_directory):
         print("directory does not exist or is not a directory")
         return
@@ -172,14 +200,57 @@ def check_whole_directory(path_to_directory, sbx_ver, recursively = False, raid
     for file in list_of_files:
         if not str(file).endswith(".sbx") and os.path.exists(file+".sbx"):
             files_to_check.append(file)
+
+    #the ledger is only kept if asked for, so plain checks leave no traces
+    db = None
+    if incremental or ledger:
+        if not ledger:
+            ledger = os.path.join(path_to_directory, LEDGER_FILENAME)
+        db = Ledger(ledger)
+    files_skipped = 0
         
     for file in files_to_check:
+        if db:
+            signature = get_signature(file)
+            entry = db.GetEntry(os.path.abspath(file))
+            #unchanged since the last verification and not too old to trust
+            if incremental and entry and entry["signature"] == signature:
+                if max_age is None or time.time() - entry["verified"] < max_age:
+                    files_skipped += 1
+                    continue
+
+        if repair:
+            report = sbxdec.repair_container(file+".sbx", sbx_ver=sbx_ver, raid=raid)
+            if not report["healthy"]:
+                print("'%s':" % (file+".sbx"))
+                sbxdec.print_repair_report(report)
+                if db:
+                    signature = get_signature(file)
         
-        hash_of_file = get_hash_of_normal_file(file)
-        hash_inside_sbx_file = get_hash_of_sbx_file(file+".sbx", sbx_version=sbx_ver)
+        tree = sbxmerkle.load(file+".sbx", sbx_ver=sbx_ver, raid=raid)
+        if tree:
+            #the leaves are hashed in parallel, and a mismatch says where the damage is
+            bad = tree.verify_range(file, threads=os.cpu_count() or 1)
+            for leafnum in bad:
+                start, end = tree.span(range(leafnum, leafnum+1))
+                print("'%s': bytes %i-%i do not match" % (file, start, end - 1))
+            hash_inside_sbx_file = tree.root
+            hash_of_file = b"" if bad else tree.root
+        else:
+            hash_of_file = get_hash_of_normal_file(file)
+            hash_inside_sbx_file = get_hash_of_sbx_file(file+".sbx", sbx_version=sbx_ver)
         
         if hash_of_file != hash_inside_sbx_file:
             files_needing_repair.append(file)
+            if db:
+                db.RemoveEntry(os.path.abspath(file))
+        elif db:
+            db.SetEntry(os.path.abspath(file), signature, hash_of_file, hash_inside_sbx_file)
+
+    if db:
+        db.close()
+        if files_skipped:
+            print("%i unchanged files skipped" % files_skipped)
     
     if len(files_needing_repair) == 0:
         return print("All Files are correct, no need to repair")
@@ -196,29 +267,19 @@ def check_whole_directory(path_to_directory, sbx_ver, recursively = False, raid
             sbxdec.decode(file+".sbx",filename=file,sbx_ver=sbx_ver, overwrite=True,raid=raid,password=password)
     
 def main():
-    supported_sbx_versions = [1,2]
     cmdline = get_cmdline()
-    if not supported_sbx_versions.__contains__(cmdline.sbxver):
-        return print("sbx version not supported")
-    if cmdline.folder == None:
-        return print("Folder argument is necessary")
-    if not cmdline.recursive:
-        
-        check_whole_directory(cmdline.folder,cmdline.sbxver,raid=cmdline.raid,password=cmdline.password)
-    else:
-        check_whole_directory(cmdline.folder,cmdline.sbxver, cmdline.recursive,raid=cmdline.raid,password=cmdline.password)
-def check(folder,sbxver=1,recursive=False,raid=False,password="",auto=False):
-    supported_sbx_versions = [1,2]
+    max_age = cmdline.max_age * 24*60*60 if cmdline.max_age is not None else None
+    check(cmdline.folder, cmdline.sbxver, cmdline.recursive, raid=cmdline.raid,
+          password=cmdline.password, auto=cmdline.auto, incremental=cmdline.incremental,
+          max_age=max_age, ledger=cmdline.ledger, repair=cmdline.repair)
 
-    if not supported_sbx_versions.__contains__(sbxver):
+def check(folder,sbxver=1,recursive=False,raid=False,password="",auto=False,incremental=False,max_age=None,ledger=None,repair=False):
+    if not seqbox.supported_vers.__contains__(sbxver):
         return print("sbx version not supported")
     if folder == None:
         return print("Folder argument is necessary")
-    if not recursive:
-        
-        check_whole_directory(folder,sbxver,raid=raid,password=password,auto=auto)
-    else:
-        check_whole_directory(folder,sbxver, recursive,raid=raid,password=password, auto=auto)
+    check_whole_directory(folder, sbxver, recursive, raid=raid, password=password, auto=auto,
+                          incremental=incremental, max_age=max_age, ledger=ledger, repair=repair)
 
 
 
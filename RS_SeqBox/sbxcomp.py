@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import zlib
+import lzma
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
+
+#the data is compressed in chunks, each stored as a frame that decompresses on its
+#own: compressed length (4 bytes), plain length (4 bytes), compressed data
+FRAME_HDR = 8
+DEFAULT_CHUNK = 1024*1024
+MAX_CHUNK = 64*1024*1024
+#codec id stored in the CMP tag of the header
+CODECS = {"zlib":1, "lzma":2, "zstd":3}
+CODEC_NAMES = {num:name for name, num in CODECS.items()}
+
+def available():
+    """Codecs that can be used here"""
+    return [name for name in CODECS if name != "zstd" or zstandard]
+
+def compress(codec, data):
+    if codec == "zlib":
+        return zlib.compress(data, 6)
+    if codec == "lzma":
+        return lzma.compress(data, preset=6)
+    if codec == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise seqbox.SbxError("compression '%s' not available" % codec)
+
+def decompress(codec, data):
+    try:
+        if codec == "zlib":
+            return zlib.decompress(data)
+        if codec == "lzma":
+            return lzma.decompress(data)
+        if codec == "zstd" and zstandard:
+            return zstandard.ZstdDecompressor().decompress(data)
+    except (zlib.error, lzma.LZMAError) as err:
+        raise seqbox.SbxDecodeError("compressed chunk can not be decoded: %s" % err)
+    except Exception as err:
+        if zstandard and isinstance(err, zstandard.ZstdError):
+            raise seqbox.SbxDecodeError("compressed chunk can not be decoded: %s" % err)
+        raise
+    raise seqbox.SbxError("compression '%s' not available" % codec)
+
+def check_codec(codec, chunksize=DEFAULT_CHUNK):
+    """Error message for a compression setting that can not be used"""
+    if codec not in CODECS:
+        return "compression must be one of %s" % ", ".join(CODECS)
+    if codec not in available():
+        return "compression '%s' needs the zstandard module" % codec
+    if not 1 <= chunksize <= MAX_CHUNK:
+        return "compression chunk size must be between 1 and %i bytes" % MAX_CHUNK
+    return ""
+
+def codec_name(codecid):
+    if codecid not in CODEC_NAMES:
+        raise seqbox.SbxDecodeError("compression %i not supported" % codecid)
+    return CODEC_NAMES[codecid]
+
+class CompressedReader():
+    """Read side of a file as a stream of compressed frames; the plain data read is
+    also fed to the hashers, so it can be hashed in the same pass"""
+
+    def __init__(self, fin, codec, chunksize=DEFAULT_CHUNK, hashers=()):
+        self.fin = fin
+        self.codec = codec
+        self.chunksize = chunksize
+        self.hashers = hashers
+        self.plainsize = 0
+        #frames not read yet start at pos
+        self.pending = bytearray()
+        self.pos = 0
+        self.eof = False
+
+    def read(self, size):
+        while len(self.pending) - self.pos < size and not self.eof:
+            chunk = self.fin.read(self.chunksize)
+            if not chunk:
+                self.eof = True
+                break
+            self.plainsize += len(chunk)
+            for hasher in self.hashers:
+                hasher.update(chunk)
+            packed = compress(self.codec, chunk)
+            del self.pending[:self.pos]
+            self.pos = 0
+            self.pending += (len(packed).to_bytes(4, byteorder='big') +
+                             len(chunk).to_bytes(4, byteorder='big') + packed)
+        buffer = bytes(self.pending[self.pos:self.pos+size])
+        self.pos += len(buffer)
+        return buffer
+
+    def close(self):
+        self.fin.close()
+
+class Decompressor():
+    """Turn the stored data back into the plain data, fed in pieces of any size"""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.pending = bytearray()
+
+    def feed(self, data):
+        self.pending += data
+        out = []
+        while len(self.pending) >= FRAME_HDR:
+            length = int.from_bytes(self.pending[:4], byteorder='big')
+            if len(self.pending) < FRAME_HDR + length:
+                break
+            out.append(decompress(self.codec, bytes(self.pending[FRAME_HDR:FRAME_HDR+length])))
+            del self.pending[:FRAME_HDR+length]
+        return b"".join(out)
+
+    def finish(self):
+        if self.pending:
+            raise seqbox.SbxDecodeError("compressed data ends in the middle of a chunk")
+
+def read_range(read_stored, codec, storedsize, offset, length):
+    """Plain bytes offset..offset+length, reading the stored data with
+    read_stored(offset, length): only the frame headers before the range and the
+    frames holding it are read"""
+    out = []
+    end = offset + length
+    pos = 0
+    plainpos = 0
+    while plainpos < end and pos + FRAME_HDR <= storedsize:
+        header = read_stored(pos, FRAME_HDR)
+        packed = int.from_bytes(header[:4], byteorder='big')
+        plain = int.from_bytes(header[4:8], byteorder='big')
+        if plainpos + plain > offset:
+            data = decompress(codec, read_stored(pos + FRAME_HDR, packed))
+            if len(data) != plain:
+                raise seqbox.SbxDecodeError("chunk at %i has the wrong size" % pos)
+            out.append(data[max(0, offset - plainpos):end - plainpos])
+        pos += FRAME_HDR + packed
+        plainpos += plain
+    return b"".join(out)
@@ -24,13 +24,14 @@
 #A part of this Software is based on the work of Marco Pontello
 #The base is located at https://github.com/MarcoPon/SeqBox/
 #----------------------------------------------------------------------------------
-import creedsolo.creedsolo as crs
 import os
 import sys
 import hashlib
 import argparse
 import binascii
+import json
 import time
+import contextlib
 try:
     import RS_SeqBox.seqbox as seqbox
 except ImportError:
@@ -39,6 +40,22 @@ try:
     import seqbox as seqbox
 except ImportError:
     pass
+try:
+    import RS_SeqBox.sbxpar as sbxpar
+except ImportError:
+    pass
+try:
+    import sbxpar as sbxpar
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxcomp as sbxcomp
+except ImportError:
+    pass
+try:
+    import sbxcomp as sbxcomp
+except ImportError:
+    pass
 
 PROGRAM_VER = "1.0.2"
 
@@ -53,9 +70,15 @@ def get_cmdline():
                         'Decoder v%s - (C) 2017 by M.Pontello' % PROGRAM_VER) 
     parser.add_argument("sbxfilename", action="store", help="SBx container")
     parser.add_argument("filename", action="store", nargs='?', 
-                        help="target/decoded file")
+                        help="target/decoded file, - for stdout")
     parser.add_argument("-t","--test", action="store_true", default=False,
                         help="test container integrity")
+    parser.add_argument("-f","--fast", action="store_true", default=False,
+                        help="test only checking the blocks, without decoding the payload")
+    parser.add_argument("-j","--json", action="store_true", default=False,
+                        help="print the fast test report as JSON")
+    parser.add_argument("-r","--repair", action="store_true", default=False,
+                        help="rewrite damaged blocks of the container (and raid) in place")
     parser.add_argument("-i", "--info", action="store_true", default=False,
                         help="show informations/metadata")
     parser.add_argument("-o", "--overwrite", action="store_true", default=False,
@@ -66,6 +89,9 @@ def get_cmdline():
                         help="SBX blocks version", metavar="n")
     parser.add_argument("-p", "--password", type=str, default="",
                         help="decrypt with password", metavar="pass")
+    parser.add_argument("-rg", "--range", type=int, nargs=2, default=None,
+                        help="decode only length bytes from offset (default target: " +
+                        "sbxfilename.range)", metavar=("offset", "length"))
     res = parser.parse_args()
     return res
 
@@ -76,8 +102,280 @@ def errexit(errlev=1, mess=""):
                          (os.path.split(sys.argv[0])[1], mess))
     sys.exit(errlev)
 
-def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test=False,cont=False,sbx_ver=1, raid=False):
+def decode_block(sbx, buffer):
+    """RS decode a raw block, clean blocks are not passed through the decoder"""
+    return sbx.rs_decode(buffer)
+
+def decode_checked_block(sbx, buffer, blocknum=None):
+    """RS decode a raw block and check its CRC, a miscorrection is an error too"""
+    message = sbx.rs_decode(buffer)
+    if not sbx.is_valid(message, blocknum):
+        raise seqbox.ReedSolomonError("block decoded to invalid data")
+    return message
+
+def check_block(sbx, buffer, blocknum=None):
+    """Tell if a raw block is clean, correctable or lost"""
+    if len(buffer) < sbx.blocksize:
+        return "lost"
+    message = sbx.clean_message(buffer)
+    if message is not None:
+        if sbx.is_valid(message, blocknum):
+            return "clean"
+        return "lost"
+    try:
+        message = sbx.rs_decode(buffer)
+    except seqbox.ReedSolomonError:
+        return "lost"
+    #too many errors can also be "corrected" into a wrong codeword
+    if not sbx.is_valid(bytes(message), blocknum):
+        return "lost"
+    return "correctable"
+
+def verify(sbxfilename, sbx_ver=1, raid=False):
+    """Build a damage map of a container (and its raid twin) without decoding the payload"""
+    sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver, raid=raid)
+    blockcount = os.path.getsize(sbxfilename) // sbx.blocksize
+    copies = {"primary":sbxfilename}
+    if raid and os.path.exists(sbxfilename+".raid"):
+        copies["raid"] = sbxfilename+".raid"
+
+    metadata = seqbox.read_metadata(sbxfilename, sbx, raid)
+    interleave = metadata.get("interleave", 1)
+    datablocks = seqbox.data_blocks(metadata, sbx)
+
+    report = {"sbxfilename":sbxfilename, "version":sbx.ver,
+              "blocksize":sbx.blocksize, "blocks":blockcount}
+    if interleave > 1:
+        report["interleave"] = interleave
+    if datablocks is not None:
+        report["datablocks"] = datablocks
+    for copy, path_to_file in copies.items():
+        damage = {"clean":0, "correctable":[], "lost":[]}
+        blocknum = 0
+        with open(path_to_file, "rb", buffering=1024*1024) as fin:
+            for buffer in sbx.read_blocks(fin, interleave, datablocks):
+                if blocknum >= blockcount:
+                    break
+                result = check_block(sbx, buffer, seqbox.expected_blocknum(blocknum, blockcount, datablocks))
+                if result == "clean":
+                    damage["clean"] += 1
+                else:
+                    damage[result].append(blocknum)
+                blocknum += 1
+        #a short copy lost its tail
+        damage["lost"].extend(range(blocknum, blockcount))
+        report[copy] = damage
+
+    unrecoverable = set(report["primary"]["lost"])
+    if "raid" in report:
+        unrecoverable &= set(report["raid"]["lost"])
+    parity = sbxpar.Parity.open(sbxfilename, sbx, metadata, raid)
+    if parity:
+        #blocks lost in every copy can still be rebuilt from the rest of their group
+        lost_records = parity.lost_records()
+        rebuilt, unrecoverable = parity.recoverable(sorted(unrecoverable), lost_records)
+        report["parity"] = {"lost":len(lost_records), "rebuildable":rebuilt}
+    report["unrecoverable"] = sorted(unrecoverable)
+    report["recoverable"] = len(unrecoverable) == 0
+    report["healthy"] = all(not report[copy]["correctable"] and not report[copy]["lost"]
+                            for copy in copies)
+    if parity and lost_records:
+        report["healthy"] = False
+    return report
+
+def print_report(report, use_json=False):
+    if use_json:
+        print(json.dumps(report))
+        return
+    print("blocks: %i" % report["blocks"])
+    for copy in ("primary", "raid"):
+        if copy in report:
+            damage = report[copy]
+            print("  %s: %i clean, %i correctable, %i lost" %
+                  (copy, damage["clean"], len(damage["correctable"]), len(damage["lost"])))
+    if "parity" in report:
+        print("  parity: %i damaged parity blocks, %i blocks can be rebuilt" %
+              (report["parity"]["lost"], len(report["parity"]["rebuildable"])))
+    if report["healthy"]:
+        print("container is healthy")
+    elif report["recoverable"]:
+        print("container is damaged but recoverable")
+    else:
+        print("unrecoverable blocks: %s" % report["unrecoverable"])
+
+def repair_container(sbxfilename, sbx_ver=1, raid=False):
+    """Rewrite the damaged blocks of a container and its raid twin in place"""
+    report = verify(sbxfilename, sbx_ver=sbx_ver, raid=raid)
+    sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver, raid=raid)
+    copies = {"primary":sbxfilename}
+    if "raid" in report:
+        copies["raid"] = sbxfilename+".raid"
+    damaged = {}
+    for copy in copies:
+        damaged[copy] = set(report[copy]["correctable"]) | set(report[copy]["lost"])
+
+    report["repaired"] = []
+    #interleaved blocks are only rewritten a whole group at a time
+    interleave = report.get("interleave", 1)
+    datablocks = report.get("datablocks")
+    parity = None
+    if "parity" in report:
+        parity = sbxpar.Parity.open(sbxfilename, sbx, seqbox.read_metadata(sbxfilename, sbx, raid), raid)
+    alldamaged = set().union(*damaged.values())
+    handles = {copy:open(path_to_file, "r+b") for copy, path_to_file in copies.items()}
+    for start in sorted({seqbox.group_start(blocknum, interleave, datablocks) for blocknum in alldamaged}):
+        count = seqbox.group_size(start, interleave, report["blocks"], datablocks)
+        groups = {}
+        for copy in copies:
+            handles[copy].seek(start * sbx.blocksize)
+            buffer = handles[copy].read(count * sbx.blocksize)
+            #a copy cut short in this group has no block to trust
+            groups[copy] = sbx.deinterleave(buffer, count) if len(buffer) == count * sbx.blocksize else [None] * count
+        changed = set()
+        for blocknum in range(start, start + count):
+            if blocknum not in alldamaged:
+                continue
+            #take the message from the first copy where it can still be decoded
+            block = None
+            for copy in copies:
+                if blocknum in report[copy]["lost"] or groups[copy][blocknum-start] is None:
+                    continue
+                try:
+                    message = decode_block(sbx, groups[copy][blocknum-start])
+                except seqbox.ReedSolomonError:
+                    continue
+                if sbx.is_valid(message, seqbox.expected_blocknum(blocknum, report["blocks"], datablocks)):
+                    block = sbx.rs_encode(message)
+                    break
+            if block is None and parity and blocknum in report["parity"]["rebuildable"]:
+                try:
+                    block = parity.block(blocknum)
+                except seqbox.ReedSolomonError:
+                    pass
+            if block is None:
+                continue
+            for copy in copies:
+                if blocknum in damaged[copy]:
+                    groups[copy][blocknum-start] = block
+                    changed.add(copy)
+            report["repaired"].append(blocknum)
+        for copy in changed:
+            if None in groups[copy]:
+                continue
+            handles[copy].seek(start * sbx.blocksize)
+            handles[copy].write(sbx.interleave(groups[copy]))
+    for handle in handles.values():
+        handle.close()
+    if parity and report["parity"]["lost"]:
+        for groupnum in sorted(set(parity.lost_records())):
+            try:
+                parity.rewrite_records(groupnum)
+            except seqbox.ReedSolomonError:
+                continue
+            report["parity"]["repaired"] = report["parity"].get("repaired", 0) + 1
+    return report
+
+def print_repair_report(report):
+    if report["healthy"]:
+        print("no damaged blocks")
+        return
+    print("repaired blocks: %i" % len(report["repaired"]))
+    if report["unrecoverable"]:
+        print("unrecoverable blocks: %s" % report["unrecoverable"])
+
+def decode_range(sbxfilename, offset, length, fout=None, sbx_ver=1, raid=False, password=""):
+    """Decode only the bytes offset..offset+length of the original file: just the
+    blocks (or interleaving groups) holding them are read and checked, from the
+    primary, the raid copy or the parity. The bytes are returned, or written to
+    fout and their count returned"""
+    if offset < 0 or length < 0:
+        raise seqbox.SbxError("negative offset or length")
+    sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver, raid=raid)
+    metadata = seqbox.read_metadata(sbxfilename, sbx, raid)
+    if seqbox.data_blocks(metadata, sbx) is None:
+        raise seqbox.SbxDecodeError("size of the file in '%s' is not known" % sbxfilename)
+    if "compression" in metadata:
+        #only the frame headers before the range and the frames holding it are decoded
+        def read_stored(pos, size):
+            return read_stored_range(sbx, metadata, sbxfilename, pos, size, raid=raid, password=password)
+        data = sbxcomp.read_range(read_stored, sbxcomp.codec_name(metadata["compression"][0]),
+                                  metadata["filesize"], offset, length)
+        if fout:
+            fout.write(data)
+            return len(data)
+        return data
+    return read_stored_range(sbx, metadata, sbxfilename, offset, length, fout, raid, password)
+
+def read_stored_range(sbx, metadata, sbxfilename, offset, length, fout=None, raid=False, password=""):
+    """Bytes offset..offset+length of the data stored in the blocks of a container"""
+    datablocks = seqbox.data_blocks(metadata, sbx)
+    raw = sbx.raw_data_size_read_into_1_block
+    end = min(offset + length, metadata["filesize"])
+    out = []
+    written = 0
+    if offset >= end:
+        return 0 if fout else b""
+    first = 1 + offset // raw
+    last = 1 + (end - 1) // raw
+
+    interleave = metadata.get("interleave", 1)
+    blockcount = os.path.getsize(sbxfilename) // sbx.blocksize
+    paths = [sbxfilename] + ([sbxfilename+".raid"] if raid and os.path.exists(sbxfilename+".raid") else [])
+    handles = [open(path_to_file, "rb") for path_to_file in paths]
+    parity = None
+    if password:
+        encdec = seqbox.EncDec(password, raw, sbx.ver)
+    try:
+        start = seqbox.group_start(first, interleave, datablocks)
+        while start <= last:
+            count = seqbox.group_size(start, interleave, blockcount, datablocks)
+            #the copies are only read when the ones before them fail
+            groups = [None] * len(handles)
+            for blocknum in range(max(start, first), min(start + count - 1, last) + 1):
+                message = None
+                for i, handle in enumerate(handles):
+                    if groups[i] is None:
+                        handle.seek(start * sbx.blocksize)
+                        buffer = handle.read(count * sbx.blocksize)
+                        groups[i] = (sbx.deinterleave(buffer, count)
+                                     if len(buffer) == count * sbx.blocksize else [b""] * count)
+                    if len(groups[i][blocknum-start]) < sbx.blocksize:
+                        continue
+                    try:
+                        message = decode_checked_block(sbx, groups[i][blocknum-start], blocknum)
+                        break
+                    except seqbox.ReedSolomonError:
+                        continue
+                if message is None:
+                    if parity is None:
+                        parity = sbxpar.Parity.open(sbxfilename, sbx, metadata, raid) or False
+                    try:
+                        if not parity:
+                            raise seqbox.ReedSolomonError("no parity")
+                        message = decode_block(sbx, parity.block(blocknum))
+                    except seqbox.ReedSolomonError:
+                        raise seqbox.SbxDecodeError("block %i of '%s' can not be recovered" %
+                                                    (blocknum, sbxfilename))
+                data = message[16:16+raw]
+                if password:
+                    data = encdec.xor(data)
+                blockoffset = (blocknum - 1) * raw
+                data = data[max(0, offset - blockoffset):end - blockoffset]
+                if fout:
+                    fout.write(data)
+                    written += len(data)
+                else:
+                    out.append(data)
+            start += count
+    finally:
+        for handle in handles:
+            handle.close()
+    return written if fout else b"".join(out)
+
+def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test=False,cont=False,sbx_ver=1, raid=False, fast=False, repair=False, fout=None):
     sbxfilename = sbxfilename
+    #the decoded data can also go to an open stream instead of a file
+    stream = fout is not None
     filename = filename
 
     if os.path.isdir(sbxfilename):
@@ -86,6 +384,13 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
     
     if not os.path.exists(sbxfilename):
         errexit(1, "sbx file '%s' not found" % (sbxfilename))
+    if fast:
+        report = verify(sbxfilename, sbx_ver=sbx_ver, raid=raid)
+        print_report(report)
+        return report
+    if repair:
+        report = repair_container(sbxfilename, sbx_ver=sbx_ver, raid=raid)
+        print_repair_report(report)
     sbxfilesize = os.path.getsize(sbxfilename)
     
     print("decoding '%s'..." % (sbxfilename))
@@ -98,7 +403,10 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
     fin.seek(0, 0)
     
     sbxver = sbx_ver
-    sbx = seqbox.SbxBlock(ver=sbxver)
+    try:
+        sbx = seqbox.block_for_file(sbxfilename, ver=sbxver, raid=raid_exists)
+    except seqbox.SbxDecodeError as err:
+        errexit(1, str(err))
     metadata = {}
     
     hashtype = 0
@@ -111,18 +419,15 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
     buffer = fin.read(sbx.blocksize)
     if raid_exists:
         buffer_raid = fin_raid.read(sbx.blocksize)
-    #set symbols for reed solomon
-
-    rsc_for_header_block = crs.RSCodec(sbx.redsym)
     #decode header with reed solomon
     try:
-        buffer=bytes(rsc_for_header_block.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
-    except crs.ReedSolomonError:
+        buffer = sbx.rs_decode(buffer)
+    except seqbox.ReedSolomonError:
         #trying Raid copy
         if raid_exists:
             try:
-                buffer=bytes(rsc_for_header_block.decode(bytearray(buffer_raid[:-sbx.padding_normal_block]))[0])
-            except crs.ReedSolomonError:
+                buffer = sbx.rs_decode(buffer_raid)
+            except seqbox.ReedSolomonError:
                 pass
 
     sbx.decode(buffer)
@@ -153,6 +458,25 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
         print("  file size: %i bytes" % (sbxfilesize))
         print("  blocks: %i" % (sbxfilesize / sbx.blocksize))
         print("  version: %i" % (sbx.ver))
+        if sbx.ver >= 3:
+            print("  block size: %i - ECC symbols: %i" % (sbx.blocksize, sbx.redsym))
+        if metadata.get("interleave", 1) > 1:
+            print("  interleaved in groups of %i blocks" % (metadata["interleave"]))
+        if "parity" in metadata:
+            print("  parity: %i blocks for every %i data blocks" %
+                  (metadata["parity"][1], metadata["parity"][0]))
+        sbxindex = seqbox.read_index(sbxfilename, sbx, raid_exists)
+        if sbxindex:
+            print("  index: %i blocks - %i data blocks - %i hashes of %i blocks" %
+                  (sbxindex.indexblocks, sbxindex.datablocks,
+                   len(sbxindex.hashes or []), sbxindex.hashgroup))
+        if "compression" in metadata:
+            codecid, chunksize, plainsize = metadata["compression"]
+            print("  compressed: %s in chunks of %i bytes - %i bytes before compression" %
+                  (sbxcomp.CODEC_NAMES.get(codecid, "unknown"),
+                   chunksize, plainsize))
+        if "merkle" in metadata:
+            print("  Merkle root: %s" % (binascii.hexlify(metadata["merkle"][2:]).decode()))
         print("  UID: %s" % (binascii.hexlify(sbx.uid).decode()))
         if metadata:
             print("metadata:")
@@ -180,10 +504,13 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
         sys.exit(0) 
 
     #evaluate target filename
-    if not test:
+    if not test and not stream:
         if not filename:
             if "filename" in metadata:
                 filename = metadata["filename"]
+                if not os.path.isabs(filename):
+                    print("warning: file name '%s' in the header is not absolute, "
+                          "decoding relative to the current directory" % filename)
             else:
                 filename = os.path.split(sbxfilename)[1] + ".out"
         elif os.path.isdir(filename):
@@ -214,25 +541,46 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
         count_of_blocks = (metadata["filesize"] - (metadata["filesize"] % sbx.raw_data_size_read_into_1_block)) / sbx.raw_data_size_read_into_1_block
     
     if password:
-        encdec = seqbox.EncDec(password, sbx.raw_data_size_read_into_1_block)
+        encdec = seqbox.EncDec(password, sbx.raw_data_size_read_into_1_block, sbx.ver)
+    interleave = metadata.get("interleave", 1)
+    decompressor = None
+    if "compression" in metadata:
+        try:
+            decompressor = sbxcomp.Decompressor(sbxcomp.codec_name(metadata["compression"][0]))
+        except seqbox.SbxError as err:
+            errexit(1, str(err))
+    parity = sbxpar.Parity.open(sbxfilename, sbx, metadata, raid_exists)
+    datablocks = seqbox.data_blocks(metadata, sbx)
+    blocks = sbx.read_blocks(fin, interleave, datablocks)
+    if raid_exists:
+        blocks_raid = sbx.read_blocks(fin_raid, interleave, datablocks)
     while True:
-        buffer = fin.read(sbx.blocksize)
+        #the index blocks after the data are not part of the file
+        if datablocks is not None and blocknumber >= datablocks:
+            break
+        buffer = next(blocks, b"")
         if raid_exists:
-            buffer_raid = fin_raid.read(sbx.blocksize)
+            buffer_raid = next(blocks_raid, b"")
             
         if len(buffer) < sbx.blocksize:
             break
         try:
             blocknumber+=1
-            if raid_exists:
-                try:
-                    buffer = bytes(sbx.rsc_for_data_block.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
-                except crs.ReedSolomonError:
-                    #trying Raid copy
-                    if raid_exists:
-                            buffer = bytes(sbx.rsc_for_data_block.decode(bytearray(buffer_raid[:-sbx.padding_normal_block]))[0])
-            else:
-                    buffer = bytes(sbx.rsc_for_data_block.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
+            try:
+                if raid_exists:
+                    try:
+                        buffer = decode_checked_block(sbx, buffer)
+                    except seqbox.ReedSolomonError:
+                        #trying Raid copy
+                        if raid_exists:
+                                buffer = decode_checked_block(sbx, buffer_raid)
+                else:
+                        buffer = decode_checked_block(sbx, buffer)
+            except seqbox.ReedSolomonError:
+                if not parity:
+                    raise
+                #lost in every copy, rebuild it from the rest of its parity group
+                buffer = decode_block(sbx, parity.block(blocknumber))
             
             #Decode with password if necessary
             if password:
@@ -255,10 +603,13 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
                     errexit(errlev=1, mess="block %i out of order or missing"
                              % (lastblocknum+1))    
             lastblocknum += 1
+            data = sbx.data
+            if decompressor:
+                data = decompressor.feed(data)
             if hashcheck:
-                d.update(sbx.data) 
+                d.update(data) 
             if not test:
-                fout.write(sbx.data)
+                fout.write(data)
 
         except seqbox.SbxDecodeError as err:
             if cont:
@@ -276,15 +627,22 @@ def decode(sbxfilename,filename=None,password="",overwrite=False,info=False,test
             updatetime = time.time() + .1
 
     fin.close()
-    if raid: 
+    if raid_exists: 
         fin_raid.close()
-    if not test:
+    if not test and stream:
+        fout.flush()
+    elif not test:
         fout.close()
         if metadata:
             if "filedatetime" in metadata:
                 os.utime(filename,
                          (int(time.time()), metadata["filedatetime"]))
 
+    if decompressor:
+        try:
+            decompressor.finish()
+        except seqbox.SbxError as err:
+            errexit(1, str(err))
     print("SBX decoding complete")
     if blockmiss:
         errexit(1, "missing blocks: %i" % blockmiss)
@@ -318,222 +676,40 @@ def decode_whole_directory(path_to_directory):
                      
 def main():
     cmdline = get_cmdline()
-    sbxfilename = cmdline.sbxfilename
-    filename = cmdline.filename
-    if os.path.isdir(sbxfilename):
-        decode_whole_directory(sbxfilename)
-        return
-    
-    if not os.path.exists(sbxfilename):
-        errexit(1, "sbx file '%s' not found" % (sbxfilename))
-    sbxfilesize = os.path.getsize(sbxfilename)
-    
-    print("decoding '%s'..." % (sbxfilename))
-    fin = open(sbxfilename, "rb", buffering=1024*1024)
-    raid_exists = os.path.exists(sbxfilename+".raid") and cmdline.raid == True
-
-    if raid_exists:
-        fin_raid = open(sbxfilename+".raid", "rb", buffering=1024*1024)
-        fin_raid.seek(0,0)
-    fin.seek(0, 0)
-    
-    sbxver = cmdline.sbxver
-    sbx = seqbox.SbxBlock(ver=sbxver)
-    metadata = {}
-    
-    hashtype = 0
-    hashlen = 0
-    hashdigest = b""
-    hashcheck = False
-
-    #read in bytes
-
-    buffer = fin.read(sbx.blocksize)
-    if raid_exists:
-        buffer_raid = fin_raid.read(sbx.blocksize)
-    #set symbols for reed solomon
-
-    rsc_for_header_block = crs.RSCodec(sbx.redsym)
-    #decode header with reed solomon
-    try:
-        buffer=bytes(rsc_for_header_block.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
-    except crs.ReedSolomonError:
-        #trying Raid copy
-        if raid_exists:
-            try:
-                buffer=bytes(rsc_for_header_block.decode(bytearray(buffer_raid[:-sbx.padding_normal_block]))[0])
-            except crs.ReedSolomonError:
-                pass
-
-    sbx.decode(buffer)
-
-    if sbx.blocknum > 1:
-        return print("blocks missing or out of order")
-    elif sbx.blocknum == 0:
-        print("metadata block found!")
-        metadata = sbx.metadata
-        if "filesize" in metadata:
-            trimfilesize = True
-        if "hash" in metadata:
-            hashtype = metadata["hash"][0]
-            if hashtype == 0x12:
-                hashlen = metadata["hash"][1]
-                hashdigest = metadata["hash"][2:2+hashlen]
-                hashcheck = True
+    if cmdline.fast:
+        if not os.path.exists(cmdline.sbxfilename):
+            errexit(1, "sbx file '%s' not found" % (cmdline.sbxfilename))
+        report = verify(cmdline.sbxfilename, sbx_ver=cmdline.sbxver, raid=cmdline.raid)
+        print_report(report, use_json=cmdline.json)
+        errexit(0 if report["recoverable"] else 1)
+    if cmdline.filename == "-":
+        #the data goes to stdout, so everything else goes to stderr
+        stdout = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            decode_main(cmdline, stdout)
     else:
-        #first block is data, so reset from the start
-        print("no metadata available")
-        fin.seek(0, 0)
-        if raid_exists:
-            fin_raid.seek(0,0)
-
-    #display some info and stop
-    if cmdline.info:
-        print("\nSeqBox container info:")
-        print("  file size: %i bytes" % (sbxfilesize))
-        print("  blocks: %i" % (sbxfilesize / sbx.blocksize))
-        print("  version: %i" % (sbx.ver))
-        print("  UID: %s" % (binascii.hexlify(sbx.uid).decode()))
-        if metadata:
-            print("metadata:")
-            if "sbxname" in metadata:
-                print("  SBX name : '%s'" % (metadata["sbxname"]))
-            if "filename" in metadata:
-                print("  file name: '%s'" % (metadata["filename"]))
-            if "filesize" in metadata:
-                print("  file size: %i bytes" % (metadata["filesize"]))
-            if "sbxdatetime" in metadata:
-                print("  SBX date&time : %s" %
-                      (time.strftime("%Y-%m-%d %H:%M:%S",
-                                     time.localtime(metadata["sbxdatetime"]))))
-            if "filedatetime" in metadata:
-                print("  file date&time: %s" %
-                      (time.strftime("%Y-%m-%d %H:%M:%S",
-                                     time.localtime(metadata["filedatetime"]))))
-            if "hash" in metadata:
-                if hashtype == 0x12:
-                    print("  SHA256: %s" % (binascii.hexlify(
-                        hashdigest).decode()))
-                else:
-                    print("hash type not recognized!")
-            
-        sys.exit(0) 
-
-    #evaluate target filename
-    if not cmdline.test:
-        if not filename:
-            if "filename" in metadata:
-                filename = metadata["filename"]
-            else:
-                filename = os.path.split(sbxfilename)[1] + ".out"
-        elif os.path.isdir(filename):
-            if "filename" in metadata:
-                filename = os.path.join(filename, metadata["filename"])
-                
-            else:
-                filename = os.path.join(filename,
-                                        os.path.split(sbxfilename)[1] + ".out")
-
-        if os.path.exists(filename) and not cmdline.overwrite:
-            errexit(1, "target file '%s' already exists!" % (filename)) 
-        print("creating file '%s'..." % (filename))
-        fout= open(filename, "wb", buffering=1024*1024)
-
-    if hashtype == 0x12:
-        d = hashlib.sha256()
-    lastblocknum = 0
-
-    blockmiss = 0
-    updatetime = time.time()
-    blocknumber=0 
-
-    #calculate hot many blocks there are in the file
-    if metadata["filesize"] % sbx.raw_data_size_read_into_1_block == 0:
-        count_of_blocks = metadata["filesize"] / sbx.raw_data_size_read_into_1_block
-    else:
-        count_of_blocks = (metadata["filesize"] - (metadata["filesize"] % sbx.raw_data_size_read_into_1_block)) / sbx.raw_data_size_read_into_1_block
-    
-    if cmdline.password:
-        encdec = seqbox.EncDec(cmdline.password, sbx.raw_data_size_read_into_1_block)
-    while True:
-        buffer = fin.read(sbx.blocksize)
-        if raid_exists:
-            buffer_raid = fin_raid.read(sbx.blocksize)
-            
-        if len(buffer) < sbx.blocksize:
-            break
+        decode_main(cmdline)
+
+def decode_main(cmdline, stdout=None):
+    if cmdline.range:
+        if not os.path.exists(cmdline.sbxfilename):
+            errexit(1, "sbx file '%s' not found" % (cmdline.sbxfilename))
+        filename = cmdline.filename or os.path.split(cmdline.sbxfilename)[1] + ".range"
+        if not stdout and os.path.exists(filename) and not cmdline.overwrite:
+            errexit(1, "target file '%s' already exists!" % (filename))
         try:
-            blocknumber+=1
-            if raid_exists:
-                try:
-                    buffer = bytes(sbx.rsc_for_data_block.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
-                except crs.ReedSolomonError:
-                    #trying Raid copy
-                    if raid_exists:
-                            buffer = bytes(sbx.rsc_for_data_block.decode(bytearray(buffer_raid[:-sbx.padding_normal_block]))[0])
-            else:
-                    buffer = bytes(sbx.rsc_for_data_block.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
-            #Decode with password if necessary
-            if cmdline.password:
-                #only the data was encoded, so only data should be decoded
-                buffer_data = encdec.xor(buffer[16:])
-                buffer = buffer[:16] + buffer_data
-            #LastBlock check
-            if blocknumber == count_of_blocks+1:
-                #cut padding
-                buffer = buffer[:-metadata["padding_last_block"]]
-            
-            sbx.decode(buffer)
-            if sbx.blocknum > lastblocknum+1:
-                if cmdline.cont:
-                    blockmiss += 1
-                    lastblocknum += 1
-                else:
-                    errexit(errlev=1, mess="block %i out of order or missing"
-                             % (lastblocknum+1))    
-            lastblocknum += 1
-            if hashcheck:
-                d.update(sbx.data) 
-            if not cmdline.test:
-                fout.write(sbx.data)
-
-        except seqbox.SbxDecodeError as err:
-            if cmdline.cont:
-                blockmiss += 1
-                lastblocknum += 1
-            else:
-                print(err)
-                #errexit(errlev=1, mess="invalid block at offset %s" %
-                        #(hex(fin.tell()-sbx.blocksize)))
-
-        #some progress report
-        if time.time() > updatetime: 
-            print("  %.1f%%" % (fin.tell()*100.0/sbxfilesize),
-                  end="\r", flush=True)
-            updatetime = time.time() + .1
-
-    fin.close()
-    if cmdline.raid: 
-        fin_raid.close()
-    if not cmdline.test:
-        fout.close()
-        if metadata:
-            if "filedatetime" in metadata:
-                os.utime(filename,
-                         (int(time.time()), metadata["filedatetime"]))
-
-    print("SBX decoding complete")
-    if blockmiss:
-        errexit(1, "missing blocks: %i" % blockmiss)
-
-    if hashcheck:
-        if hashtype == 0x12:
-            print("SHA256", d.hexdigest())
-
-        if d.digest() == hashdigest:
-            print("hash match!")
-        else:
-            errexit(1, "hash mismatch! decoded file corrupted!")
+            with (contextlib.nullcontext(stdout) if stdout else open(filename, "wb")) as fout:
+                written = decode_range(cmdline.sbxfilename, cmdline.range[0], cmdline.range[1],
+                                       fout=fout, sbx_ver=cmdline.sbxver, raid=cmdline.raid,
+                                       password=cmdline.password)
+                fout.flush()
+        except seqbox.SbxError as err:
+            errexit(1, str(err))
+        print("%i bytes written to '%s'" % (written, filename))
+        return
+    decode(cmdline.sbxfilename, filename=cmdline.filename, password=cmdline.password,
+           overwrite=cmdline.overwrite, info=cmdline.info, test=cmdline.test,
+           sbx_ver=cmdline.sbxver, raid=cmdline.raid, repair=cmdline.repair, fout=stdout)
    
             
 if __name__ == '__main__':
@@ -26,7 +26,6 @@
 #The base is located at https://github.com/MarcoPon/SeqBox/
 #----------------------------------------------------------------------------------
 
-import creedsolo.creedsolo as crs
 import os
 import sys
 import hashlib
@@ -44,8 +43,34 @@ try:
     import seqbox as seqbox
 except ImportError:
     pass
+try:
+    import RS_SeqBox.sbxpar as sbxpar
+except ImportError:
+    pass
+try:
+    import sbxpar as sbxpar
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxmerkle as sbxmerkle
+except ImportError:
+    pass
+try:
+    import sbxmerkle as sbxmerkle
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxcomp as sbxcomp
+except ImportError:
+    pass
+try:
+    import sbxcomp as sbxcomp
+except ImportError:
+    pass
 
 PROGRAM_VER = "1.0.2"
+#data encoded in one batch, the Reed-Solomon parity of a batch is computed at once
+ENCODE_BATCH_BYTES = 4*1024*1024
 
 def get_cmdline():
     """Evaluate command line parameters, usage & help."""
@@ -57,7 +82,7 @@ def get_cmdline():
                         version='SeqBox - Sequenced Box container - ' +
                         'Encoder v%s - (C) 2017 by M.Pontello' % PROGRAM_VER) 
     parser.add_argument("filename", action="store", 
-                        help="file to encode")
+                        help="file to encode, - for stdin")
     parser.add_argument("-uid", action="store", default="r", type=str,
                         help="use random or custom UID (up to 12 hexdigits)")
     parser.add_argument("sbxfilename", action="store", nargs='?',
@@ -70,6 +95,27 @@ def get_cmdline():
                         help="SBX blocks version", metavar="n")
     parser.add_argument("-raid", "--raid", action="store_true", default=False,
                         help="Create duplicate sbx File for better recovery")
+    parser.add_argument("-bs", "--blocksize", type=int, default=seqbox.DEFAULT_BLOCKSIZE // 1024,
+                        help="block size in KiB, 64 to 1024 (version 3 only)", metavar="n")
+    parser.add_argument("-rs", "--redsym", type=int, default=seqbox.DEFAULT_REDSYM,
+                        help="ECC symbols per 255 byte codeword (version 3 only)", metavar="n")
+    parser.add_argument("-il", "--interleave", type=int, default=1,
+                        help="spread the bytes of groups of n blocks over each other, " +
+                        "so a burst of damage hits many blocks a little", metavar="n")
+    parser.add_argument("-par", "--parity", type=int, default=0,
+                        help="parity blocks for every group of data blocks, " +
+                        "written to a .par sidecar", metavar="n")
+    parser.add_argument("-pg", "--pargroup", type=int, default=20,
+                        help="data blocks in a parity group", metavar="n")
+    parser.add_argument("-ix", "--index", action="store_true", default=False,
+                        help="append index blocks with the layout and the hashes of the data")
+    parser.add_argument("-mk", "--merkle", action="store_true", default=False,
+                        help="write a Merkle tree of the data to a .mkl sidecar, " +
+                        "so ranges of the file can be verified on their own")
+    parser.add_argument("-c", "--compress", type=str, default=None, choices=list(sbxcomp.CODECS),
+                        help="compress the data in chunks before encoding it")
+    parser.add_argument("-cs", "--chunksize", type=int, default=sbxcomp.DEFAULT_CHUNK // 1024,
+                        help="size of the compressed chunks in KiB", metavar="n")
     parser.add_argument("-verbose", "--verbose", action="store_true", default=False, help="Show extended Information")
     res = parser.parse_args()
     return res
@@ -81,6 +127,12 @@ def errexit(errlev=1, mess=""):
                          (os.path.split(sys.argv[0])[1], mess))
     sys.exit(errlev)
     
+def warn_dropped_names(sbx):
+    """Tell which names did not fit in the header just encoded"""
+    for key in sbx.dropped_names:
+        print("warning: %s '%s' does not fit in the header, it is not stored" %
+              (key, sbx.metadata[key]))
+
 def getsha256(filename):
     """SHA256 used to verify the integrity of the encoded file"""
     with open(filename, mode='rb') as fin:
@@ -89,12 +141,19 @@ def getsha256(filename):
             d.update(buf)
     return d.digest()
 
-def encode(filename,sbxfilename=None,overwrite="False",uid="r",sbx_ver=1, raid=False, password=""):
+def encode(filename,sbxfilename=None,overwrite="False",uid="r",sbx_ver=1, raid=False, password="",
+           blocksize=seqbox.DEFAULT_BLOCKSIZE, redsym=seqbox.DEFAULT_REDSYM, interleave=1,
+           parity=0, pargroup=20, index=False, merkle=False,
+           compression=None, chunksize=sbxcomp.DEFAULT_CHUNK):
     #filename to encode
     filename = filename
     #filename which results from encoding
     sbxfilename = sbxfilename
 
+    #a stream is read once: its size and hash are only known at its end
+    stream = filename == "-"
+    if stream and (not sbxfilename or sbxfilename == "-" or os.path.isdir(sbxfilename)):
+        errexit(1, "encoding stdin needs an SBX file name to write to")
     if not sbxfilename:
         sbxfilename = os.path.split(filename)[1] + ".sbx"
     elif os.path.isdir(sbxfilename):
@@ -111,51 +170,162 @@ def encode(filename,sbxfilename=None,overwrite="False",uid="r",sbx_ver=1, raid=F
         except:
             errexit(1, "invalid UID")
 
-    if not os.path.exists(filename):
+    if not stream and not os.path.exists(filename):
         errexit(1, "file '%s' not found" % (filename))
-    filesize = os.path.getsize(filename)
+    if not 1 <= interleave <= 65535:
+        errexit(1, "interleave must be between 1 and 65535")
+    if compression and sbxcomp.check_codec(compression, chunksize):
+        errexit(1, sbxcomp.check_codec(compression, chunksize))
+    if parity and sbxpar.check_geometry(pargroup, parity):
+        errexit(1, sbxpar.check_geometry(pargroup, parity))
+    try:
+        sbx = seqbox.SbxBlock(uid=uid, ver=sbx_ver, pswd=password, blocksize=blocksize, redsym=redsym)
+    except seqbox.SbxError as err:
+        errexit(1, str(err))
+    filesize = 0 if stream else os.path.getsize(filename)
     fout = open(sbxfilename, "wb", buffering=1024*1024)
 
     #calc hash - before all processing, and not while reading the file,
-    sha256 = getsha256(filename)
-
-    fin = open(filename, "rb", buffering=1024*1024)
+    if stream:
+        #except for a stream, that is hashed while it is read
+        sha256 = bytes(32)
+        d_stream = hashlib.sha256()
+        if merkle:
+            hasher = sbxmerkle.MerkleHasher()
+    elif merkle:
+        #the leaves of the tree are hashed in the same pass
+        sha256, tree = sbxmerkle.hash_file(filename)
+    else:
+        sha256 = getsha256(filename)
+
+    fin = sys.stdin.buffer if stream else open(filename, "rb", buffering=1024*1024)
+    plainsize = filesize
+    if compression:
+        #the frames are read like a stream, the plain data is hashed by the reader;
+        #the file size in the header is the size of the frames, that are in the blocks
+        fin = sbxcomp.CompressedReader(fin, compression, chunksize,
+                                       hashers=([d_stream] + ([hasher] if merkle else [])) if stream else [])
+        filesize = 0
     print("creating file '%s'..." % sbxfilename)
 
-    sbx = seqbox.SbxBlock(uid=uid, ver=sbx_ver, pswd=password)
-
     #write metadata block 0
     sbx.metadata = {"filesize":filesize,
-                        "filename":filename,
                         "sbxname":sbxfilename,
-                        "filedatetime":int(os.path.getmtime(filename)),
+                        "filedatetime":int(gettime() if stream else os.path.getmtime(filename)),
                         "sbxdatetime":int(gettime()),
                         "hash":b'\x12\x20'+sha256,#multihash
                         "padding_last_block":0,} 
+    if not stream:
+        sbx.metadata["filename"] = filename
+    if merkle:
+        #a stream gets the root of its tree when the header is rewritten
+        sbx.metadata["merkle"] = b'\x12\x20' + (bytes(32) if stream else tree.root)
+    if sbx.ver >= 3:
+        #the geometry is also in every block prefix, this is for the humans
+        sbx.metadata["blocksize"] = sbx.blocksize
+        sbx.metadata["redundancy_level"] = sbx.redsym
+    if interleave > 1:
+        sbx.metadata["interleave"] = interleave
+    if parity:
+        sbx.metadata["parity"] = (pargroup, parity)
+    if compression:
+        sbx.metadata["compression"] = (sbxcomp.CODECS[compression], chunksize, plainsize)
     
     fout.write(sbx.encode())
+    if parity:
+        parwriter = sbxpar.ParityWriter(sbxfilename + sbxpar.PAR_EXT, sbx, pargroup, parity)
     
     #write all other blocks
     updatetime = gettime() 
     
     if password:
-        encdec = seqbox.EncDec(password, sbx.raw_data_size_read_into_1_block)
-
+        encdec = seqbox.EncDec(password, sbx.raw_data_size_read_into_1_block, sbx.ver)
+
+    #blocks waiting to be interleaved with the rest of their group
+    group = []
+    #data read but not encoded yet: the blocks are encoded a batch at a time
+    pending = []
+    batchsize = max(1, ENCODE_BATCH_BYTES // sbx.blocksize)
+    def write_pending():
+        for data in sbx.encode_data_blocks(pending):
+            if parity:
+                parwriter.add(data)
+            group.append(data)
+            if len(group) == interleave:
+                fout.write(sbx.interleave(group))
+                group.clear()
+        pending.clear()
+    if index:
+        hashgroup = seqbox.SbxIndex.hashgroup_for(sbx)
+        hashes = []
+        hashblocks = 0
+        d = hashlib.sha256()
+    indexblocks = 0
     while True:
         #Reads data from file 
         buffer = fin.read(sbx.raw_data_size_read_into_1_block)
+        if stream or compression:
+            filesize += len(buffer)
+        if stream and not compression:
+            d_stream.update(buffer)
+            if merkle:
+                hasher.update(buffer)
+        if index and buffer:
+            #hash of the plain data of every hashgroup blocks
+            d.update(buffer)
+            hashblocks += 1
+            if hashblocks == hashgroup:
+                hashes.append(d.digest())
+                d = hashlib.sha256()
+                hashblocks = 0
         
         
         #check if last block or file ended
         if len(buffer) < sbx.raw_data_size_read_into_1_block:
             #if file ended and no more data to be read:
             if len(buffer) == 0:
+                write_pending()
                 #save sbx_blocknum
                 sbx_blocknum_save = sbx.blocknum
                 #set to 0 so when encoding the data will be treated as header block data
                 sbx.blocknum = 0
+                if stream or compression:
+                    sbx.metadata["filesize"] = filesize
+                if compression:
+                    plainsize = fin.plainsize
+                    sbx.metadata["compression"] = (sbxcomp.CODECS[compression], chunksize, plainsize)
+                elif stream:
+                    plainsize = filesize
+                if stream:
+                    sbx.metadata["hash"] = b'\x12\x20' + d_stream.digest()
+                    if merkle:
+                        tree = hasher.tree()
+                        sbx.metadata["merkle"] = b'\x12\x20' + tree.root
+                #write the last, maybe shorter, group
+                if group:
+                    fout.write(sbx.interleave(group))
+                if parity:
+                    parwriter.close()
+                if index:
+                    if hashblocks:
+                        hashes.append(d.digest())
+                    sbxindex = seqbox.SbxIndex(sbx, datablocks=sbx_blocknum_save, filesize=filesize,
+                                               padding=sbx.metadata["padding_last_block"],
+                                               interleave=interleave,
+                                               parity=(pargroup, parity) if parity else (0, 0),
+                                               hashgroup=hashgroup, hashes=hashes)
+                    pieces = sbxindex.encode()
+                    #the first index block is the last block of the file
+                    for i in reversed(range(len(pieces))):
+                        sbx.blocknum = seqbox.INDEX_BLOCKNUM - i
+                        sbx.data = pieces[i]
+                        fout.write(sbx.encode())
+                    indexblocks = len(pieces)
+                    sbx.metadata["index"] = indexblocks
+                    sbx.blocknum = 0
                 #get Header Block behaviour to replace the header block with padding information
                 header_block = sbx.encode()
+                warn_dropped_names(sbx)
                 #close filehandler which was used to write output
                 fout.close()
                 #replace first 512 Bytes with up to date Informationen
@@ -179,153 +349,141 @@ def encode(filename,sbxfilename=None,overwrite="False",uid="r",sbx_ver=1, raid=F
         if password:
             buffer = encdec.xor(buffer)   
 
-        sbx.blocknum += 1
-        sbx.data = buffer
-
-        data = sbx.encode()
-       
-        #write to file
-        fout.write(data)
+        pending.append(buffer)
+        if len(pending) == batchsize:
+            write_pending()
         
         #some progress update
         if gettime() > updatetime:
-            print("%.1f%%" % (fin.tell()*100.0/filesize), " ",
-                  end="\r", flush=True)
+            if stream or compression:
+                print("%i bytes" % filesize, " ", end="\r", flush=True)
+            else:
+                print("%.1f%%" % (fin.tell()*100.0/filesize), " ",
+                      end="\r", flush=True)
             updatetime = gettime() + .1
+    if merkle:
+        sbxmerkle.write_tree(sbxfilename, tree)
     if raid:
         print("Copying sbx file")
         shutil.copy2(sbxfilename, sbxfilename+".raid")
 
     print("100%  ")
-    fin.close()
+    if not stream:
+        fin.close()
     fout.close()
+    seqbox.forget_sbx_header(sbxfilename)
 
-    totblocks = sbx.blocknum if False else sbx.blocknum + 1
+    totblocks = sbx.blocknum + 1 + indexblocks
     sbxfilesize = totblocks * sbx.blocksize
-    overhead = 100.0 * sbxfilesize / filesize - 100 if filesize > 0 else 0
+    overhead = 100.0 * sbxfilesize / plainsize - 100 if plainsize > 0 else 0
     print("SBX file size: %i - blocks: %i - overhead: %.1f%%" %
           (sbxfilesize, totblocks, overhead))
-
-def main():
-    cmdline = get_cmdline()
-    #filename to encode
-    filename = cmdline.filename
-    #filename which results from encoding
-    sbxfilename = cmdline.sbxfilename
-
-    if not sbxfilename:
-        sbxfilename = os.path.split(filename)[1] + ".sbx"
-    elif os.path.isdir(sbxfilename):
-        sbxfilename = os.path.join(sbxfilename,
-                                   os.path.split(filename)[1] + ".sbx")
-    if os.path.exists(sbxfilename) and not cmdline.overwrite:
-        errexit(1, "SBX file '%s' already exists!" % (sbxfilename))
-    #parse eventual custom uid
-    
-    if cmdline.uid !="r":
-        uid = uid[-12:]
-        try:
-            uid = int(uid, 16).to_bytes(6, byteorder='big')
-        except:
-            errexit(1, "invalid UID")
-
-    if not os.path.exists(filename):
-        errexit(1, "file '%s' not found" % (filename))
+    if parity:
+        parsize = os.path.getsize(sbxfilename + sbxpar.PAR_EXT)
+        print("parity file size: %i - %.1f%% of the SBX file" %
+              (parsize, 100.0 * parsize / sbxfilesize))
+
+def reshield(filename, sbxfilename, ranges, sbx_ver=1, raid=False, password=""):
+    """Re-encode in place only the blocks of a container that hold the byte ranges
+    (offset, length) of filename changed since it was encoded, plus the header.
+    Only a plain layout can be patched like that: False, with nothing written,
+    for interleaved, parity, indexed or compressed containers, which need encode()"""
+    try:
+        sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver, raid=raid)
+    except seqbox.SbxError:
+        return False
+    header = seqbox.read_header(sbxfilename, sbx, raid)
+    if (not header or header.metadata.get("interleave", 1) > 1 or
+        any(key in header.metadata for key in ("parity", "index", "compression"))):
+        return False
+    raw = header.raw_data_size_read_into_1_block
+    oldsize = header.metadata.get("filesize", 0)
     filesize = os.path.getsize(filename)
-    fout = open(sbxfilename, "wb", buffering=1024*1024)
-
-    #calc hash - before all processing, and not while reading the file,
-    sha256 = getsha256(filename)
-
-    fin = open(filename, "rb", buffering=1024*1024)
-    print("creating file '%s'..." % sbxfilename)
-
-    sbx = seqbox.SbxBlock(uid=cmdline.uid, ver=cmdline.sbxver, pswd=cmdline.password)
-
-    #write metadata block 0
-    sbx.metadata = {"filesize":filesize,
-                        "filename":filename,
-                        "sbxname":sbxfilename,
-                        "filedatetime":int(os.path.getmtime(filename)),
-                        "sbxdatetime":int(gettime()),
-                        "hash":b'\x12\x20'+sha256,#multihash
-                        "padding_last_block":0,} 
-    
-    fout.write(sbx.encode())
-    
-    #write all other blocks
-    updatetime = gettime() 
-    
-    if cmdline.password:
-        encdec = seqbox.EncDec(cmdline.password, sbx.raw_data_size_read_into_1_block)
-
-    while True:
-        #Reads data from file 
-        buffer = fin.read(sbx.raw_data_size_read_into_1_block)
-        
-        
-        #check if last block or file ended
-        if len(buffer) < sbx.raw_data_size_read_into_1_block:
-            #if file ended and no more data to be read:
-            if len(buffer) == 0:
-                #save sbx_blocknum
-                sbx_blocknum_save = sbx.blocknum
-                #set to 0 so when encoding the data will be treated as header block data
-                sbx.blocknum = 0
-                #get Header Block behaviour to replace the header block with padding information
-                header_block = sbx.encode()
-                #close filehandler which was used to write output
-                fout.close()
-                #replace first 512 Bytes with up to date Informationen
-                with open(sbxfilename,'r+b') as f:
-                    #go to position 0 in file
-                    f.seek(0)
-                    #write correct header block
-                    f.write(header_block)
-                    f.close()
-                    #restore blocknum
-                    sbx.blocknum = sbx_blocknum_save
-                    break
-            else:
-                #this occurs when the last block is read in | datasize is between 1 byte to sbx.datasize-sbx.redsize
-                
-                #we set the correct padding in metadata
-                sbx.metadata["padding_last_block"] = ((sbx.datasize-sbx.redsize) - len(buffer))
-                #fill buffer up with padding
-                buffer += b'\x1A'* ((sbx.datasize-sbx.redsize) - len(buffer))
-
-        if cmdline.password:
-            buffer = encdec.xor(buffer)   
-
-        sbx.blocknum += 1
-        sbx.data = buffer
-
-        data = sbx.encode()
-       
-        #write to file
-        fout.write(data)
-        
-        #some progress update
-        if gettime() > updatetime:
-            print("%.1f%%" % (fin.tell()*100.0/filesize), " ",
-                  end="\r", flush=True)
-            updatetime = gettime() + .1
-    if cmdline.raid:
-        print("Copying sbx file")
-        shutil.copy2(sbxfilename, sbxfilename+".raid")
-
-    print("100%  ")
-    fin.close()
-    fout.close()
-
-    totblocks = sbx.blocknum if False else sbx.blocknum + 1
-    sbxfilesize = totblocks * sbx.blocksize
-    overhead = 100.0 * sbxfilesize / filesize - 100 if filesize > 0 else 0
-    print("SBX file size: %i - blocks: %i - overhead: %.1f%%" %
-          (sbxfilesize, totblocks, overhead))
+    datablocks = (filesize + raw - 1) // raw
+    copies = [sbxfilename] + ([sbxfilename+".raid"] if raid and os.path.exists(sbxfilename+".raid") else [])
+    if any(os.path.getsize(path_to_file) != (1 + (oldsize + raw - 1) // raw) * header.blocksize
+           for path_to_file in copies):
+        return False
+
+    #blocks are numbered from 1, the ones after the old or new end all change
+    blocknums = set()
+    for offset, length in ranges:
+        if length > 0 and offset < filesize:
+            end = min(offset + length, filesize)
+            blocknums.update(range(offset // raw + 1, (end - 1) // raw + 2))
+    if filesize != oldsize:
+        blocknums.update(range(min(oldsize, filesize) // raw + 1, datablocks + 1))
 
+    if password:
+        encdec = seqbox.EncDec(password, raw, header.ver)
+    blocks = []
+    with open(filename, "rb") as fin:
+        for blocknum in sorted(blocknums):
+            fin.seek((blocknum - 1) * raw)
+            buffer = fin.read(raw)
+            buffer += b'\x1A' * (raw - len(buffer))
+            if password:
+                buffer = encdec.xor(buffer)
+            header.blocknum = blocknum
+            header.data = buffer
+            blocks.append((blocknum, header.encode()))
+
+    #the hashes cover the whole file, reading it is still far cheaper than encoding it
+    if "merkle" in header.metadata:
+        sha256, tree = sbxmerkle.hash_file(filename)
+        sbxmerkle.write_tree(sbxfilename, tree)
+        header.metadata["merkle"] = b'\x12\x20' + tree.root
+    else:
+        sha256 = getsha256(filename)
+    header.metadata["hash"] = b'\x12\x20' + sha256
+    header.metadata["filesize"] = filesize
+    header.metadata["padding_last_block"] = (raw - filesize % raw) % raw
+    header.metadata["filedatetime"] = int(os.path.getmtime(filename))
+    header.metadata["sbxdatetime"] = int(gettime())
+    header.blocknum = 0
+    blocks.append((0, header.encode()))
+
+    for path_to_file in copies:
+        with open(path_to_file, "r+b") as fout:
+            for blocknum, block in blocks:
+                fout.seek(blocknum * header.blocksize)
+                fout.write(block)
+            fout.truncate((1 + datablocks) * header.blocksize)
+    seqbox.forget_sbx_header(sbxfilename)
+    return True
+
+def rename_header(sbxfilename, filename, sbx_ver=1, raid=False):
+    """Record new names of the original file and of the container in the header,
+    after they were moved; the data blocks are left as they are"""
+    try:
+        sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver, raid=raid)
+    except seqbox.SbxError:
+        return False
+    header = seqbox.read_header(sbxfilename, sbx, raid)
+    if not header:
+        return False
+    if "filename" in header.metadata:
+        header.metadata["filename"] = filename
+    header.metadata["sbxname"] = sbxfilename
+    header.blocknum = 0
+    block = header.encode()
+    warn_dropped_names(header)
+    for path_to_file in [sbxfilename] + ([sbxfilename+".raid"] if raid else []):
+        if os.path.exists(path_to_file):
+            with open(path_to_file, "r+b") as fout:
+                fout.write(block)
+    seqbox.forget_sbx_header(sbxfilename)
+    return True
 
-    
+def main():
+    cmdline = get_cmdline()
+    encode(cmdline.filename, sbxfilename=cmdline.sbxfilename, overwrite=cmdline.overwrite,
+           uid=cmdline.uid, sbx_ver=cmdline.sbxver, raid=cmdline.raid,
+           password=cmdline.password, blocksize=cmdline.blocksize*1024,
+           redsym=cmdline.redsym, interleave=cmdline.interleave,
+           parity=cmdline.parity, pargroup=cmdline.pargroup, index=cmdline.index,
+           merkle=cmdline.merkle, compression=cmdline.compress,
+           chunksize=cmdline.chunksize*1024)
 
 if __name__ == '__main__':
     main()
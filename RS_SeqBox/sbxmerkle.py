@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import os
+import sys
+import argparse
+import binascii
+import hashlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
+
+PROGRAM_VER = "1.0.0"
+
+MKL_EXT = ".mkl"
+MKL_MAGIC = b"SBxM"
+#magic, format, hash type, leaf size, file size, leaf count
+HEADER_FORMAT = ">4sBBIQI"
+LEAF_SIZE = 1024*1024
+#leaves and nodes are hashed with a different prefix, so a leaf can not pass for a node
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+def get_cmdline():
+    """Evaluate command line parameters, usage & help."""
+    parser = argparse.ArgumentParser(
+             description="add a Merkle tree of the data to an existing SBX container, " +
+             "or check a file against it",
+             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+             prefix_chars='-+')
+    parser.add_argument("-v", "--version", action='version',
+                        version='SeqBox - Sequenced Box container - ' +
+                        'Merkle v%s' % PROGRAM_VER)
+    parser.add_argument("filename", action="store", help="original file")
+    parser.add_argument("sbxfilename", action="store", nargs='?',
+                        help="SBX container (default: filename.sbx)")
+    parser.add_argument("-c", "--check", action="store_true", default=False,
+                        help="check the file against the tree instead of writing it")
+    parser.add_argument("-off", "--offset", type=int, default=0,
+                        help="first byte to check", metavar="n")
+    parser.add_argument("-len", "--length", type=int, default=None,
+                        help="bytes to check (default: up to the end)", metavar="n")
+    parser.add_argument("-t", "--threads", type=int, default=os.cpu_count() or 1,
+                        help="hash leaves in n threads", metavar="n")
+    parser.add_argument("-sv", "--sbxver", type=int, default=1,
+                        help="SBX blocks version", metavar="n")
+    parser.add_argument("-raid", "--raid", action="store_true", default=False,
+                        help="also use and update the raid copy")
+    res = parser.parse_args()
+    return res
+
+def errexit(errlev=1, mess=""):
+    """Display an error and exit."""
+    if mess != "":
+        sys.stderr.write("%s: error: %s\n" %
+                         (os.path.split(sys.argv[0])[1], mess))
+    sys.exit(errlev)
+
+def hash_leaf(data):
+    return hashlib.sha256(LEAF_PREFIX + data).digest()
+
+def hash_node(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+def leaf_count(filesize, leafsize=LEAF_SIZE):
+    #an empty file still has one (empty) leaf
+    return max(1, -(-filesize // leafsize))
+
+class MerkleTree():
+    """Hashes of the fixed size leaves of a file and the tree above them"""
+
+    def __init__(self, leaves, filesize, leafsize=LEAF_SIZE):
+        self.leaves = list(leaves)
+        self.filesize = filesize
+        self.leafsize = leafsize
+        if len(self.leaves) != leaf_count(filesize, leafsize):
+            raise seqbox.SbxError("%i leaves for a file of %i bytes" % (len(self.leaves), filesize))
+        #levels[0] are the leaves, the last level is the root; an odd node is carried up
+        self.levels = [self.leaves]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            self.levels.append([hash_node(level[i], level[i+1]) if i+1 < len(level) else level[i]
+                                for i in range(0, len(level), 2)])
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    def leaves_of(self, offset, length):
+        """Leaves holding a byte range of the file"""
+        end = min(offset + length, self.filesize)
+        if length <= 0 or offset >= end:
+            return range(0)
+        return range(offset // self.leafsize, (end - 1) // self.leafsize + 1)
+
+    def span(self, leafnums):
+        """Byte range of the file covered by a range of leaves"""
+        return (leafnums[0] * self.leafsize,
+                min((leafnums[-1] + 1) * self.leafsize, self.filesize))
+
+    def verify_data(self, offset, data):
+        """Leaves that do not match, data must start on a leaf and cover whole leaves
+        (or run to the end of the file)"""
+        first = offset // self.leafsize
+        bad = []
+        for i in range(-(-len(data) // self.leafsize) or 1):
+            chunk = data[i*self.leafsize:(i+1)*self.leafsize]
+            if first + i >= len(self.leaves) or hash_leaf(chunk) != self.leaves[first+i]:
+                bad.append(first + i)
+        return bad
+
+    def verify_range(self, filename, offset=0, length=None, threads=1):
+        """Leaves touched by a byte range of a file that do not match, all of them if
+        the file does not have the size of the tree"""
+        if length is None:
+            length = self.filesize - offset
+        leafnums = self.leaves_of(offset, length)
+        if self.filesize == 0:
+            leafnums = range(1)
+        if os.path.getsize(filename) != self.filesize:
+            return list(leafnums)
+        leaves = hash_leaves(filename, self.filesize, self.leafsize, leafnums, threads)
+        return [leafnum for leafnum, leaf in zip(leafnums, leaves)
+                if leaf != self.leaves[leafnum]]
+
+    def encode(self):
+        """The sidecar: header, leaves, CRC32 of both"""
+        buffer = struct.pack(HEADER_FORMAT, MKL_MAGIC, 1, 0x12, self.leafsize,
+                             self.filesize, len(self.leaves))
+        buffer += b"".join(self.leaves)
+        return buffer + binascii.crc32(buffer).to_bytes(4, byteorder='big')
+
+    @staticmethod
+    def decode(buffer):
+        """Tree from a sidecar, None if it is damaged or not one"""
+        size = struct.calcsize(HEADER_FORMAT)
+        if len(buffer) < size + 4 or buffer[:4] != MKL_MAGIC:
+            return None
+        if binascii.crc32(buffer[:-4]) != int.from_bytes(buffer[-4:], byteorder='big'):
+            return None
+        magic, fmt, hashtype, leafsize, filesize, count = struct.unpack(HEADER_FORMAT, buffer[:size])
+        if fmt != 1 or hashtype != 0x12 or len(buffer) != size + 32 * count + 4:
+            return None
+        try:
+            return MerkleTree([buffer[size+i*32:size+(i+1)*32] for i in range(count)],
+                              filesize, leafsize)
+        except seqbox.SbxError:
+            return None
+
+class MerkleHasher():
+    """Build the leaves of a tree from data fed in order, in chunks of any size"""
+
+    def __init__(self, leafsize=LEAF_SIZE):
+        self.leafsize = leafsize
+        self.leaves = []
+        self.size = 0
+        #hash of the leaf being filled and the bytes already in it
+        self.d = hashlib.sha256(LEAF_PREFIX)
+        self.filled = 0
+
+    def update(self, data):
+        self.size += len(data)
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.leafsize - self.filled)
+            self.d.update(view[:take])
+            self.filled += take
+            view = view[take:]
+            if self.filled == self.leafsize:
+                self.leaves.append(self.d.digest())
+                self.d = hashlib.sha256(LEAF_PREFIX)
+                self.filled = 0
+
+    def tree(self):
+        leaves = self.leaves
+        if self.filled or not leaves:
+            leaves = leaves + [self.d.digest()]
+        return MerkleTree(leaves, self.size, self.leafsize)
+
+def hash_leaves(filename, filesize, leafsize=LEAF_SIZE, leafnums=None, threads=1):
+    """Hashes of some leaves of a file, computed in parallel: hashlib releases the
+    GIL on large buffers, so threads are enough to use more than one core"""
+    if leafnums is None:
+        leafnums = range(leaf_count(filesize, leafsize))
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        def leaf(leafnum):
+            return hash_leaf(os.pread(fd, leafsize, leafnum * leafsize))
+        if threads > 1 and len(leafnums) > 1:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                return list(pool.map(leaf, leafnums))
+        return [leaf(leafnum) for leafnum in leafnums]
+    finally:
+        os.close(fd)
+
+def hash_file(filename, leafsize=LEAF_SIZE):
+    """Whole file SHA256 and Merkle tree of a file, in a single pass"""
+    d = hashlib.sha256()
+    hasher = MerkleHasher(leafsize)
+    with open(filename, "rb") as fin:
+        while True:
+            buffer = fin.read(leafsize)
+            if not buffer:
+                break
+            d.update(buffer)
+            hasher.update(buffer)
+    return d.digest(), hasher.tree()
+
+def write_tree(sbxfilename, tree):
+    with open(sbxfilename + MKL_EXT, "wb") as fout:
+        fout.write(tree.encode())
+
+def load(sbxfilename, sbx_ver=1, raid=False):
+    """Tree of a container, None if it has none or the sidecar does not match the
+    root recorded in its header"""
+    if not os.path.exists(sbxfilename + MKL_EXT) or not os.path.exists(sbxfilename):
+        return None
+    header = seqbox.read_sbx_header(sbxfilename, ver=sbx_ver, raid=raid)
+    if not header or "merkle" not in header.metadata:
+        return None
+    with open(sbxfilename + MKL_EXT, "rb") as fin:
+        tree = MerkleTree.decode(fin.read())
+    if not tree or b'\x12\x20' + tree.root != header.metadata["merkle"]:
+        return None
+    #the tree is of the file before any compression
+    filesize = header.metadata.get("filesize", tree.filesize)
+    if "compression" in header.metadata:
+        filesize = header.metadata["compression"][2]
+    if tree.filesize != filesize:
+        return None
+    return tree
+
+def add_merkle(filename, sbxfilename, sbx_ver=1, raid=False):
+    """Write the tree of the original file of a container next to it and record its
+    root in the header; the file must still match the hash of the container"""
+    sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver, raid=raid)
+    header = seqbox.read_header(sbxfilename, sbx, raid)
+    if not header:
+        raise seqbox.SbxDecodeError("header block of '%s' can not be decoded" % sbxfilename)
+    sha256, tree = hash_file(filename)
+    if header.metadata.get("hash") != b'\x12\x20' + sha256:
+        raise seqbox.SbxError("'%s' does not match the hash of '%s'" % (filename, sbxfilename))
+    write_tree(sbxfilename, tree)
+    header.metadata["merkle"] = b'\x12\x20' + tree.root
+    header.blocknum = 0
+    block = header.encode()
+    for path_to_file in [sbxfilename] + ([sbxfilename+".raid"] if raid else []):
+        if os.path.exists(path_to_file):
+            with open(path_to_file, "r+b") as fout:
+                fout.write(block)
+    seqbox.forget_sbx_header(sbxfilename)
+    return tree
+
+def main():
+    cmdline = get_cmdline()
+    sbxfilename = cmdline.sbxfilename or cmdline.filename + ".sbx"
+    if not os.path.exists(cmdline.filename):
+        errexit(1, "file '%s' not found" % (cmdline.filename))
+    if not os.path.exists(sbxfilename):
+        errexit(1, "sbx file '%s' not found" % (sbxfilename))
+    if not cmdline.check:
+        try:
+            tree = add_merkle(cmdline.filename, sbxfilename, sbx_ver=cmdline.sbxver, raid=cmdline.raid)
+        except seqbox.SbxError as err:
+            errexit(1, str(err))
+        print("tree of %i leaves written to '%s'" % (len(tree.leaves), sbxfilename + MKL_EXT))
+        return
+    tree = load(sbxfilename, sbx_ver=cmdline.sbxver, raid=cmdline.raid)
+    if not tree:
+        errexit(1, "'%s' has no valid Merkle tree" % (sbxfilename))
+    bad = tree.verify_range(cmdline.filename, cmdline.offset, cmdline.length, cmdline.threads)
+    for leafnum in bad:
+        start, end = tree.span(range(leafnum, leafnum+1))
+        print("bytes %i-%i do not match" % (start, end - 1))
+    if bad:
+        errexit(1, "%i of %i leaves do not match" % (len(bad), len(tree.leaves)))
+    print("range matches")
+
+if __name__ == '__main__':
+    main()
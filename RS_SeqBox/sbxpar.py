@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import os
+import sys
+import argparse
+import binascii
+
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.rsbatch as rsbatch
+except ImportError:
+    pass
+try:
+    import rsbatch as rsbatch
+except ImportError:
+    pass
+
+PROGRAM_VER = "1.0.0"
+
+PAR_EXT = ".par"
+PAR_MAGIC = b"SBxP"
+HEADER_SIZE = 32
+#every parity block is stored after its CRC32, so a damaged one is known as missing
+RECORD_HDR = 4
+DEFAULT_GROUP = 20
+
+def get_cmdline():
+    """Evaluate command line parameters, usage & help."""
+    parser = argparse.ArgumentParser(
+             description="add parity blocks to an existing SBX container",
+             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+             prefix_chars='-+')
+    parser.add_argument("-v", "--version", action='version',
+                        version='SeqBox - Sequenced Box container - ' +
+                        'Parity v%s' % PROGRAM_VER)
+    parser.add_argument("sbxfilename", action="store", help="SBX container")
+    parser.add_argument("-par", "--parity", type=int, default=2,
+                        help="parity blocks for every group", metavar="n")
+    parser.add_argument("-pg", "--pargroup", type=int, default=DEFAULT_GROUP,
+                        help="data blocks in a parity group", metavar="n")
+    parser.add_argument("-sv", "--sbxver", type=int, default=1,
+                        help="SBX blocks version", metavar="n")
+    parser.add_argument("-raid", "--raid", action="store_true", default=False,
+                        help="also update the header of the raid copy")
+    res = parser.parse_args()
+    return res
+
+def errexit(errlev=1, mess=""):
+    """Display an error and exit."""
+    if mess != "":
+        sys.stderr.write("%s: error: %s\n" %
+                         (os.path.split(sys.argv[0])[1], mess))
+    sys.exit(errlev)
+
+def codec(parity):
+    return seqbox.rscodec(parity)
+
+def check_geometry(group, parity):
+    """Error message for a parity setting that does not fit in one RS codeword"""
+    if parity < 1 or group < 1:
+        return "parity and group size must be at least 1"
+    if group + parity > 255:
+        return "group size + parity blocks must be at most 255"
+    return ""
+
+def parity_blocks(blocks, parity):
+    """Parity blocks of a group of raw blocks: byte p of every block forms the
+    message of one RS codeword, its ECC symbols are byte p of the parity blocks"""
+    count = len(blocks)
+    blocksize = len(blocks[0])
+    batch = rsbatch.encoder(parity)
+    if batch is not None:
+        #all the byte positions at once, one row per position
+        np = rsbatch.np
+        columns = np.frombuffer(b"".join(blocks), dtype=np.uint8).reshape(count, blocksize).T
+        out = batch.parity(columns)
+        return [out[:, m].tobytes() for m in range(parity)]
+    rsc = codec(parity)
+    group = bytearray(b"".join(blocks))
+    out = b"".join(bytes(rsc.encode(group[p::blocksize])[count:]) for p in range(blocksize))
+    return [out[m::parity] for m in range(parity)]
+
+def rebuild(blocks, parities):
+    """Fill in the missing (None) blocks of a group from its parity blocks"""
+    count = len(blocks)
+    parity = len(parities)
+    missing = ([i for i, block in enumerate(blocks) if block is None] +
+               [count+m for m, block in enumerate(parities) if block is None])
+    if not any(block is None for block in blocks):
+        return list(blocks)
+    if len(missing) > parity:
+        raise seqbox.ReedSolomonError("%i blocks missing in a group with %i parity blocks" %
+                                   (len(missing), parity))
+    blocksize = len(next(block for block in blocks + parities if block is not None))
+    empty = bytes(blocksize)
+    group = bytearray(b"".join(empty if block is None else block for block in blocks + parities))
+    rsc = codec(parity)
+    erase_pos = bytearray(missing)
+    message = b"".join(bytes(rsc.decode(group[p::blocksize], erase_pos=erase_pos, only_erasures=True)[0])
+                       for p in range(blocksize))
+    return [message[i::count] for i in range(count)]
+
+def encode_header(sbx, group, parity):
+    buffer = (PAR_MAGIC + bytes([sbx.ver, parity]) + group.to_bytes(2, byteorder='big') +
+              sbx.uid + sbx.blocksize.to_bytes(4, byteorder='big'))
+    buffer += binascii.crc32(buffer).to_bytes(4, byteorder='big')
+    return buffer + b'\x1A' * (HEADER_SIZE - len(buffer))
+
+def decode_header(buffer):
+    """uid, block size, group size and parity blocks of a sidecar, None if not valid"""
+    if len(buffer) < HEADER_SIZE or buffer[:4] != PAR_MAGIC:
+        return None
+    if binascii.crc32(buffer[:18]) != int.from_bytes(buffer[18:22], byteorder='big'):
+        return None
+    return {"ver":buffer[4], "parity":buffer[5],
+            "group":int.from_bytes(buffer[6:8], byteorder='big'),
+            "uid":buffer[8:14],
+            "blocksize":int.from_bytes(buffer[14:18], byteorder='big')}
+
+class ParityWriter():
+    """Write the parity sidecar of a container while its data blocks are encoded"""
+
+    def __init__(self, parfilename, sbx, group, parity):
+        self.group = group
+        self.parity = parity
+        self.blocks = []
+        self.fout = open(parfilename, "wb", buffering=1024*1024)
+        self.fout.write(encode_header(sbx, group, parity))
+
+    def add(self, block):
+        self.blocks.append(block)
+        if len(self.blocks) == self.group:
+            self.flush()
+
+    def flush(self):
+        if not self.blocks:
+            return
+        for block in parity_blocks(self.blocks, self.parity):
+            self.fout.write(binascii.crc32(block).to_bytes(4, byteorder='big') + block)
+        self.blocks = []
+
+    def close(self):
+        #the last group can be shorter, the code is just shortened
+        self.flush()
+        self.fout.close()
+
+class Parity():
+    """Rebuild whole blocks of a container from its parity sidecar"""
+
+    def __init__(self, sbxfilename, sbx, metadata, raid=False):
+        self.sbx = sbx
+        self.group, self.parity = metadata["parity"]
+        self.interleave = metadata.get("interleave", 1)
+        self.parfilename = sbxfilename + PAR_EXT
+        self.copies = [sbxfilename]
+        if raid and os.path.exists(sbxfilename+".raid"):
+            self.copies.append(sbxfilename+".raid")
+        #data blocks are 1..datablocks, the header is not part of any group
+        self.datablocks = -(-metadata.get("filesize", 0) // sbx.raw_data_size_read_into_1_block)
+        self.groups = -(-self.datablocks // self.group)
+        self.recordsize = RECORD_HDR + sbx.blocksize
+        self.cached = (None, None)
+
+    @staticmethod
+    def open(sbxfilename, sbx, metadata, raid=False):
+        """Parity of a container, None if it has none or the sidecar does not match it"""
+        if "parity" not in metadata or not os.path.exists(sbxfilename + PAR_EXT):
+            return None
+        with open(sbxfilename + PAR_EXT, "rb") as fin:
+            header = decode_header(fin.read(HEADER_SIZE))
+        if (not header or header["blocksize"] != sbx.blocksize or
+                (header["group"], header["parity"]) != tuple(metadata["parity"])):
+            return None
+        return Parity(sbxfilename, sbx, metadata, raid)
+
+    def group_of(self, blocknum):
+        return (blocknum - 1) // self.group
+
+    def group_blocks(self, groupnum):
+        first = 1 + groupnum * self.group
+        return range(first, min(first + self.group, self.datablocks + 1))
+
+    def read_records(self, groupnum):
+        """The parity blocks of a group, None for the damaged ones"""
+        records = []
+        with open(self.parfilename, "rb") as fin:
+            fin.seek(HEADER_SIZE + groupnum * self.parity * self.recordsize)
+            for m in range(self.parity):
+                record = fin.read(self.recordsize)
+                block = record[RECORD_HDR:]
+                if (len(block) == self.sbx.blocksize and
+                        binascii.crc32(block) == int.from_bytes(record[:RECORD_HDR], byteorder='big')):
+                    records.append(block)
+                else:
+                    records.append(None)
+        return records
+
+    def lost_records(self):
+        """Group number of every damaged parity block"""
+        return [groupnum for groupnum in range(self.groups)
+                for block in self.read_records(groupnum) if block is None]
+
+    def read_copy(self, path_to_file, blocknums):
+        """Raw blocks of one copy, undoing the interleaving of the groups they are in"""
+        blocksize = self.sbx.blocksize
+        start = seqbox.group_start(blocknums[0], self.interleave)
+        end = min(seqbox.group_start(blocknums[-1], self.interleave) + self.interleave,
+                  self.datablocks + 1)
+        with open(path_to_file, "rb") as fin:
+            fin.seek(start * blocksize)
+            buffer = fin.read((end - start) * blocksize)
+        #a short copy reads as empty blocks, which are never valid
+        buffer += bytes((end - start) * blocksize - len(buffer))
+        blocks = self.sbx.deinterleave(buffer, self.interleave)
+        return blocks[blocknums[0]-start:blocknums[-1]-start+1]
+
+    def clean_blocks(self, groupnum):
+        """The blocks of a group with their errors corrected, None for the lost ones"""
+        blocknums = list(self.group_blocks(groupnum))
+        blocks = [None] * len(blocknums)
+        for path_to_file in self.copies:
+            for i, raw in enumerate(self.read_copy(path_to_file, blocknums)):
+                if blocks[i] is not None:
+                    continue
+                try:
+                    message = self.sbx.rs_decode(raw)
+                except seqbox.ReedSolomonError:
+                    continue
+                if self.sbx.is_valid(message, blocknums[i]):
+                    blocks[i] = self.sbx.rs_encode(message)
+        return blocks
+
+    def rebuild_group(self, groupnum):
+        if self.cached[0] != groupnum:
+            self.cached = (groupnum, rebuild(self.clean_blocks(groupnum), self.read_records(groupnum)))
+        return self.cached[1]
+
+    def block(self, blocknum):
+        """Raw block rebuilt from the other blocks of its group and the parity"""
+        groupnum = self.group_of(blocknum)
+        block = self.rebuild_group(groupnum)[blocknum - self.group_blocks(groupnum)[0]]
+        message = self.sbx.clean_message(block)
+        if message is None or not self.sbx.is_valid(message, blocknum):
+            raise seqbox.ReedSolomonError("block %i can not be rebuilt from the parity" % blocknum)
+        return block
+
+    def recoverable(self, lost, lost_records):
+        """Split lost data blocks in the ones the parity rebuilds and the others"""
+        rebuilt = []
+        unrecoverable = []
+        datalost = [b for b in lost if 0 < b <= self.datablocks]
+        for groupnum in sorted({self.group_of(blocknum) for blocknum in datalost}):
+            blocknums = [b for b in datalost if self.group_of(b) == groupnum]
+            if len(blocknums) + lost_records.count(groupnum) <= self.parity:
+                rebuilt += blocknums
+            else:
+                unrecoverable += blocknums
+        #the header and the index blocks are not covered by the parity
+        unrecoverable += [b for b in lost if b not in datalost]
+        return sorted(rebuilt), sorted(unrecoverable)
+
+    def rewrite_records(self, groupnum):
+        """Write the parity blocks of a group again from its (repaired) data blocks"""
+        blocks = self.rebuild_group(groupnum)
+        with open(self.parfilename, "r+b") as fout:
+            fout.seek(HEADER_SIZE + groupnum * self.parity * self.recordsize)
+            for block in parity_blocks(blocks, self.parity):
+                fout.write(binascii.crc32(block).to_bytes(4, byteorder='big') + block)
+
+def add_parity(sbxfilename, group=DEFAULT_GROUP, parity=2, sbx_ver=1, raid=False):
+    """Write the parity sidecar of an existing container and record it in its header"""
+    sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver, raid=raid)
+    header = seqbox.read_header(sbxfilename, sbx, raid)
+    if not header:
+        raise seqbox.SbxDecodeError("header block of '%s' can not be decoded" % sbxfilename)
+    header.metadata["parity"] = (group, parity)
+    parity_reader = Parity(sbxfilename, sbx, header.metadata, raid)
+    sbx.uid = header.uid
+    writer = ParityWriter(sbxfilename + PAR_EXT, sbx, group, parity)
+    for groupnum in range(parity_reader.groups):
+        blocks = parity_reader.clean_blocks(groupnum)
+        if None in blocks:
+            writer.fout.close()
+            os.remove(sbxfilename + PAR_EXT)
+            raise seqbox.SbxDecodeError("'%s' has lost blocks, repair it first" % sbxfilename)
+        for block in blocks:
+            writer.add(block)
+    writer.close()
+    header.blocknum = 0
+    block = header.encode()
+    for path_to_file in parity_reader.copies:
+        with open(path_to_file, "r+b") as fout:
+            fout.write(block)
+
+def main():
+    cmdline = get_cmdline()
+    if not os.path.exists(cmdline.sbxfilename):
+        errexit(1, "sbx file '%s' not found" % (cmdline.sbxfilename))
+    error = check_geometry(cmdline.pargroup, cmdline.parity)
+    if error:
+        errexit(1, error)
+    try:
+        add_parity(cmdline.sbxfilename, cmdline.pargroup, cmdline.parity,
+                   sbx_ver=cmdline.sbxver, raid=cmdline.raid)
+    except seqbox.SbxError as err:
+        errexit(1, str(err))
+    print("parity written to '%s'" % (cmdline.sbxfilename + PAR_EXT))
+
+if __name__ == '__main__':
+    main()
@@ -33,7 +33,14 @@ import binascii
 import sqlite3
 import time
 
-import seqbox
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
 
 PROGRAM_VER = "1.0.2"
 
@@ -128,12 +135,31 @@ class RecDB():
         res = {row[0]:row[1] for row in c.fetchall()}
         return res
 
+    def GetUIDGeometry(self, uid):
+        """Block size and ECC symbols of a uid, None for databases without them"""
+        c = self.cursor
+        try:
+            c.execute("SELECT blocksize, redsym from sbx_uids where uid = '%i'" % (uid))
+        except sqlite3.OperationalError:
+            return None
+        res = c.fetchone()
+        if res and res[0]:
+            return res
+
     def GetSourcesList(self):
         c = self.cursor
         c.execute("SELECT * FROM sbx_source")
         return c.fetchall()
 
 
+def new_block(db, uid, sbxver):
+    """SbxBlock with the geometry a uid was encoded with"""
+    geometry = db.GetUIDGeometry(uid) if sbxver >= 3 else None
+    if geometry:
+        return seqbox.SbxBlock(ver=sbxver, blocksize=geometry[0], redsym=geometry[1])
+    return seqbox.SbxBlock(ver=sbxver)
+
+
 def uniquifyFileName(filename):
     count = 0
     uniq = ""
@@ -160,7 +186,7 @@ def report(db, uidDataList, blocksizes):
         if "filesize" in metadata:
             filesize = metadata["filesize"]
         else:
-            filesize = blocksnum * blocksizes[uidDataList[uid]]
+            filesize = blocksnum * blocksizes[uid]
         filedatetime = "n/a"
         if "filedatetime" in metadata:
             if metadata["filedatetime"] >= 0:
@@ -188,7 +214,7 @@ def report_err(db, uiderrlist, uidDataList, blocksizes):
         if "filesize" in metadata:
             filesize = metadata["filesize"]
         else:
-            filesize = blocksnum * blocksizes[uidDataList[uid]]
+            filesize = blocksnum * blocksizes[uid]
         
         print('"%s", %i, %i, %i, "%s", "%s"' %
               (hexdigits, blocksnum, errblocks, filesize, sbxname, filename))
@@ -197,8 +223,13 @@ def report_err(db, uiderrlist, uidDataList, blocksizes):
 def main():
 
     cmdline = get_cmdline()
+    recover(cmdline.dbfilename, destpath=cmdline.destpath, recover_all=cmdline.all,
+            files=cmdline.file, sbxnames=cmdline.sbx, uids=cmdline.uid,
+            fill=cmdline.fill, info=cmdline.info, overwrite=cmdline.overwrite)
+
 
-    dbfilename = cmdline.dbfilename
+def recover(dbfilename, destpath=None, recover_all=False, files=None, sbxnames=None,
+            uids=None, fill=False, info=False, overwrite=False):
     if not os.path.exists(dbfilename) or os.path.isdir(dbfilename):
         errexit(1,"file '%s' not found!" % (dbfilename))
 
@@ -209,23 +240,23 @@ def main():
     #get data on all uids present
     uidDataList = db.GetUIDDataList()
 
-    #get blocksizes for every supported SBx version
+    #get the blocksize of every uid, version 3 ones have their own
     blocksizes = {}
-    for v in seqbox.supported_vers:
-        blocksizes[v] = seqbox.SbxBlock(ver=v).blocksize
+    for uid in uidDataList:
+        blocksizes[uid] = new_block(db, uid, uidDataList[uid]).blocksize
     
     #info/report
-    if cmdline.info:
+    if info:
         report(db, uidDataList, blocksizes)
         errexit(0)
 
     #build a list of uids to recover:
     uidRecoList = []
-    if cmdline.all:
+    if recover_all:
         uidRecoList = list(uidDataList)
     else:
-        if cmdline.uid:
-            for hexuid in cmdline.uid:
+        if uids:
+            for hexuid in uids:
                 if len(hexuid) % 2 != 0:
                     errexit(1, "invalid UID!")
                 uid = int.from_bytes(binascii.unhexlify(hexuid),
@@ -234,15 +265,15 @@ def main():
                     uidRecoList.append(uid)
                 else:
                     errexit(1,"no recoverable UID '%s'" % (hexuid))
-        if cmdline.sbx:
-            for sbxname in cmdline.sbx:
+        if sbxnames:
+            for sbxname in sbxnames:
                 uid = db.GetUIDFromSbxName(sbxname)
                 if uid:
                     uidRecoList.append(uid)
                 else:
                     errexit(1,"no recoverable sbx file '%s'" % (sbxname))
-        if cmdline.file:
-            for filename in cmdline.file:
+        if files:
+            for filename in files:
                 uid = db.GetUIDFromFileName(filename)
                 if uid:
                     uidRecoList.append(uid)
@@ -266,8 +297,7 @@ def main():
     uiderrlist = []
     for uid in uidRecoList:
         uidcount += 1
-        sbxver = uidDataList[uid]
-        sbx = seqbox.SbxBlock(ver=sbxver)
+        sbx = new_block(db, uid, uidDataList[uid])
         hexuid = binascii.hexlify(uid.to_bytes(6, byteorder="big")).decode()
         print("UID %s (%i/%i)" % (hexuid, uidcount, len(uid_list)))
 
@@ -281,11 +311,12 @@ def main():
             #use hex uid as name if no metadata present
             sbxname = (binascii.hexlify(uid.to_bytes(6, byteorder="big")).decode() +
                        ".sbx")
-        if cmdline.destpath:
-            sbxname = os.path.join(cmdline.destpath, sbxname)
+        if destpath:
+            #the stored name can be a full path, which would make join() ignore destpath
+            sbxname = os.path.join(destpath, os.path.basename(sbxname))
         print("  to: '%s'" % sbxname)
 
-        if not cmdline.overwrite:
+        if not overwrite:
             sbxname = uniquifyFileName(sbxname)
         fout = open(sbxname, "wb", buffering = 1024*1024)
 
@@ -311,14 +342,15 @@ def main():
         #loop trough the block list and recreate SBx file
         for blockdata in blockdatalist:
             bnum = blockdata[0]
-            #check for missing blocks and fill in
-            if bnum != lastblock +1 and bnum != 1:
+            #check for missing blocks and fill in, the index blocks at the end
+            #count down from the top of the block numbers
+            if bnum != lastblock +1 and bnum != 1 and not seqbox.is_index_blocknum(bnum):
                 for b in range(lastblock+1, bnum):
                     #no point in an empty block 0 with no metadata
-                    if b > 0 and cmdline.fill:
+                    if b > 0 and fill:
                         sbx.blocknum = b
-                        sbx.data = bytes(sbx.datasize)
-                        buffer = sbx.encode(sbx)
+                        sbx.data = bytes(sbx.raw_data_size_read_into_1_block)
+                        buffer = sbx.encode()
                         fout.write(buffer)
                     missingblocks += 1
 
@@ -347,6 +379,9 @@ def main():
             uiderrlist.append((uid, missingblocks))
             totblockserr += missingblocks
 
+    for fin in finlist.values():
+        fin.close()
+
     print("\ndone.")
     if len(uiderrlist) == 0:
         print("all SBx files recovered with no errors!")
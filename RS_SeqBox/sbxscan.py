@@ -32,14 +32,19 @@ import argparse
 import binascii
 from time import sleep, time
 import sqlite3
-import creedsolo.creedsolo as crs
-import seqbox
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
 from collections.abc import Sequence, Mapping
 PROGRAM_VER = "1.0.1"
 
 def decode_data_block(buffer, sbx):
-    redundancy=sbx.redsym 
-    rsc=crs.RSCodec(redundancy)
+    rsc=sbx.rsc_for_data_block
     buffer = bytes(rsc.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])   
     return buffer 
 
@@ -92,19 +97,118 @@ def getFileSize(filename):
         os.close(ftemp)
 
 
+def add_block(c, sbx, uids, filenum, pos):
+    """Record a valid decoded block in the database, return True if it has metadata"""
+    if not sbx.uid in uids:
+        uids[sbx.uid] = True
+        c.execute("INSERT INTO sbx_uids (uid, ver, blocksize, redsym) VALUES (?, ?, ?, ?)",
+                  (int.from_bytes(sbx.uid, byteorder='big'), sbx.ver, sbx.blocksize, sbx.redsym))
+    c.execute("INSERT INTO sbx_blocks (uid, num, fileid, pos) VALUES (?, ?, ?, ?)",
+              (int.from_bytes(sbx.uid, byteorder='big'), sbx.blocknum, filenum, pos))
+    if sbx.blocknum != 0:
+        return False
+    c.execute("INSERT INTO sbx_meta (uid , size, name, sbxname, datetime, sbxdatetime, fileid) VALUES (?, ?, ?, ?, ?, ?, ?)",
+              (int.from_bytes(sbx.uid, byteorder='big'),
+               sbx.metadata.get("filesize", -1), sbx.metadata.get("filename", ""),
+               sbx.metadata.get("sbxname", ""), sbx.metadata.get("filedatetime", -1),
+               sbx.metadata.get("sbxdatetime", -1), filenum))
+    return True
+
+def scan_v3(filename, filenum, filesize, c, conn, uids, offset=0, step=0, buffersize=1024):
+    """Find version 3 blocks: their size is only known after decoding the prefix"""
+    #the prefix codeword is systematic, so the magic is there in clear and
+    #candidates are found with a plain search; with a step, every step is also
+    #tried, for blocks where the magic itself got damaged
+    magic = b'SBx\x03'
+    geometries = {}
+    fin = open(filename, "rb", buffering=0)
+
+    def read_block(pos):
+        fin.seek(pos, 0)
+        info = seqbox.decode_prefix(fin.read(seqbox.PREFIX_SIZE))
+        if not info:
+            return None
+        geometry = (info["blocksize"], info["redsym"])
+        if geometry not in geometries:
+            geometries[geometry] = seqbox.SbxBlock(ver=3, blocksize=geometry[0], redsym=geometry[1])
+        sbx = geometries[geometry]
+        fin.seek(pos, 0)
+        try:
+            message = sbx.rs_decode(fin.read(sbx.blocksize))
+        except seqbox.ReedSolomonError:
+            return None
+        if not sbx.is_valid(message):
+            return None
+        sbx.decode(message)
+        return sbx
+
+    blocksfound = 0
+    blocksmetafound = 0
+    starttime = time()
+    updatetime = starttime - 1
+    readsize = max(buffersize*1024, seqbox.PREFIX_SIZE)
+    pos = offset
+    nextstep = offset
+    expected = offset
+    while pos < filesize:
+        candidate = None
+        if pos == expected:
+            #blocks of a container follow each other, try there before searching
+            candidate = pos
+        else:
+            fin.seek(pos, 0)
+            buffer = fin.read(readsize)
+            found = buffer.find(magic)
+            if found >= 0:
+                candidate = pos + found
+            if step:
+                while nextstep < pos:
+                    nextstep += step
+                if nextstep < pos + len(buffer) and (candidate is None or nextstep < candidate):
+                    candidate = nextstep
+            if candidate is None:
+                #keep an overlap for a magic split between two reads
+                pos += max(1, len(buffer) - len(magic) + 1)
+                continue
+        sbx = read_block(candidate)
+        if not sbx:
+            pos = candidate + 1
+            continue
+        blocksfound += 1
+        if add_block(c, sbx, uids, filenum, candidate):
+            blocksmetafound += 1
+        pos = expected = candidate + sbx.blocksize
+
+        #status update
+        if time() > updatetime:
+            etime = max(time()-starttime, 1)
+            print("%5.1f%% blocks: %i - meta: %i - files: %i - %.2fMB/s" %
+                  (min(pos, filesize)*100.0/filesize, blocksfound, blocksmetafound,
+                   len(uids), pos/(1024*1024)/etime), end = "\r", flush=True)
+            conn.commit()
+            updatetime = time() + .5
+    fin.close()
+    conn.commit()
+    print("%5.1f%% blocks: %i - meta: %i - files: %i" %
+          (100, blocksfound, blocksmetafound, len(uids)))
+
 def main():
 
     cmdline = get_cmdline()
+    scan(cmdline.filename, dbfilename=cmdline.dbfilename, offset=cmdline.offset,
+         step=cmdline.step, buffersize=cmdline.buffer, sbx_ver=cmdline.sbxver,
+         password=cmdline.password)
 
+
+def scan(filenames_to_scan, dbfilename="sbxscan.db3", offset=0, step=0, buffersize=1024, sbx_ver=1, password=""):
     filenames = []
-    for filename in cmdline.filename:
+    for filename in filenames_to_scan:
         if os.path.exists(filename):
             filenames.append(filename)
         else:
             errexit(1, "file '%s' not found!" % (filename))
     filenames = sorted(set(filenames), key=os.path.getsize)
 
-    dbfilename = cmdline.dbfilename
     if os.path.isdir(dbfilename):
         dbfilename = os.path.join(dbfilename, "sbxscan.db3")
 
@@ -116,19 +220,18 @@ def main():
     c = conn.cursor()
     c.execute("CREATE TABLE sbx_source (id INTEGER, name TEXT)")
     c.execute("CREATE TABLE sbx_meta (uid INTEGER, size INTEGER, name TEXT, sbxname TEXT, datetime INTEGER, sbxdatetime INTEGER, fileid INTEGER)")
-    c.execute("CREATE TABLE sbx_uids (uid INTEGER, ver INTEGER)")
+    c.execute("CREATE TABLE sbx_uids (uid INTEGER, ver INTEGER, blocksize INTEGER, redsym INTEGER)")
     c.execute("CREATE TABLE sbx_blocks (uid INTEGER, num INTEGER, fileid INTEGER, pos INTEGER )")
     c.execute("CREATE INDEX blocks ON sbx_blocks (uid, num, pos)")
 
     #scan all the files/devices
-    sbx = seqbox.SbxBlock(ver=cmdline.sbxver)
-    offset = cmdline.offset
+    sbx = seqbox.SbxBlock(ver=sbx_ver)
     filenum = 0
     uids = {}
-    magic = b'SBx' + bytes([cmdline.sbxver])
-    if cmdline.password:
-        magic = seqbox.EncDec(cmdline.password, len(magic)).xor(magic)
-    scanstep = cmdline.step
+    magic = b'SBx' + bytes([sbx_ver])
+    if password:
+        magic = seqbox.EncDec(password, len(magic)).xor(magic)
+    scanstep = step
     if scanstep == 0:
         scanstep = sbx.blocksize
 
@@ -142,7 +245,11 @@ def main():
           (filenum, filename))
         conn.commit()
 
-        fin = open(filename, "rb", buffering=cmdline.buffer*1024)
+        if sbx_ver >= 3:
+            scan_v3(filename, filenum, filesize, c, conn, uids, offset, step, buffersize)
+            continue
+
+        fin = open(filename, "rb", buffering=buffersize*1024)
         blocksfound = 0
         blocksmetafound = 0
         updatetime = time() - 1
@@ -154,7 +261,7 @@ def main():
             try:
                 #decode with reed solomon
                 buffer = decode_data_block(buffer, sbx)
-            except crs.ReedSolomonError:
+            except seqbox.ReedSolomonError:
                 #not a sbx block or too many errors
                 pass
             #check for magic
@@ -166,9 +273,9 @@ def main():
                     if not sbx.uid in uids:
                         uids[sbx.uid] = True
                         c.execute(
-                                "INSERT INTO sbx_uids (uid, ver) VALUES (?, ?)",
+                                "INSERT INTO sbx_uids (uid, ver, blocksize, redsym) VALUES (?, ?, ?, ?)",
                                 (int.from_bytes(sbx.uid, byteorder='big'),
-                                sbx.ver))
+                                sbx.ver, sbx.blocksize, sbx.redsym))
                         docommit = True
 
                     #update blocks table
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import os
+import sys
+import argparse
+import hashlib
+import time
+import sqlite3
+
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxenc as sbxenc
+except ImportError:
+    pass
+try:
+    import sbxenc as sbxenc
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxdec as sbxdec
+except ImportError:
+    pass
+try:
+    import sbxdec as sbxdec
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxcheck as sbxcheck
+except ImportError:
+    pass
+try:
+    import sbxcheck as sbxcheck
+except ImportError:
+    pass
+
+PROGRAM_VER = "1.0.0"
+
+def get_cmdline():
+    """Evaluate command line parameters, usage & help."""
+    parser = argparse.ArgumentParser(
+             description="scrub a shield directory in the background",
+             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+             prefix_chars='-+')
+    parser.add_argument("-v", "--version", action='version',
+                        version='SeqBox - Sequenced Box container - ' +
+                        'Scrubber v%s' % PROGRAM_VER)
+    parser.add_argument("folder", action="store",
+                        help="shield directory to scrub")
+    parser.add_argument("-sv", "--sbxver", type=int, default=1,
+                        help="SBX blocks version", metavar="n")
+    parser.add_argument("-raid", "--raid", action="store_true", default=False,
+                        help="use and verify existing raid files")
+    parser.add_argument("-p", "--password", type=str, default="",
+                        help="decrypt/encrypt with password if password used", metavar="pass")
+    parser.add_argument("-mbps", "--mbps", type=float, default=10,
+                        help="read bandwidth budget in MB/s (0 = unlimited)", metavar="n")
+    parser.add_argument("-iops", "--iops", type=float, default=100,
+                        help="read operations per second budget (0 = unlimited)", metavar="n")
+    parser.add_argument("-l", "--ledger", type=str, default=None,
+                        help="ledger holding checkpoint and results (default: %s in the scrubbed folder)" % sbxcheck.LEDGER_FILENAME,
+                        metavar="filename")
+    parser.add_argument("-n", "--no-repair", action="store_true", default=False, dest="norepair",
+                        help="only report damage, do not repair")
+    parser.add_argument("-loop", "--loop", action="store_true", default=False,
+                        help="keep scrubbing, one pass after the other")
+    parser.add_argument("-i", "--interval", type=float, default=3600,
+                        help="seconds to wait between two passes", metavar="n")
+    res = parser.parse_args()
+    return res
+
+def errexit(errlev=1, mess=""):
+    """Display an error and exit."""
+    if mess != "":
+        sys.stderr.write("%s: error: %s\n" %
+                         (os.path.split(sys.argv[0])[1], mess))
+    sys.exit(errlev)
+
+class Throttle():
+    """Pace reads so they stay under a bandwidth and an IO operations budget"""
+
+    def __init__(self, mbps=0, iops=0):
+        self.bytes_per_sec = mbps * 1024*1024
+        self.iops = iops
+        self.nexttime = time.monotonic()
+
+    def consume(self, nbytes):
+        cost = 0
+        if self.bytes_per_sec > 0:
+            cost = nbytes / self.bytes_per_sec
+        if self.iops > 0:
+            cost = max(cost, 1 / self.iops)
+        #an idle period does not build up credit for a later burst
+        now = time.monotonic()
+        self.nexttime = max(self.nexttime, now) + cost
+        if self.nexttime > now:
+            time.sleep(self.nexttime - now)
+
+class Scrubber():
+    """Walk a shield directory, verify every container block by block and repair damage"""
+
+    def __init__(self, path_to_directory, sbx_ver=1, raid=False, password="",
+                 mbps=10, iops=100, ledger=None, repair=True, skip=None,
+                 claim=None, release=None):
+        self.path_to_directory = path_to_directory
+        self.sbx_ver = sbx_ver
+        self.raid = raid
+        self.password = password
+        self.repair = repair
+        #skip(path) tells if a plain file is busy and should be left alone
+        self.skip = skip
+        #claim(path) registers a plain file for a repair, False if it is busy;
+        #release(path) ends the registration
+        self.claim = claim
+        self.release = release
+        if not ledger:
+            ledger = os.path.join(path_to_directory, sbxcheck.LEDGER_FILENAME)
+        self.ledger = ledger
+        self.throttle = Throttle(mbps, iops)
+        self.checkpoint_interval = 10
+        #read about 64KB at once, one IO for many small blocks
+        self.blocks_per_read = max(1, 65536 // seqbox.SbxBlock(ver=sbx_ver).blocksize)
+
+    def list_containers(self):
+        containers = []
+        for dirpath, dirnames, filenames in os.walk(self.path_to_directory):
+            for file in filenames:
+                if file.endswith(".sbx"):
+                    containers.append(os.path.abspath(os.path.join(dirpath, file)))
+        #sorted, so a checkpoint still points to the right place on the next run
+        return sorted(containers)
+
+    def verify_blocks(self, path_to_file, sbx, startblock, interleave=1, datablocks=None,
+                      checkpoint=None):
+        """Classify every block of a container, returns the block numbers by state;
+        checkpoint(blocknum, damage) is called now and then to save the progress"""
+        damage = {"clean":0, "correctable":[], "lost":[]}
+        blockcount = os.path.getsize(path_to_file) // sbx.blocksize
+        if datablocks is None:
+            datablocks = blockcount - 1
+        lastcheckpoint = time.monotonic()
+        #reads start on a group boundary and take whole groups
+        startblock = seqbox.group_start(startblock, interleave, datablocks)
+        groups_per_read = max(1, self.blocks_per_read // interleave)
+        with open(path_to_file, "rb") as fin:
+            fin.seek(startblock * sbx.blocksize)
+            blocknum = startblock
+            while blocknum < blockcount:
+                if blocknum > datablocks:
+                    #index blocks are not interleaved
+                    count, groupsize = self.blocks_per_read, 1
+                elif blocknum == 0 and interleave > 1:
+                    count, groupsize = 1, 1
+                else:
+                    count = min(interleave * groups_per_read, datablocks + 1 - blocknum)
+                    groupsize = interleave
+                buffer = fin.read(sbx.blocksize * count)
+                if not buffer:
+                    break
+                self.throttle.consume(len(buffer))
+                for block in sbx.deinterleave(buffer, groupsize):
+                    expected = seqbox.expected_blocknum(blocknum, blockcount, datablocks)
+                    result = sbxdec.check_block(sbx, block, expected)
+                    if result == "clean":
+                        damage["clean"] += 1
+                    else:
+                        damage[result].append(blocknum)
+                    blocknum += 1
+                if checkpoint and time.monotonic() - lastcheckpoint > self.checkpoint_interval:
+                    checkpoint(blocknum, damage)
+                    lastcheckpoint = time.monotonic()
+        return damage
+
+    def hash_file(self, path_to_file):
+        d = hashlib.sha256()
+        with open(path_to_file, "rb") as fin:
+            while True:
+                buffer = fin.read(1024*1024)
+                if not buffer:
+                    break
+                self.throttle.consume(len(buffer))
+                d.update(buffer)
+        return d.digest()
+
+    def get_header_hash(self, sbxfilename):
+        header = seqbox.read_sbx_header(sbxfilename, ver=self.sbx_ver, raid=True)
+        return seqbox.header_digest(header.metadata) if header else None
+
+    def repair_container(self, sbxfilename, filename, plain_ok, damaged, raid_exists):
+        """Repair damaged blocks in place and/or restore the plain file"""
+        try:
+            if damaged:
+                print("repairing '%s'" % sbxfilename)
+                report = sbxdec.repair_container(sbxfilename, sbx_ver=self.sbx_ver, raid=raid_exists)
+                if report["unrecoverable"]:
+                    if not plain_ok:
+                        print("'%s' cannot be repaired!" % sbxfilename)
+                        return False
+                    #lost in every copy, but the plain file is still good
+                    print("rebuilding '%s'" % sbxfilename)
+                    sbxenc.encode(filename, sbxfilename=sbxfilename, overwrite=True,
+                                  sbx_ver=self.sbx_ver, raid=raid_exists, password=self.password)
+            if not plain_ok:
+                print("restoring '%s'" % filename)
+                sbxdec.decode(sbxfilename, filename=filename, overwrite=True,
+                              sbx_ver=self.sbx_ver, raid=raid_exists, password=self.password)
+        except (SystemExit, seqbox.ReedSolomonError):
+            print("'%s' cannot be repaired!" % sbxfilename)
+            return False
+        return True
+
+    def scrub_container(self, sbxfilename, db, startblock=0, starttwin=0):
+        """Verify one container (and its raid twin) and repair it if needed"""
+        filename = sbxfilename[:-4]
+        if self.skip and self.skip(filename):
+            return "busy"
+        raid_exists = self.raid and os.path.exists(sbxfilename+".raid")
+        try:
+            sbx = seqbox.block_for_file(sbxfilename, ver=self.sbx_ver, raid=raid_exists)
+        except seqbox.SbxDecodeError as err:
+            print(err)
+            return "lost"
+
+        #damage seen before an interruption is remembered in the checkpoint
+        damaged = int(db.GetState("scrub_damaged", 0)) if startblock or starttwin else 0
+        twins = [sbxfilename]
+        if raid_exists:
+            twins.append(sbxfilename+".raid")
+        metadata = seqbox.read_metadata(sbxfilename, sbx, raid_exists)
+        interleave = metadata.get("interleave", 1)
+        datablocks = seqbox.data_blocks(metadata, sbx)
+        for twin, path_to_file in enumerate(twins):
+            #a resumed scrub goes on in the twin it stopped in, the later ones
+            #are verified from their start
+            if twin < starttwin:
+                continue
+            def checkpoint(blocknum, damage, twin=twin):
+                db.SetState("scrub_twin", twin)
+                db.SetState("scrub_block", blocknum)
+                db.SetState("scrub_damaged", int(damaged or bool(damage["correctable"] or damage["lost"])))
+                db.commit()
+            damage = self.verify_blocks(path_to_file, sbx, startblock if twin == starttwin else 0,
+                                        interleave, datablocks, checkpoint)
+            if damage["correctable"] or damage["lost"]:
+                print("'%s': %i correctable, %i lost blocks" %
+                      (path_to_file, len(damage["correctable"]), len(damage["lost"])))
+                damaged = 1
+            db.SetState("scrub_twin", twin + 1)
+            db.SetState("scrub_block", 0)
+            db.SetState("scrub_damaged", damaged)
+            db.commit()
+
+        plain_ok = False
+        hash_inside_sbx_file = self.get_header_hash(sbxfilename)
+        if os.path.exists(filename) and hash_inside_sbx_file:
+            hash_of_file = self.hash_file(filename)
+            plain_ok = hash_of_file == hash_inside_sbx_file
+            if plain_ok:
+                db.SetEntry(filename, sbxcheck.get_signature(filename),
+                            hash_of_file, hash_inside_sbx_file)
+        if plain_ok and not damaged:
+            return "clean"
+        if not self.repair:
+            return "damaged"
+        #the file may have been opened while its container was verified
+        if self.skip and self.skip(filename):
+            return "busy"
+        if self.claim and not self.claim(filename):
+            return "busy"
+        try:
+            repaired = self.repair_container(sbxfilename, filename, plain_ok, damaged, raid_exists)
+        finally:
+            if self.release:
+                self.release(filename)
+        if not repaired:
+            db.RemoveEntry(filename)
+            return "lost"
+        db.SetEntry(filename, sbxcheck.get_signature(filename),
+                    hash_inside_sbx_file, hash_inside_sbx_file)
+        return "repaired"
+
+    def run_pass(self):
+        """One pass over the whole directory, resuming from the last checkpoint"""
+        db = sbxcheck.Ledger(self.ledger)
+        try:
+            return self.scrub_pass(db)
+        finally:
+            db.close()
+
+    def scrub_pass(self, db):
+        checkpoint = db.GetState("scrub_path", "")
+        startblock = int(db.GetState("scrub_block", 0))
+        starttwin = int(db.GetState("scrub_twin", 0))
+        results = {"clean":0, "damaged":0, "repaired":0, "lost":0, "busy":0}
+        for sbxfilename in self.list_containers():
+            if sbxfilename < checkpoint:
+                continue
+            if sbxfilename != checkpoint:
+                startblock = starttwin = 0
+                db.SetState("scrub_path", sbxfilename)
+                db.SetState("scrub_twin", 0)
+                db.SetState("scrub_block", 0)
+                db.SetState("scrub_damaged", 0)
+                db.commit()
+            result = self.scrub_container(sbxfilename, db, startblock, starttwin)
+            results[result] += 1
+            db.SetState("scrub_twin", 0)
+            db.SetState("scrub_block", 0)
+            db.commit()
+            startblock = starttwin = 0
+        #pass complete, the next one starts from the beginning
+        db.SetState("scrub_path", "")
+        db.SetState("scrub_twin", 0)
+        db.SetState("scrub_block", 0)
+        db.SetState("scrub_passes", int(db.GetState("scrub_passes", 0)) + 1)
+        db.SetState("scrub_lastpass", time.time())
+        return results
+
+    def run(self, forever=False, interval=3600):
+        while True:
+            try:
+                results = self.run_pass()
+            except sqlite3.OperationalError as err:
+                #the ledger is shared with the mount, the next pass resumes
+                #from the last checkpoint
+                print("scrub pass interrupted: %s" % err)
+                if not forever:
+                    return None
+                time.sleep(min(interval, 60))
+                continue
+            print("scrub pass done: %i clean, %i repaired, %i damaged, %i lost, %i busy" %
+                  (results["clean"], results["repaired"], results["damaged"],
+                   results["lost"], results["busy"]))
+            if not forever:
+                return results
+            time.sleep(interval)
+
+def scrub(folder, sbx_ver=1, raid=False, password="", mbps=10, iops=100,
+          ledger=None, repair=True, forever=False, interval=3600, skip=None):
+    if not os.path.isdir(folder):
+        return print("directory does not exist or is not a directory")
+    scrubber = Scrubber(folder, sbx_ver=sbx_ver, raid=raid, password=password,
+                        mbps=mbps, iops=iops, ledger=ledger, repair=repair, skip=skip)
+    return scrubber.run(forever=forever, interval=interval)
+
+def main():
+    cmdline = get_cmdline()
+    if not seqbox.supported_vers.__contains__(cmdline.sbxver):
+        errexit(1, "sbx version not supported")
+    if not os.path.isdir(cmdline.folder):
+        errexit(1, "folder '%s' not found" % (cmdline.folder))
+    scrub(cmdline.folder, sbx_ver=cmdline.sbxver, raid=cmdline.raid,
+          password=cmdline.password, mbps=cmdline.mbps, iops=cmdline.iops,
+          ledger=cmdline.ledger, repair=not cmdline.norepair,
+          forever=cmdline.loop, interval=cmdline.interval)
+
+if __name__ == '__main__':
+    main()
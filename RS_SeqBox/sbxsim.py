@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import numpy as np
+import os
+import sys
+import argparse
+import contextlib
+import json
+import random
+import shutil
+import tempfile
+
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxenc as sbxenc
+except ImportError:
+    pass
+try:
+    import sbxenc as sbxenc
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxdec as sbxdec
+except ImportError:
+    pass
+try:
+    import sbxdec as sbxdec
+except ImportError:
+    pass
+
+PROGRAM_VER = "1.0.0"
+
+MODELS = ["random", "burst", "sector"]
+#upper bound for one batch of damage masks (trials * container size)
+BATCH_BYTES = 1 << 26
+
+def get_cmdline():
+    """Evaluate command line parameters, usage & help."""
+    parser = argparse.ArgumentParser(
+             description="simulate damage on SBX containers in memory and " +
+                         "measure how often the file can still be recovered",
+             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+             prefix_chars='-+')
+    parser.add_argument("-v", "--version", action='version',
+                        version='SeqBox - Sequenced Box container - ' +
+                        'Damage simulator v%s' % PROGRAM_VER)
+    parser.add_argument("-s", "--size", type=int, default=3000,
+                        help="size of the simulated file in bytes")
+    parser.add_argument("-sv", "--sbxver", type=str, default="1,2",
+                        help="SBX blocks versions")
+    parser.add_argument("-bs", "--blocksize", type=int, default=seqbox.DEFAULT_BLOCKSIZE // 1024,
+                        help="block size in KiB (version 3)", metavar="n")
+    parser.add_argument("-rs", "--redsym", type=int, default=seqbox.DEFAULT_REDSYM,
+                        help="ECC symbols per codeword (version 3)", metavar="n")
+    parser.add_argument("-il", "--interleave", type=int, default=1,
+                        help="blocks per interleaving group", metavar="n")
+    parser.add_argument("-raid", "--raid", type=str, default="both",
+                        choices=["on", "off", "both"], help="simulate with/without raid copy")
+    parser.add_argument("-m", "--models", type=str, default=",".join(MODELS),
+                        help="damage models")
+    parser.add_argument("-r", "--rates", type=str, default="0:0.3:0.02",
+                        help="damage rates as a list (0.01,0.1) or a range (start:stop:step)")
+    parser.add_argument("-t", "--trials", type=int, default=1000,
+                        help="trials per damage rate", metavar="n")
+    parser.add_argument("-bl", "--burst", type=int, default=64,
+                        help="length of a burst in bytes (burst model)", metavar="n")
+    parser.add_argument("-ss", "--sector", type=int, default=512,
+                        help="sector size in bytes (sector model)", metavar="n")
+    parser.add_argument("-x", "--exact", action="store_true", default=False,
+                        help="RS decode every damaged block instead of only the ambiguous ones")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random generator", metavar="n")
+    parser.add_argument("-j", "--json", type=str, default=None, metavar="filename",
+                        help="write the curves as JSON")
+    res = parser.parse_args()
+    return res
+
+def errexit(errlev=1, mess=""):
+    """Display an error and exit."""
+    if mess != "":
+        sys.stderr.write("%s: error: %s\n" %
+                         (os.path.split(sys.argv[0])[1], mess))
+    sys.exit(errlev)
+
+def parse_rates(text):
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        return [round(v, 6) for v in np.arange(start, stop + step/2, step)]
+    return [float(v) for v in text.split(",")]
+
+class Container():
+    """An encoded container held in memory, with the geometry of its RS chunks"""
+
+    def __init__(self, size, sbx_ver=1, seed=0, blocksize=seqbox.DEFAULT_BLOCKSIZE,
+                 redsym=seqbox.DEFAULT_REDSYM, interleave=1):
+        self.sbx = seqbox.SbxBlock(ver=sbx_ver, blocksize=blocksize, redsym=redsym)
+        self.interleave = interleave
+        workdir = tempfile.mkdtemp(prefix="sbxsim")
+        try:
+            filename = os.path.join(workdir, "sim.bin")
+            with open(filename, "wb") as fout:
+                fout.write(random.Random(seed).randbytes(size))
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                sbxenc.encode(filename, sbxfilename=filename+".sbx", overwrite=True, sbx_ver=sbx_ver,
+                              blocksize=blocksize, redsym=redsym, interleave=interleave)
+            with open(filename+".sbx", "rb") as fin:
+                self.data = fin.read()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        self.size = len(self.data)
+        self.blocks = self.size // self.sbx.blocksize
+        #damage hits the bytes as stored, the decoder sees the blocks deinterleaved:
+        #data and masks are kept in block order
+        self.order = self.block_order()
+        self.data = np.frombuffer(self.data, dtype=np.uint8)[self.order].tobytes()
+        #every byte of a block belongs to one RS chunk (interleaved in version 3),
+        #each chunk corrects up to nsym/2 wrong bytes
+        index, nsyms = self.sbx.codeword_of_byte()
+        index = np.array(index)
+        positions = np.nonzero(index >= 0)[0]
+        self.positions = positions[np.argsort(index[positions], kind="stable")]
+        self.chunks = np.searchsorted(index[self.positions], np.arange(len(nsyms)))
+        self.correctable = np.array(nsyms) // 2
+        self.messages = [sbxdec.decode_block(self.sbx, self.block(blocknum))
+                         for blocknum in range(self.blocks)]
+
+    def block_order(self):
+        """For every byte of the deinterleaved blocks its position in the container"""
+        blocksize = self.sbx.blocksize
+        keep = self.sbx.interleave_keep
+        order = [np.arange(blocksize)]
+        for start in range(1, self.blocks, self.interleave):
+            count = min(self.interleave, self.blocks - start)
+            positions = np.arange(start * blocksize, (start+count) * blocksize).reshape(count, blocksize)
+            body = positions[:, keep:].reshape(-1)
+            for j in range(count):
+                order.append(np.concatenate([positions[j, :keep], body[j::count]]))
+        return np.concatenate(order)
+
+    def in_block_order(self, masks):
+        return masks[:, self.order]
+
+    def block(self, blocknum, data=None):
+        data = self.data if data is None else data
+        return data[blocknum * self.sbx.blocksize:(blocknum+1) * self.sbx.blocksize]
+
+    def chunk_errors(self, masks):
+        """Count the damaged bytes of every chunk: (trials, blocks, chunks)"""
+        masks = masks[:, :self.blocks * self.sbx.blocksize].reshape(
+            len(masks), self.blocks, self.sbx.blocksize)
+        return np.add.reduceat(masks[:, :, self.positions], self.chunks, axis=2, dtype=np.int32)
+
+    def damaged_block(self, blocknum, mask, rng):
+        """The bytes of one block with every masked byte changed to another value"""
+        block = np.frombuffer(self.block(blocknum), dtype=np.uint8).copy()
+        blockmask = self.block(blocknum, mask)
+        block[blockmask] ^= rng.integers(1, 256, int(blockmask.sum()), dtype=np.uint8)
+        return block.tobytes()
+
+    def decodes_to_original(self, blocknum, mask, rng):
+        """RS decode a damaged block from memory, None if the decoder gives up"""
+        try:
+            message = sbxdec.decode_block(self.sbx, self.damaged_block(blocknum, mask, rng))
+        except seqbox.ReedSolomonError:
+            return None
+        return message == self.messages[blocknum]
+
+def damage_masks(model, rate, trials, size, rng, burst=64, sector=512):
+    """Boolean masks (trials, size) of the bytes hit by a damage model"""
+    if model == "random":
+        #every byte is hit independently
+        return rng.random((trials, size)) < rate
+    if model == "burst":
+        #bursts of consecutive bytes, starting so that on average rate of the bytes are hit
+        starts = (rng.random((trials, size)) < rate / burst).astype(np.int32)
+        ends = np.cumsum(starts, axis=1)
+        ends[:, burst:] -= ends[:, :-burst].copy()
+        return ends > 0
+    if model == "sector":
+        #whole sectors are lost, aligned to the start of the container
+        sectors = rng.random((trials, -(-size // sector))) < rate
+        return np.repeat(sectors, sector, axis=1)[:, :size]
+    raise ValueError("unknown damage model '%s'" % model)
+
+def simulate_batch(container, masks, raid_masks, rng, exact=False):
+    """Tell for every trial of a batch how many blocks the decoder would lose"""
+    #a chunk with more wrong bytes than it can correct never gives back the
+    #original message: the decoder either gives up or miscorrects
+    masks = container.in_block_order(masks)
+    if raid_masks is not None:
+        raid_masks = container.in_block_order(raid_masks)
+    over = (container.chunk_errors(masks) > container.correctable).any(axis=2)
+    damaged = masks[:, :container.blocks * container.sbx.blocksize].reshape(
+        len(masks), container.blocks, -1).any(axis=2)
+    if raid_masks is not None:
+        over_raid = (container.chunk_errors(raid_masks) > container.correctable).any(axis=2)
+        damaged_raid = raid_masks[:, :container.blocks * container.sbx.blocksize].reshape(
+            len(masks), container.blocks, -1).any(axis=2)
+    lost = np.zeros(len(masks), dtype=np.int32)
+    for trial in range(len(masks)):
+        blocknums = np.nonzero(damaged[trial] if exact else over[trial])[0]
+        for blocknum in blocknums:
+            if not exact and (raid_masks is None or over_raid[trial, blocknum]):
+                lost[trial] += 1
+                continue
+            #same order as sbxdec.decode: the raid copy is tried when the primary
+            #one can not be decoded or decodes to a block with a wrong CRC
+            result = container.decodes_to_original(blocknum, masks[trial], rng)
+            if not result and raid_masks is not None:
+                if exact and damaged_raid[trial, blocknum]:
+                    result = container.decodes_to_original(blocknum, raid_masks[trial], rng)
+                else:
+                    result = not over_raid[trial, blocknum]
+            if not result:
+                lost[trial] += 1
+    return lost
+
+def simulate(container, model, rates, trials=1000, raid=False, seed=0, burst=64,
+             sector=512, exact=False):
+    """Recoverability curve of a container under a damage model"""
+    rng = np.random.default_rng(seed)
+    #the values written over damaged bytes come from their own stream, so the
+    #masks are the same whether every block is decoded or not
+    values_rng = np.random.default_rng([seed, 1])
+    batch = max(1, BATCH_BYTES // container.size)
+    curve = []
+    for rate in rates:
+        lost = []
+        for first in range(0, trials, batch):
+            count = min(batch, trials - first)
+            masks = damage_masks(model, rate, count, container.size, rng, burst, sector)
+            raid_masks = None
+            if raid:
+                raid_masks = damage_masks(model, rate, count, container.size, rng, burst, sector)
+            lost.append(simulate_batch(container, masks, raid_masks, values_rng, exact))
+        lost = np.concatenate(lost)
+        curve.append({"rate":rate,
+                      "trials":trials,
+                      "recovered":int((lost == 0).sum()),
+                      "probability":float((lost == 0).mean()),
+                      "mean_lost_blocks":float(lost.mean())})
+    return curve
+
+def main():
+    cmdline = get_cmdline()
+    versions = [int(v) for v in cmdline.sbxver.split(",")]
+    for v in versions:
+        if not seqbox.supported_vers.__contains__(v):
+            errexit(1, "sbx version %i not supported" % v)
+    models = [m.strip() for m in cmdline.models.split(",")]
+    for model in models:
+        if model not in MODELS:
+            errexit(1, "unknown damage model '%s'" % model)
+    rates = parse_rates(cmdline.rates)
+    raids = {"on":[True], "off":[False], "both":[False, True]}[cmdline.raid]
+
+    results = []
+    for sbx_ver in versions:
+        try:
+            container = Container(cmdline.size, sbx_ver=sbx_ver, seed=cmdline.seed,
+                                  blocksize=cmdline.blocksize*1024, redsym=cmdline.redsym,
+                                  interleave=cmdline.interleave)
+        except seqbox.SbxError as err:
+            errexit(1, str(err))
+        for raid in raids:
+            for model in models:
+                print("SBX v%i, raid %s, %s damage, %i blocks" %
+                      (sbx_ver, "on" if raid else "off", model, container.blocks))
+                curve = simulate(container, model, rates, cmdline.trials, raid,
+                                 cmdline.seed, cmdline.burst, cmdline.sector, cmdline.exact)
+                for point in curve:
+                    print("  %6.2f%%  recovered %6.2f%%  lost blocks %7.2f" %
+                          (point["rate"]*100, point["probability"]*100,
+                           point["mean_lost_blocks"]))
+                results.append({"version":sbx_ver, "raid":raid, "model":model,
+                                "interleave":cmdline.interleave,
+                                "size":cmdline.size, "blocks":container.blocks,
+                                "curve":curve})
+
+    if cmdline.json:
+        with open(cmdline.json, "w") as fout:
+            json.dump({"program_ver":PROGRAM_VER, "trials":cmdline.trials,
+                       "burst":cmdline.burst, "sector":cmdline.sector,
+                       "seed":cmdline.seed, "results":results}, fout, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import os
+import threading
+import time
+
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxcheck as sbxcheck
+except ImportError:
+    pass
+try:
+    import sbxcheck as sbxcheck
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxmerkle as sbxmerkle
+except ImportError:
+    pass
+try:
+    import sbxmerkle as sbxmerkle
+except ImportError:
+    pass
+try:
+    import RS_SeqBox.sbxpar as sbxpar
+except ImportError:
+    pass
+try:
+    import sbxpar as sbxpar
+except ImportError:
+    pass
+
+#files next to a plain file that make up its shield
+SHIELD_SUFFIXES = (".sbx", ".sbx.raid", ".sbx"+sbxpar.PAR_EXT, ".sbx"+sbxmerkle.MKL_EXT)
+
+class WarmIndex():
+    """State of every plain file of a shield directory, built in the background so
+    that opening a file does not have to hash it first.
+
+    An entry is {"state", "signature", "hash", "sbxhash", "raid"}: the state is
+    "shielded" (the file matches the hash in its container), "stale" (it does
+    not) or "unshielded" (there is no container); the signature is the stat
+    signature of the file and its container (see sbxcheck.get_signature), an
+    entry only counts while it still matches. Files the ledger of sbxcheck
+    already verified with the same signature are not hashed again."""
+
+    def __init__(self, path_to_directory, sbx_ver=1, raid=False, ledger=None,
+                 shield=None, threads=None):
+        self.path_to_directory = path_to_directory
+        self.sbx_ver = sbx_ver
+        self.raid = raid
+        if not ledger:
+            ledger = os.path.join(path_to_directory, sbxcheck.LEDGER_FILENAME)
+        self.ledger = ledger
+        #shield(path) encodes an unshielded file, False if it is busy
+        self.shield = shield
+        self.threads = threads or os.cpu_count() or 1
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def list_files(self):
+        files = []
+        ledger = os.path.abspath(self.ledger)
+        for dirpath, dirnames, filenames in os.walk(self.path_to_directory):
+            for file in filenames:
+                path_to_file = os.path.abspath(os.path.join(dirpath, file))
+                if (file.endswith(SHIELD_SUFFIXES) or path_to_file.startswith(ledger) or
+                    ".trashinfo" in file or not os.path.isfile(path_to_file)):
+                    continue
+                files.append(path_to_file)
+        return sorted(files)
+
+    def signature(self, path_to_file):
+        try:
+            return sbxcheck.get_signature(path_to_file)
+        except OSError:
+            return None
+
+    def verify(self, path_to_file, db):
+        """Entry of one file, hashing it unless the ledger vouches for it"""
+        signature = self.signature(path_to_file)
+        raid = os.path.exists(path_to_file+".sbx.raid")
+        if signature is None:
+            state = "unshielded" if not os.path.exists(path_to_file+".sbx") else "stale"
+            return {"state":state, "signature":None, "hash":None, "sbxhash":None, "raid":raid}
+        entry = db.GetEntry(path_to_file)
+        if entry and entry["signature"] == signature:
+            return {"state":"shielded", "signature":signature, "hash":entry["hash"],
+                    "sbxhash":entry["sbxhash"], "raid":raid}
+        tree = sbxmerkle.load(path_to_file+".sbx", sbx_ver=self.sbx_ver, raid=self.raid)
+        if tree:
+            #the leaves are hashed in parallel
+            hash_of_file = b"" if tree.verify_range(path_to_file, threads=self.threads) else tree.root
+            hash_inside_sbx_file = tree.root
+        else:
+            hash_of_file = sbxcheck.get_hash_of_normal_file(path_to_file)
+            header = seqbox.read_sbx_header(path_to_file+".sbx", ver=self.sbx_ver, raid=self.raid)
+            hash_inside_sbx_file = seqbox.header_digest(header.metadata) if header else None
+        if hash_of_file == hash_inside_sbx_file:
+            db.SetEntry(path_to_file, signature, hash_of_file, hash_inside_sbx_file)
+            state = "shielded"
+        else:
+            db.RemoveEntry(path_to_file)
+            state = "stale"
+        return {"state":state, "signature":signature, "hash":hash_of_file,
+                "sbxhash":hash_inside_sbx_file, "raid":raid}
+
+    def scan(self):
+        """Build the table, then shield the files that have no container; returns
+        the number of files per state"""
+        db = sbxcheck.Ledger(self.ledger)
+        unshielded = []
+        try:
+            for path_to_file in self.list_files():
+                try:
+                    entry = self.verify(path_to_file, db)
+                except OSError:
+                    continue
+                finally:
+                    #one short transaction per file, the scrubber shares the ledger
+                    db.commit()
+                with self.lock:
+                    self.entries[path_to_file] = entry
+                if entry["state"] == "unshielded":
+                    unshielded.append(path_to_file)
+            #the first opens do not wait for the encoding
+            self.ready.set()
+            for path_to_file in unshielded:
+                if self.shield and os.path.exists(path_to_file) and self.shield(path_to_file):
+                    self.verified(path_to_file, db=db)
+                    db.commit()
+        finally:
+            self.ready.set()
+            db.close()
+        counts = {"shielded":0, "stale":0, "unshielded":0}
+        with self.lock:
+            for entry in self.entries.values():
+                counts[entry["state"]] += 1
+        return counts
+
+    def run(self):
+        starttime = time.monotonic()
+        counts = self.scan()
+        print("warm index done in %.1fs: %i shielded, %i stale, %i unshielded" %
+              (time.monotonic() - starttime, counts["shielded"], counts["stale"],
+               counts["unshielded"]))
+
+    def lookup(self, path_to_file):
+        """The entry of a file, None if it is not known or changed since"""
+        path_to_file = os.path.abspath(path_to_file)
+        with self.lock:
+            entry = self.entries.get(path_to_file)
+        if entry is None or entry["signature"] != self.signature(path_to_file):
+            return None
+        return entry
+
+    def is_shielded(self, path_to_file):
+        entry = self.lookup(path_to_file)
+        return entry is not None and entry["state"] == "shielded"
+
+    def verified(self, path_to_file, db=None):
+        """Record a file that matches its container as it is now, e.g. right after
+        it was encoded, without hashing it again"""
+        path_to_file = os.path.abspath(path_to_file)
+        signature = self.signature(path_to_file)
+        if signature is None:
+            return
+        header = seqbox.read_sbx_header(path_to_file+".sbx", ver=self.sbx_ver, raid=self.raid)
+        digest = seqbox.header_digest(header.metadata) if header else None
+        if db:
+            db.SetEntry(path_to_file, signature, digest, digest)
+        with self.lock:
+            self.entries[path_to_file] = {"state":"shielded", "signature":signature, "hash":digest,
+                                          "sbxhash":digest,
+                                          "raid":os.path.exists(path_to_file+".sbx.raid")}
+
+    def move(self, path_old, path_new):
+        """Carry the entry of a renamed file over, if the file itself did not change"""
+        with self.lock:
+            entry = self.entries.pop(os.path.abspath(path_old), None)
+        signature = self.signature(path_new)
+        if entry and entry["state"] == "shielded" and signature and entry["signature"][:3] == signature[:3]:
+            self.verified(path_new)
+
+    def forget(self, path_to_file):
+        with self.lock:
+            self.entries.pop(os.path.abspath(path_to_file), None)
@@ -29,12 +29,41 @@ import binascii
 import hashlib
 import os
 import random
+import struct
 import sys
+import threading
+import time
+from collections import OrderedDict
 
-#from reedsolo import ReedSolomonError, RSCodec
-import creedsolo.creedsolo as crs
+try:
+    import RS_SeqBox.rsbatch as rsbatch
+except ImportError:
+    pass
+try:
+    import rsbatch as rsbatch
+except ImportError:
+    pass
+
+supported_vers = [1,2,3]
+
+#version 3 blocks start with a small codeword of their own, so the block
+#geometry can be read before the rest of the block is decoded
+PREFIX_SIZE = 64
+PREFIX_REDSYM = 32
+BLOCKSIZE_EXPS = range(16, 21) #64 KiB to 1 MiB
+DEFAULT_BLOCKSIZE = 65536
+DEFAULT_REDSYM = 32
 
-supported_vers = [1,2]
+#index blocks at the end of a container count down from this block number,
+#the last block of the file is the first index block
+INDEX_BLOCKNUM = 0xFFFFFFFF
+INDEX_MAX_BLOCKS = 0x10000
+INDEX_MAGIC = b'SBxI'
+#magic, format, sbx version, block size, redsym, raw data per block, data blocks,
+#file size, padding of the last block, interleave, parity group, parity blocks,
+#hash type, hash length, data blocks per hash, hashes, index blocks
+INDEX_FORMAT = ">4sBBIBIIQIHHBBBIIH"
+INDEX_HASH_BYTES = 1024*1024 #data covered by one hash
 
 #Some custom exceptions
 class SbxError(Exception):
@@ -42,13 +71,165 @@ class SbxError(Exception):
 
 class SbxDecodeError(SbxError):
     pass   
+
+class ReedSolomonError(Exception):
+    """A codeword that can not be corrected, whatever backend decoded it"""
+    pass
+
+#Reed-Solomon backends, they all give the same codewords: name -> loader of the
+#codec class and of the error it raises, ImportError if it is not installed
+def _load_creedsolo():
+    import creedsolo.creedsolo as module
+    return module.RSCodec, module.ReedSolomonError
+
+def _load_reedsolo():
+    import reedsolo as module
+    return module.RSCodec, module.ReedSolomonError
+
+RS_BACKENDS = OrderedDict([("creedsolo", _load_creedsolo), ("reedsolo", _load_reedsolo)])
+#a backend name, or auto for the fastest one that works
+RS_BACKEND = os.environ.get("SBX_RS_BACKEND", "auto")
+#on, off, or auto to use the NumPy batch encoder only if it beats the backend
+RS_BATCH = os.environ.get("SBX_RS_BATCH", "auto")
+
+#codeword of bytes(range(256))+bytes(range(38)) with 108 ECC symbols
+_PROBE_DIGEST = "94511919c4aff3f7187b3c91a60c97ecfb38469fd12b09a56defe7f930b45f18"
+_PROBE = bytes(range(256)) + bytes(range(38))
+
+def register_backend(name, loader):
+    """Add a backend, e.g. a native one; it is used by name or when it is timed"""
+    RS_BACKENDS[name] = loader
+
+class RSCodec():
+    """A codec of a backend, that raises its errors as ReedSolomonError"""
+
+    def __init__(self, codec, error):
+        self.codec = codec
+        self.error = error
+        self.nsym = codec.nsym
+        self.nsize = codec.nsize
+
+    def encode(self, data):
+        try:
+            return self.codec.encode(data)
+        except self.error as err:
+            raise ReedSolomonError(*err.args) from err
+
+    def decode(self, data, erase_pos=None, only_erasures=False):
+        try:
+            return self.codec.decode(data, erase_pos=erase_pos, only_erasures=only_erasures)
+        except self.error as err:
+            raise ReedSolomonError(*err.args) from err
+
+def _time_backend(loader, best=None):
+    """Seconds to encode and correct a version 1 block, None if the backend is
+    not installed or gets it wrong; stops once it is slower than best"""
+    try:
+        codec_class, error = loader()
+        rsc = RSCodec(codec_class(108), error)
+    except ImportError:
+        return None
+    seconds = None
+    for _ in range(3):
+        starttime = time.perf_counter()
+        try:
+            codeword = bytearray(rsc.encode(bytearray(_PROBE)))
+            if hashlib.sha256(codeword).hexdigest() != _PROBE_DIGEST:
+                return None
+            codeword[0] ^= 0xFF
+            codeword[200] ^= 0x55
+            if bytes(rsc.decode(codeword)[0]) != _PROBE:
+                return None
+        except Exception:
+            return None
+        elapsed = time.perf_counter() - starttime
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+        if best is not None and seconds > best:
+            break
+    return seconds
+
+def _time_batch(rsc):
+    """True if the NumPy batch encoder gives the codewords of rsc, faster"""
+    batch = rsbatch.encoder(rsc.nsym)
+    if batch is None:
+        return False
+    messages = [_PROBE[i:] + _PROBE[:i] for i in range(64)]
+    starttime = time.perf_counter()
+    codewords = [bytes(rsc.encode(bytearray(message))) for message in messages]
+    single = time.perf_counter() - starttime
+    starttime = time.perf_counter()
+    same = batch.encode(messages) == codewords
+    return same and time.perf_counter() - starttime < single
+
+#backend name, codec class, error class and whether sbxenc batches are encoded
+#with NumPy; chosen at the first codec that is made
+_backend = None
+_backend_lock = threading.Lock()
+
+def select_backend(name="auto", batch="auto"):
+    """Use a Reed-Solomon backend by name, or time the installed ones and take
+    the fastest. The codecs made before keep their backend"""
+    global _backend
+    if name == "auto":
+        best = None
+        for candidate, loader in RS_BACKENDS.items():
+            seconds = _time_backend(loader, best[0] if best else None)
+            if seconds is not None and (best is None or seconds < best[0]):
+                best = (seconds, candidate)
+        if best is None:
+            raise SbxError("no Reed-Solomon backend installed (%s)" % ", ".join(RS_BACKENDS))
+        name = best[1]
+    if name not in RS_BACKENDS:
+        raise SbxError("unknown Reed-Solomon backend '%s'" % name)
+    try:
+        codec_class, error = RS_BACKENDS[name]()
+    except ImportError as err:
+        raise SbxError("Reed-Solomon backend '%s' not installed: %s" % (name, err))
+    if batch == "auto":
+        use_batch = _time_batch(RSCodec(codec_class(108), error))
+    else:
+        use_batch = batch == "on" and rsbatch.np is not None
+    with _backend_lock:
+        _backend = (name, codec_class, error, use_batch)
+        _rscodecs.clear()
+    return name
+
+def backend():
+    """Name of the Reed-Solomon backend in use"""
+    with _backend_lock:
+        if _backend is not None:
+            return _backend[0]
+    return select_backend(RS_BACKEND, RS_BATCH)
+
+#Reed-Solomon codecs shared by the whole process: building one recomputes the
+#generator polynomial, so each set of parameters is only built once
+_rscodecs = {}
+def rscodec(nsym, nsize=255, fcr=0, prim=0x11d, generator=2, c_exp=8):
+    """The codec for nsym ECC symbols over the given Galois field"""
+    key = (nsym, nsize, fcr, prim, generator, c_exp)
+    rsc = _rscodecs.get(key)
+    if rsc is None:
+        backend()
+        name, codec_class, error, use_batch = _backend
+        rsc = RSCodec(codec_class(nsym, nsize=nsize, fcr=fcr, prim=prim, generator=generator,
+                                  c_exp=c_exp), error)
+        _rscodecs[key] = rsc
+    return rsc
+
+def batch_encoder(nsym):
+    """The NumPy encoder for batches of messages, None to encode them one by one"""
+    backend()
+    return rsbatch.encoder(nsym) if _backend[3] else None
+
 class SbxBlock():
     """
     Implement a basic SBX block
     """
-    def __init__(self, ver=1, uid="r",pswd=""):
+    def __init__(self, ver=1, uid="r",pswd="", blocksize=DEFAULT_BLOCKSIZE, redsym=DEFAULT_REDSYM):
         self.ver = ver
         self.padding_last_block = 0
+        #names left out of the last header encoded, they did not fit
+        self.dropped_names = []
 
         if ver == 1:
             self.blocksize = 512 #Total Block size
@@ -57,7 +238,7 @@ class SbxBlock():
             self.redsym = 108 #How many ECC symbols are used
             self.padding_normal_block = 2 #What Padding occurs at the end of normal blocks
             self.raw_data_size_read_into_1_block = 278 #How many bytes can be read from the file
-            self.rsc_for_data_block = crs.RSCodec(self.redsym) #rsc means Reed-Solomon_Code
+            self.rsc_for_data_block = rscodec(self.redsym) #rsc means Reed-Solomon_Code
         if ver == 2:
             self.blocksize = 4096 
             self.hdrsize = 16
@@ -65,12 +246,29 @@ class SbxBlock():
             self.redsym = 107
             self.padding_normal_block = 16
             self.raw_data_size_read_into_1_block = 2352
-            self.rsc_for_data_block = crs.RSCodec(self.redsym)
-            
+            self.rsc_for_data_block = rscodec(self.redsym)
+        if ver == 3:
+            #large blocks made of full 255 byte codewords, interleaved after the prefix
+            if blocksize.bit_length()-1 not in BLOCKSIZE_EXPS or blocksize & (blocksize-1):
+                raise SbxError("block size %i not supported" % blocksize)
+            if not 2 <= redsym <= 128:
+                raise SbxError("%i ECC symbols not supported" % redsym)
+            self.blocksize = blocksize
+            self.hdrsize = 16
+            self.redsym = redsym
+            self.codewords = (blocksize - PREFIX_SIZE) // 255
+            self.padding_normal_block = blocksize - PREFIX_SIZE - self.codewords * 255
+            self.raw_data_size_read_into_1_block = self.codewords * (255 - redsym)
+            self.redsize = blocksize - self.hdrsize - self.raw_data_size_read_into_1_block
+            self.rsc_for_data_block = rscodec(self.redsym)
+            self.rsc_for_prefix = rscodec(PREFIX_REDSYM)
+
         if not supported_vers.__contains__(ver):
             raise SbxError("version %i not supported" % ver)
 
         self.datasize = self.blocksize - self.hdrsize
+        #bytes at the start of a block left in place by the cross-block interleaving
+        self.interleave_keep = PREFIX_SIZE if ver >= 3 else self.hdrsize
         self.magic = b'SBx' + bytes([ver])
         self.blocknum = 0
 
@@ -92,12 +290,6 @@ class SbxBlock():
         if self.blocknum == 0:
             #Header Block encoding
             self.data = b""
-            if "filename" in self.metadata:
-                bb = self.metadata["filename"].encode()
-                self.data += b"FNM" + bytes([len(bb)]) + bb
-            if "sbxname" in self.metadata:
-                bb = self.metadata["sbxname"].encode()
-                self.data += b"SNM" + bytes([len(bb)]) + bb
             if "filesize" in self.metadata:
                 bb = self.metadata["filesize"].to_bytes(8, byteorder='big')
                 self.data += b"FSZ" + bytes([len(bb)]) + bb
@@ -110,12 +302,53 @@ class SbxBlock():
             if "hash" in self.metadata:
                 bb = self.metadata["hash"]
                 self.data += b"HSH" + bytes([len(bb)]) + bb
+            if "merkle" in self.metadata:
+                #multihash of the root of the tree in the .mkl sidecar
+                bb = self.metadata["merkle"]
+                self.data += b"MKL" + bytes([len(bb)]) + bb
             if "padding_last_block" in self.metadata:
-                bb = self.metadata["padding_last_block"].to_bytes(2,byteorder="big")
+                #version 3 blocks can hold more than 64 KiB of padding
+                bb = self.metadata["padding_last_block"].to_bytes(2 if self.ver < 3 else 4,byteorder="big")
                 self.data += b"PAD" + bytes([len(bb)]) + bb 
             if "redundancy_level" in self.metadata:
                 bb = self.metadata["redundancy_level"].to_bytes(1,byteorder="big")
                 self.data += b"RSL" + bytes([len(bb)]) + bb        
+            if "blocksize" in self.metadata:
+                bb = bytes([self.metadata["blocksize"].bit_length()-1])
+                self.data += b"BSZ" + bytes([len(bb)]) + bb
+            if self.metadata.get("interleave", 1) > 1:
+                bb = self.metadata["interleave"].to_bytes(2,byteorder="big")
+                self.data += b"ILV" + bytes([len(bb)]) + bb
+            if "index" in self.metadata:
+                bb = self.metadata["index"].to_bytes(2,byteorder="big")
+                self.data += b"IDX" + bytes([len(bb)]) + bb
+            if "compression" in self.metadata:
+                #codec, chunk size and size of the file before compression
+                codec, chunksize, plainsize = self.metadata["compression"]
+                bb = (bytes([codec]) + chunksize.to_bytes(4,byteorder="big") +
+                      plainsize.to_bytes(8,byteorder="big"))
+                self.data += b"CMP" + bytes([len(bb)]) + bb
+            if "parity" in self.metadata:
+                #data blocks per group and parity blocks per group, in the .par sidecar
+                group, parity = self.metadata["parity"]
+                bb = group.to_bytes(2,byteorder="big") + bytes([parity])
+                self.data += b"PAR" + bytes([len(bb)]) + bb
+            #the names go first, in the room the other fields leave. A name is
+            #stored whole or not at all, the file name before the container
+            #name: a cut path would be decoded to the wrong place
+            self.dropped_names = []
+            room = self.raw_data_size_read_into_1_block - len(self.data)
+            prefix = b""
+            for metaid, key in ((b"FNM", "filename"), (b"SNM", "sbxname")):
+                if key not in self.metadata:
+                    continue
+                bb = self.metadata[key].encode()
+                if len(bb) > 255 or 4 + len(bb) > room:
+                    self.dropped_names.append(key)
+                    continue
+                prefix += metaid + bytes([len(bb)]) + bb
+                room -= 4 + len(bb)
+            self.data = prefix + self.data
             buffer = (self.uid +
                   self.blocknum.to_bytes(4, byteorder='big') +
                   self.data)
@@ -123,21 +356,177 @@ class SbxBlock():
             block = self.magic + crc + buffer
 
             block += b'\x1A'* (self.datasize-self.redsize+self.hdrsize-len(block))
-            block = self.rsc_for_data_block.encode(bytearray(block))
-            block = bytes(block) + b'\x1A' * (self.blocksize - len(block))
+            block = self.rs_encode(block)
         else: 
                 buffer = (self.uid + self.blocknum.to_bytes(4, byteorder='big') + self.data)
                 crc = binascii.crc_hqx(buffer, self.ver).to_bytes(2,byteorder='big')
                 #Assemble whole Block
                 block = self.magic + crc + buffer
-                block = bytes(self.rsc_for_data_block.encode(bytearray(block)))
-            
-                len_before_padding = len(block)
-                block = block + b'\x1A' * (self.blocksize - len(block))
-                len_after_padding = len(block)
-                self.padding_last_block = len_after_padding -len_before_padding   
+                block = self.rs_encode(block)
+                self.padding_last_block = self.padding_normal_block
         return block
 
+    def rs_encode(self, message):
+        """RS encode a whole message (header fields + data) into a raw block"""
+        if self.ver < 3:
+            block = bytes(self.rsc_for_data_block.encode(bytearray(message)))
+            return block + b'\x1A' * (self.blocksize - len(block))
+        prefix = (bytes(message[:16]) +
+                  bytes([self.blocksize.bit_length()-1, self.redsym]) +
+                  b'\x1A' * (PREFIX_SIZE - PREFIX_REDSYM - 18))
+        prefix = bytes(self.rsc_for_prefix.encode(bytearray(prefix)))
+        body = self.rsc_for_data_block.encode(bytearray(message[16:]))
+        #symbol i of every codeword is stored next to each other, so a burst
+        #of damage is spread over all the codewords of the block
+        n = self.codewords
+        out = bytearray(n * 255)
+        for i in range(255):
+            out[i*n:(i+1)*n] = body[i::255]
+        return prefix + bytes(out) + b'\x1A' * self.padding_normal_block
+
+    def encode_data_blocks(self, buffers):
+        """Raw blocks of consecutive data blocks, numbered on from self.blocknum; all
+        the buffers have the raw data size. The ECC of the whole batch is computed
+        at once when the NumPy batch encoder is in use"""
+        batch = batch_encoder(self.redsym) if len(buffers) > 1 else None
+        if batch is None:
+            blocks = []
+            for buffer in buffers:
+                self.blocknum += 1
+                self.data = buffer
+                blocks.append(self.encode())
+            return blocks
+        messages = []
+        for buffer in buffers:
+            self.blocknum += 1
+            buffer = self.uid + self.blocknum.to_bytes(4, byteorder='big') + buffer
+            crc = binascii.crc_hqx(buffer, self.ver).to_bytes(2,byteorder='big')
+            messages.append(self.magic + crc + buffer)
+        self.data = buffers[-1]
+        self.padding_last_block = self.padding_normal_block
+        padding = b'\x1A' * self.padding_normal_block
+        if self.ver < 3:
+            return [codeword + padding for codeword in batch.encode(messages)]
+        geometry = (bytes([self.blocksize.bit_length()-1, self.redsym]) +
+                    b'\x1A' * (PREFIX_SIZE - PREFIX_REDSYM - 18))
+        prefixes = batch_encoder(PREFIX_REDSYM).encode([message[:16] + geometry for message in messages])
+        bodies = batch.encode([message[16:] for message in messages], interleave=True)
+        return [prefix + body + padding for prefix, body in zip(prefixes, bodies)]
+
+    def _codewords(self, buffer):
+        """Split a raw block in (codec, codeword) pairs"""
+        if self.ver < 3:
+            return [(self.rsc_for_data_block, bytes(buffer[:self.blocksize-self.padding_normal_block]))]
+        n = self.codewords
+        body = bytearray(n * 255)
+        for i in range(255):
+            body[i::255] = buffer[PREFIX_SIZE+i*n:PREFIX_SIZE+(i+1)*n]
+        return [(self.rsc_for_prefix, bytes(buffer[:PREFIX_SIZE])), (self.rsc_for_data_block, bytes(body))]
+
+    def clean_message(self, buffer):
+        """The message of a raw block if it has no errors, None otherwise"""
+        #the code is systematic: if encoding the message part again gives back the
+        #same codeword all syndromes are zero, and this is a lot cheaper than decoding
+        message = b""
+        for rsc, codeword in self._codewords(buffer):
+            part = message_of_codeword(codeword, rsc.nsym)
+            if bytes(rsc.encode(bytearray(part))) != codeword:
+                return None
+            message += part
+        return message[:16] + message[PREFIX_SIZE-PREFIX_REDSYM:] if self.ver >= 3 else message
+
+    def rs_decode(self, buffer):
+        """RS decode a raw block, clean blocks are not passed through the decoder"""
+        message = self.clean_message(buffer)
+        if message is not None:
+            return message
+        parts = [bytes(rsc.decode(bytearray(codeword))[0]) for rsc, codeword in self._codewords(buffer)]
+        if self.ver >= 3:
+            return parts[0][:16] + parts[1]
+        return parts[0]
+
+    def interleave(self, blocks):
+        """Spread the raw blocks of a group over each other: byte i of the body of
+        block j goes to position i*len(blocks)+j of the bodies of the group"""
+        #the start of every block (magic, uid, block number or the v3 prefix)
+        #stays in place, so scan and recover still find the blocks
+        count = len(blocks)
+        if count < 2:
+            return b"".join(blocks)
+        keep = self.interleave_keep
+        size = self.blocksize - keep
+        body = bytearray(count * size)
+        for j, block in enumerate(blocks):
+            body[j::count] = block[keep:]
+        return b"".join(bytes(block[:keep]) + body[j*size:(j+1)*size]
+                        for j, block in enumerate(blocks))
+
+    def deinterleave(self, buffer, interleave=1):
+        """Raw blocks of whole groups read from a container (not including block 0)"""
+        blocks = []
+        keep = self.interleave_keep
+        size = self.blocksize - keep
+        groupsize = self.blocksize * interleave
+        for start in range(0, len(buffer) - self.blocksize + 1, groupsize):
+            group = buffer[start:start+groupsize]
+            count = len(group) // self.blocksize
+            if count < 2:
+                blocks.append(bytes(group[:self.blocksize]))
+                continue
+            body = b"".join(group[j*self.blocksize+keep:(j+1)*self.blocksize] for j in range(count))
+            blocks.extend(bytes(group[j*self.blocksize:j*self.blocksize+keep]) + body[j::count]
+                          for j in range(count))
+        return blocks
+
+    def read_blocks(self, fin, interleave=1, datablocks=None):
+        """Read the raw blocks of a container from fin, one group at a time; the
+        blocks after the data blocks (the index) are not interleaved"""
+        blocknum = fin.tell() // self.blocksize
+        if blocknum == 0:
+            buffer = fin.read(self.blocksize)
+            if len(buffer) < self.blocksize:
+                return
+            yield buffer
+            blocknum = 1
+        while True:
+            count = interleave
+            if datablocks is not None:
+                count = min(interleave, datablocks + 1 - blocknum) if blocknum <= datablocks else 1
+            buffer = fin.read(self.blocksize * count)
+            if len(buffer) < self.blocksize:
+                return
+            blocks = self.deinterleave(buffer, count)
+            blocknum += len(blocks)
+            yield from blocks
+
+    def codeword_of_byte(self):
+        """For every byte of a raw block the codeword it belongs to (-1 for padding), and
+        the ECC symbols of every codeword"""
+        if self.ver < 3:
+            codeword_len = self.blocksize - self.padding_normal_block
+            index = [p // 255 for p in range(codeword_len)]
+            return index + [-1] * self.padding_normal_block, [self.redsym] * (index[-1]+1)
+        n = self.codewords
+        index = [0] * PREFIX_SIZE + [1 + p % n for p in range(n * 255)]
+        return index + [-1] * self.padding_normal_block, [PREFIX_REDSYM] + [self.redsym] * n
+
+    def is_valid(self, buffer, blocknum=None):
+        """Check magic, block number and CRC of a RS decoded block"""
+        if buffer[:3] != b'SBx' or buffer[3] != self.ver:
+            return False
+        num = int.from_bytes(buffer[12:16], byteorder='big')
+        if blocknum is not None and num != blocknum:
+            return False
+        end = len(buffer)
+        if num == 0:
+            #the CRC of the header block only covers the metadata, not the padding
+            p = 16
+            while p < end-3 and buffer[p:p+2] != b"\x1a\x1a":
+                p += 4 + buffer[p+3]
+            end = min(p, end)
+        crc = binascii.crc_hqx(buffer[6:end], self.ver)
+        return crc == int.from_bytes(buffer[4:6], byteorder='big')
+
     def decode(self, buffer):
         #start setting an invalid block number
         self.blocknum = -1
@@ -179,18 +568,310 @@ class SbxBlock():
                         self.metadata["sbxdatetime"] = int.from_bytes(metabb, byteorder='big')
                     if metaid == b'HSH':
                         self.metadata["hash"] = metabb
+                    if metaid == b'MKL':
+                        self.metadata["merkle"] = metabb
                     if metaid == b'PAD':
                         self.metadata["padding_last_block"] = int.from_bytes(metabb,byteorder='big')
                     if metaid == b'RSL':
                         self.metadata["redundancy_level"] = int.from_bytes(metabb,byteorder='big')
+                    if metaid == b'BSZ':
+                        self.metadata["blocksize"] = 1 << metabb[0]
+                    if metaid == b'ILV':
+                        self.metadata["interleave"] = int.from_bytes(metabb,byteorder='big')
+                    if metaid == b'IDX':
+                        self.metadata["index"] = int.from_bytes(metabb,byteorder='big')
+                    if metaid == b'CMP':
+                        self.metadata["compression"] = (metabb[0], int.from_bytes(metabb[1:5],byteorder='big'),
+                                                        int.from_bytes(metabb[5:13],byteorder='big'))
+                    if metaid == b'PAR':
+                        self.metadata["parity"] = (int.from_bytes(metabb[:2],byteorder='big'), metabb[2])
         return True
+
+def message_of_codeword(codeword, nsym, nsize=255):
+    """The message part of a systematic codeword, without touching the ECC symbols"""
+    return b"".join(codeword[p:min(p+nsize, len(codeword))-nsym]
+                    for p in range(0, len(codeword), nsize))
+
+def decode_prefix(buffer):
+    """Read the geometry of a version 3 block from its prefix, None if it is not one"""
+    if len(buffer) < PREFIX_SIZE:
+        return None
+    rsc = rscodec(PREFIX_REDSYM)
+    codeword = bytes(buffer[:PREFIX_SIZE])
+    message = message_of_codeword(codeword, PREFIX_REDSYM)
+    if bytes(rsc.encode(bytearray(message))) != codeword:
+        try:
+            message = bytes(rsc.decode(bytearray(codeword))[0])
+        except ReedSolomonError:
+            return None
+    if message[:4] != b'SBx\x03' or message[16] not in BLOCKSIZE_EXPS or not 2 <= message[17] <= 128:
+        return None
+    return {"uid":message[6:12],
+            "blocknum":int.from_bytes(message[12:16], byteorder='big'),
+            "blocksize":1 << message[16],
+            "redsym":message[17]}
+
+def block_for_file(sbxfilename, ver=1, raid=False, uid="r", pswd=""):
+    """SbxBlock with the geometry of an existing container"""
+    if ver < 3:
+        return SbxBlock(ver=ver, uid=uid, pswd=pswd)
+    for path_to_file in [sbxfilename] + ([sbxfilename+".raid"] if raid else []):
+        if os.path.exists(path_to_file):
+            with open(path_to_file, "rb") as fin:
+                info = decode_prefix(fin.read(PREFIX_SIZE))
+                #with a damaged first block, look where block 1 or the
+                #last block would be for every block size
+                filesize = os.path.getsize(path_to_file)
+                for exp in BLOCKSIZE_EXPS:
+                    if info:
+                        break
+                    for pos in (1 << exp, filesize - (1 << exp)):
+                        if pos <= 0 or pos % (1 << exp):
+                            continue
+                        fin.seek(pos)
+                        candidate = decode_prefix(fin.read(PREFIX_SIZE))
+                        if candidate and candidate["blocksize"] == 1 << exp:
+                            info = candidate
+                            break
+            if info:
+                return SbxBlock(ver=ver, uid=uid, pswd=pswd,
+                                blocksize=info["blocksize"], redsym=info["redsym"])
+    raise SbxDecodeError("no readable SBX v3 block at the start of '%s'" % sbxfilename)
+def group_start(blocknum, interleave=1, datablocks=None):
+    """First block of the interleaving group of a block, the header and the index
+    blocks are groups by themselves"""
+    if blocknum == 0 or (datablocks is not None and blocknum > datablocks):
+        return blocknum
+    return 1 + (blocknum - 1) // interleave * interleave
+
+def group_size(start, interleave, blockcount, datablocks=None):
+    """Blocks in the interleaving group starting at start"""
+    if start == 0 or (datablocks is not None and start > datablocks):
+        return 1
+    end = blockcount if datablocks is None else datablocks + 1
+    return max(1, min(interleave, end - start))
+
+def data_blocks(metadata, sbx):
+    """Number of data blocks of a container, None if its size is not known"""
+    if "filesize" not in metadata:
+        return None
+    return -(-metadata["filesize"] // sbx.raw_data_size_read_into_1_block)
+
+def is_index_blocknum(blocknum):
+    return blocknum > INDEX_BLOCKNUM - INDEX_MAX_BLOCKS
+
+def expected_blocknum(position, blockcount, datablocks=None):
+    """Block number stored at a position: the header, the data blocks in order, then
+    the index blocks counting down to the last block of the file"""
+    if datablocks is None or position <= datablocks:
+        return position
+    return INDEX_BLOCKNUM - (blockcount - 1 - position)
+
+def read_header(sbxfilename, sbx, raid=False):
+    """Decoded header block of a container, None if it can not be read"""
+    for path_to_file in [sbxfilename] + ([sbxfilename+".raid"] if raid else []):
+        if not os.path.exists(path_to_file):
+            continue
+        with open(path_to_file, "rb") as fin:
+            buffer = fin.read(sbx.blocksize)
+        if len(buffer) < sbx.blocksize:
+            continue
+        try:
+            message = sbx.rs_decode(buffer)
+        except ReedSolomonError:
+            continue
+        if sbx.is_valid(message, 0):
+            header = SbxBlock(ver=sbx.ver, uid=sbx.uid, blocksize=sbx.blocksize, redsym=sbx.redsym)
+            header.decode(message)
+            return header
+    return None
+
+def read_metadata(sbxfilename, sbx, raid=False):
+    """Metadata of the header block of a container, the layout from the index if
+    the header can not be read, empty if neither can"""
+    header = read_header(sbxfilename, sbx, raid)
+    if header:
+        return header.metadata
+    index = read_index(sbxfilename, sbx, raid)
+    return index.metadata() if index else {}
+
+#decoded header blocks of the containers read last, see read_sbx_header()
+HEADER_CACHE_SIZE = 256
+_header_cache = OrderedDict()
+_header_cache_lock = threading.Lock()
+
+def _file_signature(path_to_file):
+    try:
+        st = os.stat(path_to_file)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def read_sbx_header(sbxfilename, ver=1, raid=False):
+    """Decoded header block of a container, from the .raid copy if the container's
+    own can not be read, None if neither can. While the files keep their inode,
+    mtime and size the block comes from a cache instead of being decoded again,
+    it is shared and must not be modified"""
+    path = os.path.abspath(sbxfilename)
+    key = (path, ver, raid)
+    signature = (_file_signature(path), _file_signature(path+".raid") if raid else None)
+    with _header_cache_lock:
+        cached = _header_cache.get(key)
+        if cached and cached[0] == signature:
+            _header_cache.move_to_end(key)
+            return cached[1]
+    try:
+        header = read_header(path, block_for_file(path, ver=ver, raid=raid), raid)
+    except (SbxDecodeError, OSError):
+        header = None
+    with _header_cache_lock:
+        _header_cache[key] = (signature, header)
+        _header_cache.move_to_end(key)
+        while len(_header_cache) > HEADER_CACHE_SIZE:
+            _header_cache.popitem(last=False)
+    return header
+
+def forget_sbx_header(sbxfilename):
+    """Drop the cached header of a container that has just been rewritten"""
+    path = os.path.abspath(sbxfilename)
+    with _header_cache_lock:
+        for key in [key for key in _header_cache if key[0] == path]:
+            del _header_cache[key]
+
+def header_digest(metadata):
+    """SHA256 digest stored in the HSH field of a header, b"" if there is none"""
+    hashfield = metadata.get("hash", b"")
+    if hashfield[:1] != b"\x12":
+        return b""
+    return hashfield[2:2+hashfield[1]]
+
+class SbxIndex():
+    """Footer of a container: its layout and the hashes of ranges of data blocks"""
+
+    def __init__(self, sbx, datablocks=0, filesize=0, padding=0, interleave=1,
+                 parity=(0, 0), hashgroup=1, hashes=None):
+        self.ver = sbx.ver
+        self.blocksize = sbx.blocksize
+        self.redsym = sbx.redsym
+        self.raw = sbx.raw_data_size_read_into_1_block
+        self.datablocks = datablocks
+        self.filesize = filesize
+        self.padding = padding
+        self.interleave = interleave
+        self.parity = tuple(parity)
+        self.hashgroup = hashgroup
+        self.hashes = hashes if hashes is not None else []
+        self.indexblocks = 0
+
+    @staticmethod
+    def hashgroup_for(sbx):
+        """Data blocks covered by one hash, about INDEX_HASH_BYTES of data"""
+        return max(1, INDEX_HASH_BYTES // sbx.raw_data_size_read_into_1_block)
+
+    def encode(self):
+        """The index as a byte stream, cut in raw data sized pieces for the index blocks"""
+        size = struct.calcsize(INDEX_FORMAT) + 32 * len(self.hashes)
+        self.indexblocks = -(-size // self.raw)
+        if self.indexblocks >= INDEX_MAX_BLOCKS:
+            raise SbxError("index too large")
+        stream = struct.pack(INDEX_FORMAT, INDEX_MAGIC, 1, self.ver, self.blocksize,
+                             self.redsym, self.raw, self.datablocks, self.filesize,
+                             self.padding, self.interleave, self.parity[0], self.parity[1],
+                             0x12, 32, self.hashgroup, len(self.hashes), self.indexblocks)
+        stream += b"".join(self.hashes)
+        stream += b'\x1A' * (self.indexblocks * self.raw - len(stream))
+        return [stream[i*self.raw:(i+1)*self.raw] for i in range(self.indexblocks)]
+
+    @staticmethod
+    def decode(sbx, stream):
+        """Index from its byte stream, None if it is not one; without the hashes if
+        the stream only holds the first index block"""
+        size = struct.calcsize(INDEX_FORMAT)
+        if len(stream) < size or stream[:4] != INDEX_MAGIC:
+            return None
+        fields = struct.unpack(INDEX_FORMAT, stream[:size])
+        index = SbxIndex(sbx, datablocks=fields[6], filesize=fields[7], padding=fields[8],
+                         interleave=fields[9], parity=(fields[10], fields[11]),
+                         hashgroup=fields[14])
+        index.indexblocks = fields[16]
+        hashcount = fields[15]
+        if len(stream) >= size + 32 * hashcount:
+            index.hashes = [stream[size+i*32:size+(i+1)*32] for i in range(hashcount)]
+        else:
+            index.hashes = None
+        return index
+
+    def metadata(self):
+        """The part of the header metadata the index also knows"""
+        metadata = {"filesize":self.filesize, "padding_last_block":self.padding,
+                    "interleave":self.interleave, "index":self.indexblocks}
+        if self.parity[1]:
+            metadata["parity"] = self.parity
+        return metadata
+
+    def locate(self, offset):
+        """Data block and offset in its data of a byte of the original file"""
+        return 1 + offset // self.raw, offset % self.raw
+
+    def hash_blocks(self, hashnum):
+        """Data blocks covered by a hash"""
+        first = 1 + hashnum * self.hashgroup
+        return range(first, min(first + self.hashgroup, self.datablocks + 1))
+
+def read_index(sbxfilename, sbx, raid=False):
+    """Index at the end of a container, None if there is none or it can not be read"""
+    copies = [path for path in [sbxfilename] + ([sbxfilename+".raid"] if raid else [])
+              if os.path.exists(path)]
+    if not copies:
+        return None
+    #each copy is read from its own end, one may be missing or cut short
+    blockcounts = {path:os.path.getsize(path) // sbx.blocksize for path in copies}
+    blockcount = max(blockcounts.values())
+
+    def read(i):
+        for path_to_file in copies:
+            if blockcounts[path_to_file] < i + 1:
+                continue
+            with open(path_to_file, "rb") as fin:
+                fin.seek((blockcounts[path_to_file] - 1 - i) * sbx.blocksize)
+                buffer = fin.read(sbx.blocksize)
+            if len(buffer) < sbx.blocksize:
+                continue
+            try:
+                message = sbx.rs_decode(buffer)
+            except ReedSolomonError:
+                continue
+            if sbx.is_valid(message, INDEX_BLOCKNUM - i):
+                return message[16:]
+        return None
+
+    if blockcount < 2:
+        return None
+    first = read(0)
+    if first is None:
+        return None
+    index = SbxIndex.decode(sbx, first)
+    if index is None or index.indexblocks < 1 or index.indexblocks >= blockcount:
+        return None
+    stream = first
+    for i in range(1, index.indexblocks):
+        data = read(i)
+        if data is None:
+            return index
+        stream += data
+    return SbxIndex.decode(sbx, stream)
+
 class EncDec():
     """Simple encoding/decoding function"""
     #it's not meant as 'strong encryption', but just to hide the presence
     #of SBX blocks on a simple scan
-    def __init__(self, key, size):
+    def __init__(self, key, size, ver=1):
         #key is kept as a bigint because a xor between two bigint is faster
         #than byte-by-byte
+        if ver >= 3:
+            #the chained SHA256 below is quadratic in size, too slow for large blocks
+            self.key = int.from_bytes(hashlib.shake_256(key.encode()).digest(size), byteorder="big")
+            return
         d = hashlib.sha256()
         key = key.encode()
         tempkey = key
@@ -200,8 +881,9 @@ class EncDec():
             tempkey += key
         self.key = int(binascii.hexlify(tempkey[:size]), 16)
     def xor(self, buffer):
-        num = int(binascii.hexlify(buffer), 16) ^ self.key
-        return binascii.unhexlify(hex(num)[2:])
+        num = int.from_bytes(buffer, byteorder="big") ^ self.key
+        #fixed width, hex() would drop the leading zero bytes
+        return num.to_bytes(len(buffer), byteorder="big")
 def main():
     print("SeqBox module!")
     sys.exit(0)
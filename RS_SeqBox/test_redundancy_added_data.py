@@ -22,7 +22,14 @@
 #SOFTWARE.
 #----------------------------------------------------------------------------------
 
-import creedsolo.creedsolo as crs
+try:
+    import RS_SeqBox.seqbox as seqbox
+except ImportError:
+    pass
+try:
+    import seqbox as seqbox
+except ImportError:
+    pass
 
 bytes_of_text= 1000
 redundancy=200
@@ -31,7 +38,7 @@ print("Redundancy Symbols used:",redundancy)
 text= b'A' * bytes_of_text
 print("LEN MESSAGE,",len(text))
 
-rsc=crs.RSCodec(redundancy)
+rsc=seqbox.rscodec(redundancy)
 
 encoded_message = bytes(rsc.encode(bytearray(text)))
 
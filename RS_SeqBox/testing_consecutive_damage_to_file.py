@@ -27,8 +27,7 @@ import sbxdec as Decoder
 import random
 import os
 from threading import Lock
-import creedsolo.creedsolo as crs
-from reedsolo import ReedSolomonError
+from seqbox import ReedSolomonError
 class SbxError(Exception):
     pass
 class SbxDecodeError(SbxError):
@@ -95,7 +94,7 @@ for k in range(count_of_bytes_tampered_at_start,until_how_much_bytes_of_file_to_
             f.close()
         try:
             Decoder.decode(encoded_file,filename="save_consecutive.txt",overwrite=True,sbx_ver=sbx_version, raid=raid)
-        except crs.ReedSolomonError:
+        except ReedSolomonError:
             counts_of_failure+=1
         except SbxDecodeError:
             counts_of_failure+=1
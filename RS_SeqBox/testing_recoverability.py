@@ -27,8 +27,7 @@ import sbxdec as Decoder
 import random
 import os
 from threading import Lock
-import creedsolo.creedsolo as crs
-from reedsolo import ReedSolomonError
+from seqbox import ReedSolomonError
 class SbxError(Exception):
     pass
 class SbxDecodeError(SbxError):
@@ -104,11 +103,11 @@ for k in range(0,len(procent_of_tampering)):
         f.close()
         if raid:
             f_raid = open(tampered_file_name+".raid","wb")
-            f_raid.write(file_sbx_encoded_copy)
+            f_raid.write(file_sbx_encoded_copy_raid)
             f_raid.close()
         try:
             Decoder.decode(tampered_file_name,filename="save.txt",overwrite=True,sbx_ver=sbx_version,raid=raid)
-        except crs.ReedSolomonError:
+        except ReedSolomonError:
             print("ERROR REED SOLOMON")
             counts_of_failure+=1
         except SbxDecodeError:
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+import os
+import time
+
+#writes go to disk in whole chunks of this size, aligned to it in the file
+FLUSH_SIZE = 1024*1024
+#dirty bytes of all open files together before the oldest are written out
+MAX_DIRTY = 64*1024*1024
+#seconds a write may stay in memory
+FLUSH_DELAY = 1.0
+
+class WriteBuffer():
+    """Writes to one open file that have not reached it yet, kept as one extent
+    of adjacent or overlapping writes"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.start = 0
+        self.data = bytearray()
+        #time.monotonic() of the oldest write still in memory
+        self.since = None
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+    def add(self, offset, buf):
+        """Take a write, return the number of bytes this wrote to the file"""
+        written = 0
+        if self.data and not self.start <= offset <= self.end:
+            written = self.flush()
+        if not self.data:
+            self.start = offset
+            self.since = time.monotonic()
+        pos = offset - self.start
+        self.data[pos:pos+len(buf)] = buf
+        #the whole chunks go out, the rest waits for the writes after it
+        if len(self.data) >= FLUSH_SIZE:
+            written += self.flush(self.end // FLUSH_SIZE * FLUSH_SIZE - self.start)
+        return written
+
+    def flush(self, length=None):
+        """Write the first length bytes (all by default) to the file"""
+        if length is None:
+            length = len(self.data)
+        with memoryview(self.data) as view:
+            pos = 0
+            while pos < length:
+                pos += os.pwrite(self.fd, view[pos:length], self.start + pos)
+        del self.data[:length]
+        self.start += length
+        if not self.data:
+            self.since = None
+        return length
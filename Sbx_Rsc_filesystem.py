@@ -29,6 +29,8 @@ import os
 import sys
 import shutil
 import hashlib
+import threading
+import time
 from functools import partial
 # If we are running from the pyfuse3 source directory, try
 # to load the module from there first.
@@ -44,12 +46,15 @@ import logging
 import stat as stat_m
 from pyfuse3 import FUSEError
 from os import fsencode, fsdecode
-from collections import defaultdict
 import trio
 import RS_SeqBox.sbxenc as sbxenc
 import RS_SeqBox.sbxdec as sbxdec
 import RS_SeqBox.seqbox as seqbox
-import creedsolo.creedsolo as crs
+import RS_SeqBox.sbxscrub as sbxscrub
+import RS_SeqBox.sbxmerkle as sbxmerkle
+import RS_SeqBox.sbxwarm as sbxwarm
+from RS_SeqBox.inodetable import InodeTable
+import RS_SeqBox.writeback as writeback
 
 
 import faulthandler
@@ -58,12 +63,15 @@ faulthandler.enable()
 log = logging.getLogger(__name__)
 
 active_sbx_encodings = []
-def decode_header_block_with_rsc(buffer, sbx_version):
-    sbx = seqbox.SbxBlock(ver=sbx_version)
-    rsc=crs.RSCodec(sbx.redsym)
-    decoded = bytes(rsc.decode(bytearray(buffer[:-sbx.padding_normal_block]))[0])
-    return decoded
-
+#guards active_sbx_encodings and shield_pending between the trio loop and the
+#background threads (warm index, scrubber)
+shield_lock = threading.Lock()
+#files released while a background thread encoded them, encoded again after
+shield_pending = set()
+#written ranges of an open file kept apart before they are merged into one
+MAX_DIRTY_RANGES = 1024
+#files next to a plain file that make up its shield
+SHIELD_SUFFIXES = sbxwarm.SHIELD_SUFFIXES
 def check_if_sbx_file_exists(path_of_normal_file):
     return os.path.exists(path_of_normal_file+".sbx")
 
@@ -86,68 +94,12 @@ def get_hash_of_sbx_file(path_to_file, sbx_version, raid):
     if not os.path.exists(path_to_file):
         print(1, "sbx file '%s' not found" % (path_to_file))
         return
-    
-    sbx = seqbox.SbxBlock(ver=sbx_version)
-    fin = open(path_to_file, "rb", buffering=1024*1024)
-    
-    raid_exists = os.path.exists(path_to_file+".raid") and raid == True
-    if raid_exists:
-        fin_raid = open(path_to_file+".raid", "rb", buffering=1024*1024)
-        fin_raid.seek(0,0)
-        buffer_raid = fin_raid.read(sbx.blocksize)
-        fin_raid.close()
-    
-    buffer = fin.read(sbx.blocksize)
-    fin.close()
-    try:
-        buffer = bytes(decode_header_block_with_rsc(buffer, sbx_version))
-    except crs.ReedSolomonError:
-        if raid_exists:
-            try:
-                buffer=bytes(decode_header_block_with_rsc(buffer_raid,sbx_version))
-            except crs.ReedSolomonError:
-                pass
-
-
-    header = buffer[:3]
-
-    data = buffer[16:]
-    if header[:3] != b"SBx":
-        print(1, "not a SeqBox file!")
-        return
-    metadata = {}
-    p=0
-    while p < (len(data)-3):
-                metaid = data[p:p+3]
-                p+=3
-                if metaid == b"\x1a\x1a\x1a":
-                    break
-                else:
-                    metalen = data[p]
-                    metabb = data[p+1:p+1+metalen]
-                    p = p + 1 + metalen    
-                    if metaid == b'FNM':
-                        metadata["filename"] = metabb.decode('utf-8')
-                    if metaid == b'SNM':
-                        metadata["sbxname"] = metabb.decode('utf-8')
-                    if metaid == b'FSZ':
-                        metadata["filesize"] = int.from_bytes(metabb, byteorder='big')
-                    if metaid == b'FDT':
-                        metadata["filedatetime"] = int.from_bytes(metabb, byteorder='big')
-                    if metaid == b'SDT':
-                        metadata["sbxdatetime"] = int.from_bytes(metabb, byteorder='big')
-                    if metaid == b'HSH':
-                        metadata["hash"] = metabb
-                        break
-    if "hash" in metadata:
-        hashtype = metadata["hash"][0]
-        if hashtype == 0x12:
-            hashlen = metadata["hash"][1]
-            hash_of_sbx_file_decoded = metadata["hash"][2:2+hashlen]  
-            d = hashlib.sha256()
-            return hash_of_sbx_file_decoded
-    else:
-        return ""
+    # block 0 is only decoded again once the container changed
+    header = seqbox.read_sbx_header(path_to_file, ver=sbx_version, raid=raid)
+    if header is None:
+        print(1, "not a readable SeqBox file!")
+        return b""
+    return seqbox.header_digest(header.metadata)
 
 #Creates shielded File in the mirror directory
 def create_shielded_version_of_file(path_to_file, sbx_version, raid,password=""):
@@ -156,86 +108,181 @@ def create_shielded_version_of_file(path_to_file, sbx_version, raid,password="")
     if path_to_file.endswith(".sbx"):
         if not os.path.exists(path_to_file.split(".sbx")[0]):
 
-            sbxdec.decode(path_to_file, sbx_ver=sbx.ver, raid=raid,password=password)
+            sbxdec.decode(path_to_file, filename=path_to_file.split(".sbx")[0], sbx_ver=sbx.ver,
+                          raid=raid, password=password)
             active_sbx_encodings.remove(path_to_file)
             return
 
-        if get_hash_of_sbx_file(path_to_file, sbx_ver=sbx_version, raid=raid) == get_hash_of_normal_file(path_to_file.split(".sbx")[0]):
+        if get_hash_of_sbx_file(path_to_file, sbx_version=sbx_version, raid=raid) == get_hash_of_normal_file(path_to_file.split(".sbx")[0]):
             print("Hash of Files dont match")
-            sbxdec.decode(path_to_file,sbx_ver=sbx.ver, raid=raid,password=password)
+            sbxdec.decode(path_to_file, filename=path_to_file.split(".sbx")[0], overwrite=True,
+                          sbx_ver=sbx.ver, raid=raid, password=password)
             active_sbx_encodings.remove(path_to_file)
             return
         else:
             return
+    encode_shield(path_to_file, sbx.ver, raid, password=password)
+    active_sbx_encodings.remove(path_to_file)
+
+def encode_shield(path_to_file, sbx_version, raid, password=""):
     print("Creating shielded version of File")
-    sbxenc.encode(path_to_file,sbxfilename=path_to_file+".sbx", sbx_ver=sbx.ver, raid=raid,password=password)    
+    sbxenc.encode(path_to_file,sbxfilename=path_to_file+".sbx", sbx_ver=sbx_version, raid=raid,password=password,merkle=True)    
+    print("file encoded")
+
+
+#Re-encodes only the blocks of the shield that hold the changed byte ranges
+def reshield_file(path_to_file, ranges, sbx_version, raid, password=""):
+    print("Updating shielded version of File")
+    if not sbxenc.reshield(path_to_file, path_to_file+".sbx", ranges, sbx_ver=sbx_version,
+                           raid=raid, password=password):
+        #layouts that can not be patched in place are encoded again
+        sbxenc.encode(path_to_file, sbxfilename=path_to_file+".sbx", sbx_ver=sbx_version,
+                      raid=raid, password=password, merkle=True)
+    #the shield is as durable as the data it protects
+    for suffix in SHIELD_SUFFIXES:
+        if os.path.exists(path_to_file+suffix):
+            fd = os.open(path_to_file+suffix, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
     print("file encoded")
-    active_sbx_encodings.remove(path_to_file)
 
 
 def unshield_file(path_to_file, sbx_version, raid,password=""):
     print("Unshielding file")
-    sbxdec.decode(path_to_file+".sbx", overwrite=True, sbx_ver=sbx_version, raid=raid, password=password)
+    #the header may not hold the path, or an old one after a rename
+    sbxdec.decode(path_to_file+".sbx", filename=path_to_file, overwrite=True, sbx_ver=sbx_version,
+                  raid=raid, password=password)
 
 class Operations(pyfuse3.Operations):
 
     enable_writeback_cache = True
 
-    def __init__(self, source, sbx_version,raid, password=""):
+    def __init__(self, source, sbx_version,raid, password="", fsync_shield="async"):
         self.raid = raid
+        #"sync": fsync also brings the shield up to date, "async": release does
+        self.fsync_shield = fsync_shield
         super().__init__()
         self.sbx_version = sbx_version
         self.shield_dir=source
         self.password=password
-        self._inode_path_map = { pyfuse3.ROOT_INODE: source }
-        self._lookup_cnt = defaultdict(lambda : 0)
+        self._inodes = InodeTable(source, pyfuse3.ROOT_INODE)
         self._fd_inode_map = dict()
         self._inode_fd_map = dict()
         self._fd_open_count = dict()
+        #Merkle trees of files opened read only, and the leaves already checked
+        self._fd_tree_map = dict()
+        self._fd_verified = dict()
+        #writes not yet on disk, and their total size
+        self._fd_write_buffer = dict()
+        self._dirty_bytes = 0
+        #byte ranges written since the shield was last updated, and the files
+        #whose shield an fsync brought up to date
+        self._fd_dirty_ranges = dict()
+        self._fd_shielded = set()
+        #optional sbxwarm.WarmIndex of the files known to match their shield
+        self.warm_index = None
+        #open directories: handle -> [inode, scandir snapshot or None]
+        self._dir_handles = dict()
+        self._next_dir_handle = 1
         self.path_to_file = ""
 
     
     
 
+    def _is_busy(self, path):
+        #used by the scrubber, files in use or being shielded are left alone
+        path = os.path.abspath(path)
+        for path_in_use in list(active_sbx_encodings):
+            if os.path.abspath(path_in_use) == path:
+                return True
+        for inode in list(self._inode_fd_map):
+            try:
+                if os.path.abspath(self._inode_to_path(inode)) == path:
+                    return True
+            except FUSEError:
+                pass
+        return False
+
+    def _matches_shield(self, path_to_file):
+        #files the warm index verified and that did not change since are not hashed
+        if self.warm_index and self.warm_index.is_shielded(path_to_file):
+            return True
+        if get_hash_of_normal_file(path_to_file) != get_hash_of_sbx_file(path_to_file+".sbx", sbx_version=self.sbx_version, raid=self.raid):
+            return False
+        if self.warm_index:
+            self.warm_index.verified(path_to_file)
+        return True
+
+    def _shielded(self, path_to_file):
+        #the shield was just written from the file as it is now
+        if self.warm_index:
+            self.warm_index.verified(path_to_file)
+
+    def _claim_shield(self, path_to_file):
+        #register an encode of the file, False if one is running; a background
+        #one is then told to encode the file again when it is done
+        with shield_lock:
+            if path_to_file in active_sbx_encodings:
+                shield_pending.add(path_to_file)
+                return False
+            active_sbx_encodings.append(path_to_file)
+            return True
+
+    def _claim_if_idle(self, path_to_file):
+        #register a file nobody uses, the busy check and the claim are one step
+        #under the lock; used off the trio loop (warm index, scrubber)
+        with shield_lock:
+            if self._is_busy(path_to_file):
+                return False
+            active_sbx_encodings.append(path_to_file)
+            return True
+
+    def _unclaim_shield(self, path_to_file):
+        with shield_lock:
+            if path_to_file in active_sbx_encodings:
+                active_sbx_encodings.remove(path_to_file)
+
+    def _shield_in_background(self, path_to_file):
+        #used by the warm index for the files it finds without a shield
+        if not self._claim_if_idle(path_to_file):
+            return False
+        try:
+            while True:
+                encode_shield(path_to_file, self.sbx_version, self.raid, password=self.password)
+                with shield_lock:
+                    #released while it was encoded, the shield may hold old data
+                    if path_to_file not in shield_pending:
+                        break
+                    shield_pending.discard(path_to_file)
+        except (SystemExit, OSError, seqbox.SbxError, seqbox.ReedSolomonError) as exc:
+            log.warning('shield of %s not created: %s', path_to_file, exc)
+            return False
+        finally:
+            self._unclaim_shield(path_to_file)
+        return True
+
     def _inode_to_path(self, inode):
+        # In case of hardlinks, this is the path the inode was first seen at
         try:
-            val = self._inode_path_map[inode]
+            return self._inodes.path(inode)
         except KeyError:
             raise FUSEError(errno.ENOENT)
 
-        if isinstance(val, set):
-            # In case of hardlinks, pick any path
-            val = next(iter(val))
-     
-        return val
-
-    def _add_path(self, inode, path):
-        log.debug('_add_path for %d, %s', inode, path)
-        self._lookup_cnt[inode] += 1
-
-        # With hardlinks, one inode may map to multiple paths.
-        if inode not in self._inode_path_map:
-            self._inode_path_map[inode] = path
-            return
-
-        val = self._inode_path_map[inode]
-        if isinstance(val, set):
-            val.add(path)
-        elif val != path:
-            self._inode_path_map[inode] = { path, val }
+    def _add_path(self, inode, inode_p, name):
+        log.debug('_add_path for %d, %s in %d', inode, name, inode_p)
+        # With hardlinks, one inode may have multiple paths.
+        try:
+            self._inodes.add(inode, inode_p, name)
+        except KeyError:
+            raise FUSEError(errno.ENOENT)
 
     async def forget(self, inode_list):
         for (inode, nlookup) in inode_list:
-            if self._lookup_cnt[inode] > nlookup:
-                self._lookup_cnt[inode] -= nlookup
-                continue
-            log.debug('forgetting about inode %d', inode)
-            assert inode not in self._inode_fd_map
-            del self._lookup_cnt[inode]
-            try:
-                del self._inode_path_map[inode]
-            except KeyError: # may have been deleted
-                pass
+            if self._inodes.forget(inode, nlookup):
+                log.debug('forgetting about inode %d', inode)
+                assert inode not in self._inode_fd_map
 
     async def lookup(self, inode_p, name, ctx=None):
         name = fsdecode(name)
@@ -243,11 +290,12 @@ class Operations(pyfuse3.Operations):
         path = os.path.join(self._inode_to_path(inode_p), name)
         attr = self._getattr(path=path)
         if name != '.' and name != '..':
-            self._add_path(attr.st_ino, path)
+            self._add_path(attr.st_ino, inode_p, name)
         return attr
 
     async def getattr(self, inode, ctx=None):
         if inode in self._inode_fd_map:
+            self._flush_writes(self._inode_fd_map[inode])
             return self._getattr(fd=self._inode_fd_map[inode])
         else:
             return self._getattr(path=self._inode_to_path(inode))
@@ -262,12 +310,19 @@ class Operations(pyfuse3.Operations):
                 stat = os.fstat(fd)
         except OSError as exc:
             raise FUSEError(exc.errno)
+        return self._entry_attributes(stat)
 
+    def _entry_attributes(self, stat):
         entry = pyfuse3.EntryAttributes()
         for attr in ('st_ino', 'st_mode', 'st_nlink', 'st_uid', 'st_gid',
                      'st_rdev', 'st_size', 'st_atime_ns', 'st_mtime_ns',
                      'st_ctime_ns'):
             setattr(entry, attr, getattr(stat, attr))
+        #writes still in memory already count for the size of an open file
+        fd = self._inode_fd_map.get(stat.st_ino)
+        buffer = self._fd_write_buffer.get(fd) if fd is not None else None
+        if buffer:
+            entry.st_size = max(entry.st_size, buffer.end)
         entry.generation = 0
         entry.entry_timeout = 0
         entry.attr_timeout = 0
@@ -285,35 +340,51 @@ class Operations(pyfuse3.Operations):
         return fsencode(target)
 
     async def opendir(self, inode, ctx):
-        return inode
-
-    async def readdir(self, inode, off, token):
-        path = self._inode_to_path(inode)
-        log.debug('reading %s', path)
-        entries = []
-        if not os.path.exists(path):
-            return
-        for name in os.listdir(path):
-            if name == '.' or name == '..' or name.endswith(".sb.rs"):
-                continue
-            attr = self._getattr(path=os.path.join(path, name))
-            entries.append((attr.st_ino, name, attr))
+        self._inode_to_path(inode)
+        fh = self._next_dir_handle
+        self._next_dir_handle += 1
+        self._dir_handles[fh] = [inode, None]
+        return fh
+
+    def _list_dir(self, path):
+        #one snapshot per pass over the directory, its DirEntry objects keep
+        #the stat once it has been asked for
+        try:
+            with os.scandir(path) as it:
+                return [entry for entry in it if not entry.name.endswith(".sb.rs")]
+        except OSError as exc:
+            raise FUSEError(exc.errno)
 
+    async def readdir(self, fh, off, token):
+        handle = self._dir_handles[fh]
+        inode = handle[0]
+        if off == 0 or handle[1] is None:
+            # (re)start of a listing, e.g. after rewinddir()
+            path = self._inode_to_path(inode)
+            log.debug('reading %s', path)
+            handle[1] = self._list_dir(path)
+        entries = handle[1]
         log.debug('read %d entries, starting at %d', len(entries), off)
 
-        # This is not fully posix compatible. If there are hardlinks
-        # (two names with the same inode), we don't have a unique
-        # offset to start in between them. Note that we cannot simply
-        # count entries, because then we would skip over entries
-        # (or return them more than once) if the number of directory
-        # entries changes between two calls to readdir().
-        for (ino, name, attr) in sorted(entries):
-            if ino <= off:
+        # The offset of an entry is its position in the snapshot plus one, so a
+        # continuation picks up where the last reply stopped, even with
+        # hardlinks or entries added and removed in between.
+        for i in range(off, len(entries)):
+            entry = entries[i]
+            try:
+                attr = self._entry_attributes(entry.stat(follow_symlinks=False))
+            except FileNotFoundError:
+                # gone since the snapshot
                 continue
+            except OSError as exc:
+                raise FUSEError(exc.errno)
             if not pyfuse3.readdir_reply(
-                token, fsencode(name), attr, ino):
+                token, fsencode(entry.name), attr, i + 1):
                 break
-            self._add_path(attr.st_ino, os.path.join(path, name))
+            self._add_path(attr.st_ino, inode, entry.name)
+
+    async def releasedir(self, fh):
+        del self._dir_handles[fh]
 
     async def unlink(self, inode_p, name, ctx):
         name = fsdecode(name)
@@ -322,11 +393,21 @@ class Operations(pyfuse3.Operations):
         try:
             inode = os.lstat(path).st_ino
             os.unlink(path)
-            os.unlink(path+".sb.rs")
         except OSError as exc:
             raise FUSEError(exc.errno)
-        if inode in self._lookup_cnt:
-            self._forget_path(inode, path)
+        # the shield goes with the file
+        for suffix in SHIELD_SUFFIXES:
+            try:
+                os.unlink(path+suffix)
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                log.warning('could not remove %s: %s', path+suffix, exc.strerror)
+        seqbox.forget_sbx_header(path+".sbx")
+        if self.warm_index:
+            self.warm_index.forget(path)
+        if inode in self._inodes:
+            self._forget_path(inode, inode_p, name)
 
     async def rmdir(self, inode_p, name, ctx):
         name = fsdecode(name)
@@ -338,18 +419,12 @@ class Operations(pyfuse3.Operations):
             os.rmdir(path)
         except OSError as exc:
             raise FUSEError(exc.errno)
-        if inode in self._lookup_cnt:
-            self._forget_path(inode, path)
-
-    def _forget_path(self, inode, path):
-        log.debug('forget %s for %d', path, inode)
-        val = self._inode_path_map[inode]
-        if isinstance(val, set):
-            val.remove(path)
-            if len(val) == 1:
-                self._inode_path_map[inode] = next(iter(val))
-        else:
-            del self._inode_path_map[inode]
+        if inode in self._inodes:
+            self._forget_path(inode, inode_p, name)
+
+    def _forget_path(self, inode, inode_p, name):
+        log.debug('forget %s in %d for %d', name, inode_p, inode)
+        self._inodes.remove(inode, inode_p, name)
 
     async def symlink(self, inode_p, name, target, ctx):
         name = fsdecode(name)
@@ -358,13 +433,16 @@ class Operations(pyfuse3.Operations):
         path = os.path.join(parent, name)
         try:
             os.symlink(target, path)
-            os.symlink(target+".sbx",path+".sbx")
             os.chown(path, ctx.uid, ctx.gid, follow_symlinks=False)
-            os.chown(path+".sbx", ctx.uid, ctx.gid, follow_symlinks=False)
+            # the shield files of the target, as far as it has them
+            for suffix in SHIELD_SUFFIXES:
+                if suffix == ".sbx" or os.path.lexists(os.path.join(parent, target+suffix)):
+                    os.symlink(target+suffix, path+suffix)
+                    os.chown(path+suffix, ctx.uid, ctx.gid, follow_symlinks=False)
         except OSError as exc:
             raise FUSEError(exc.errno)
         stat = os.lstat(path)
-        self._add_path(stat.st_ino, path)
+        self._add_path(stat.st_ino, inode_p, name)
         return await self.getattr(stat.st_ino)
 
     async def rename(self, inode_p_old, name_old, inode_p_new, name_new,
@@ -380,39 +458,69 @@ class Operations(pyfuse3.Operations):
             path_new = os.path.join(parent_new, name_new)
             try:
                 os.rename(path_old, path_new)
-                inode = os.lstat(path_new).st_ino
+                stat = os.lstat(path_new)
+                inode = stat.st_ino
         
             except OSError as exc:
                 raise FUSEError(exc.errno)
-            
+            if not stat_m.S_ISDIR(stat.st_mode):
+                self._move_shield(path_old, path_new)
 
-            if inode not in self._lookup_cnt:
+            if inode not in self._inodes:
                 return
-            val = self._inode_path_map[inode]
-            if isinstance(val, set):
-                assert len(val) > 1
-                val.add(path_new)
-                val.remove(path_old)
-            else:
-                assert val == path_old
-                self._inode_path_map[inode] = path_new
+            # the paths of everything below a renamed directory follow it
+            self._inodes.move(inode, inode_p_old, name_old, inode_p_new, name_new)
+
+    def _move_shield(self, path_old, path_new):
+        #the shield files follow the plain file instead of being encoded again,
+        #the ones of a file that was replaced go
+        moved = False
+        for suffix in SHIELD_SUFFIXES:
+            try:
+                if os.path.lexists(path_old+suffix):
+                    os.rename(path_old+suffix, path_new+suffix)
+                    moved = True
+                elif os.path.lexists(path_new+suffix):
+                    os.unlink(path_new+suffix)
+            except OSError as exc:
+                log.warning('could not move %s: %s', path_old+suffix, exc.strerror)
+        seqbox.forget_sbx_header(path_old+".sbx")
+        seqbox.forget_sbx_header(path_new+".sbx")
+        #only the names in the header block change
+        if moved and not os.path.islink(path_new+".sbx"):
+            sbxenc.rename_header(path_new+".sbx", path_new, sbx_ver=self.sbx_version, raid=self.raid)
+        if self.warm_index:
+            self.warm_index.move(path_old, path_new)
 
     async def link(self, inode, new_inode_p, new_name, ctx):
         new_name = fsdecode(new_name)
         parent = self._inode_to_path(new_inode_p)
         path = os.path.join(parent, new_name)
+        path_old = self._inode_to_path(inode)
         try:
-            os.link(self._inode_to_path(inode), path, follow_symlinks=False)
-            os.link(self._inode_to_path(inode)+".sbx",path+".sbx",follow_symlinks=False)
+            os.link(path_old, path, follow_symlinks=False)
+            # the new name shares the shield of the file
+            for suffix in SHIELD_SUFFIXES:
+                if os.path.lexists(path_old+suffix):
+                    os.link(path_old+suffix, path+suffix, follow_symlinks=False)
         except OSError as exc:
             raise FUSEError(exc.errno)
-        self._add_path(inode, path)
+        self._add_path(inode, new_inode_p, new_name)
         return await self.getattr(inode)
 
     async def setattr(self, inode, attr, fields, fh, ctx):
         # We use the f* functions if possible so that we can handle
         # a setattr() call for an inode without associated directory
         # handle.
+        if inode in self._inode_fd_map:
+            self._flush_writes(self._inode_fd_map[inode])
+            if fields.update_size:
+                #a new size changes the last blocks of the shield, and the tree
+                #of the open file no longer describes it
+                fd = self._inode_fd_map[inode]
+                self._fd_dirty_ranges.setdefault(fd, []).append([attr.st_size, 0])
+                self._fd_tree_map.pop(fd, None)
+                self._fd_verified.pop(fd, None)
         if fh is None:
             path_or_fh = self._inode_to_path(inode)
             truncate = os.truncate
@@ -478,7 +586,7 @@ class Operations(pyfuse3.Operations):
         except OSError as exc:
             raise FUSEError(exc.errno)
         attr = self._getattr(path=path)
-        self._add_path(attr.st_ino, path)
+        self._add_path(attr.st_ino, inode_p, fsdecode(name))
         return attr
 
     async def mkdir(self, inode_p, name, mode, ctx):
@@ -489,11 +597,11 @@ class Operations(pyfuse3.Operations):
         except OSError as exc:
             raise FUSEError(exc.errno)
         attr = self._getattr(path=path)
-        self._add_path(attr.st_ino, path)
+        self._add_path(attr.st_ino, inode_p, fsdecode(name))
         return attr
 
     async def statfs(self, ctx):
-        root = self._inode_path_map[pyfuse3.ROOT_INODE]
+        root = self._inode_to_path(pyfuse3.ROOT_INODE)
         stat_ = pyfuse3.StatvfsData()
         try:
             statfs = os.statvfs(root)
@@ -520,8 +628,18 @@ class Operations(pyfuse3.Operations):
             if active_sbx_encodings.__contains__(file_path):
                 fd = os.open(file_path, flags)
             else:
-                if not file_path.endswith(".sbx"):
-                    if file_path.__contains__(".trashinfo") or (get_hash_of_normal_file(file_path) == get_hash_of_sbx_file(file_path+".sbx", sbx_version=self.sbx_version, raid=self.raid)):
+                tree = None
+                if not file_path.endswith(".sbx") and flags & os.O_ACCMODE == os.O_RDONLY:
+                    tree = sbxmerkle.load(file_path+".sbx", sbx_ver=self.sbx_version, raid=self.raid)
+                    if tree and os.lstat(file_path).st_size != tree.filesize:
+                        tree = None
+                if tree:
+                    #the leaves are checked when they are read, not the whole file now
+                    fd = os.open(file_path, flags)
+                    self._fd_tree_map[fd] = tree
+                    self._fd_verified[fd] = set()
+                elif not file_path.endswith(".sbx"):
+                    if file_path.__contains__(".trashinfo") or self._matches_shield(file_path):
                         print("Hashes Match or file being deleted")
                         fd = os.open(file_path, flags)
                     else:
@@ -553,7 +671,7 @@ class Operations(pyfuse3.Operations):
         except OSError as exc:
             raise FUSEError(exc.errno)
         attr = self._getattr(fd=fd)
-        self._add_path(attr.st_ino, path)
+        self._add_path(attr.st_ino, inode_p, fsdecode(name))
         self._inode_fd_map[attr.st_ino] = fd
         self._fd_inode_map[fd] = attr.st_ino
         self._fd_open_count[fd] = 1
@@ -562,14 +680,141 @@ class Operations(pyfuse3.Operations):
     async def read(self, fd, offset, length):
         #check integrity before reading
         #--
+        self._flush_writes(fd)
+        if fd in self._fd_tree_map:
+            self._verify_leaves(fd, offset, length)
         os.lseek(fd, offset, os.SEEK_SET)
         return os.read(fd, length)
+
+    def _verify_leaves(self, fd, offset, length):
+        #check the leaves of the tree a read touches, once per open file
+        tree = self._fd_tree_map[fd]
+        verified = self._fd_verified[fd]
+        leafnums = [leafnum for leafnum in tree.leaves_of(offset, length) if leafnum not in verified]
+        if not leafnums:
+            return
+        start, end = tree.span(leafnums)
+        if tree.verify_data(start, os.pread(fd, end - start, start)):
+            print("Leaves dont match")
+            path_to_file = self._inode_to_path(self._fd_inode_map[fd])
+            unshield_file(path_to_file, self.sbx_version, self.raid, password=self.password)
+            if tree.verify_data(start, os.pread(fd, end - start, start)):
+                raise FUSEError(errno.EIO)
+        verified.update(leafnums)
     #normal
     async def write(self, fd, offset, buf):
         #check integrity before writing
         #--
-        os.lseek(fd, offset, os.SEEK_SET) 
-        return os.write(fd, buf)
+        self._fd_tree_map.pop(fd, None)
+        self._fd_verified.pop(fd, None)
+        ranges = self._fd_dirty_ranges.setdefault(fd, [])
+        if ranges and ranges[-1][0] <= offset <= ranges[-1][0] + ranges[-1][1]:
+            #sequential writes extend one range
+            ranges[-1][1] = max(ranges[-1][1], offset + len(buf) - ranges[-1][0])
+        else:
+            ranges.append([offset, len(buf)])
+            if len(ranges) > MAX_DIRTY_RANGES:
+                #scattered writes: patch everything between the first and the last
+                first = min(start for start, length in ranges)
+                last = max(start + length for start, length in ranges)
+                ranges[:] = [[first, last - first]]
+        #small writes are coalesced and reach the file in large chunks
+        buffer = self._fd_write_buffer.get(fd)
+        if buffer is None:
+            buffer = self._fd_write_buffer[fd] = writeback.WriteBuffer(fd)
+        dirty = len(buffer)
+        try:
+            buffer.add(offset, buf)
+        except OSError as exc:
+            raise FUSEError(exc.errno)
+        finally:
+            self._dirty_bytes += len(buffer) - dirty
+        if self._dirty_bytes > writeback.MAX_DIRTY:
+            self._flush_oldest(writeback.MAX_DIRTY // 2)
+        return len(buf)
+
+    def _flush_writes(self, fd):
+        buffer = self._fd_write_buffer.get(fd)
+        if not buffer:
+            return
+        dirty = len(buffer)
+        try:
+            buffer.flush()
+        except OSError as exc:
+            raise FUSEError(exc.errno)
+        finally:
+            self._dirty_bytes -= dirty - len(buffer)
+
+    def _flush_oldest(self, limit, before=None):
+        #write out the buffers that have waited longest, until at most limit
+        #bytes are dirty and none is older than before
+        for buffer in sorted((buffer for buffer in self._fd_write_buffer.values() if buffer),
+                             key=lambda buffer: buffer.since):
+            if self._dirty_bytes <= limit and (before is None or buffer.since > before):
+                break
+            self._flush_writes(buffer.fd)
+
+    async def flush_timer(self):
+        #nothing stays in memory for much longer than FLUSH_DELAY
+        while True:
+            await trio.sleep(writeback.FLUSH_DELAY / 2)
+            try:
+                self._flush_oldest(writeback.MAX_DIRTY, time.monotonic() - writeback.FLUSH_DELAY)
+            except FUSEError as exc:
+                log.warning('delayed write failed: %s', os.strerror(exc.errno))
+
+    async def flush(self, fd):
+        self._flush_writes(fd)
+
+    async def fsync(self, fd, datasync):
+        self._flush_writes(fd)
+        try:
+            if datasync:
+                os.fdatasync(fd)
+            else:
+                os.fsync(fd)
+        except OSError as exc:
+            raise FUSEError(exc.errno)
+        if self.fsync_shield == "sync":
+            self._shield_writes(fd)
+
+    def _shield_writes(self, fd):
+        #patch the blocks of the shield that hold what was written since
+        ranges = self._fd_dirty_ranges.pop(fd, None)
+        if not ranges:
+            return
+        path_to_file = self._inode_to_path(self._fd_inode_map[fd])
+        if path_to_file.endswith(".sbx") or ".trashinfo" in path_to_file:
+            return
+        if path_to_file in active_sbx_encodings:
+            self._fd_dirty_ranges[fd] = ranges
+            return
+        active_sbx_encodings.append(path_to_file)
+        try:
+            reshield_file(path_to_file, ranges, self.sbx_version, self.raid, password=self.password)
+            self._shielded(path_to_file)
+            self._fd_shielded.add(fd)
+        except OSError as exc:
+            self._fd_dirty_ranges[fd] = ranges
+            raise FUSEError(exc.errno)
+        except (SystemExit, seqbox.SbxError, seqbox.ReedSolomonError) as exc:
+            #the encode a layout falls back to exits on errors, the mount must not
+            log.warning('shield of %s not updated: %s', path_to_file, exc)
+            self._fd_dirty_ranges[fd] = ranges
+            raise FUSEError(errno.EIO)
+        finally:
+            active_sbx_encodings.remove(path_to_file)
+
+    async def fsyncdir(self, fh, datasync):
+        path = self._inode_to_path(self._dir_handles[fh][0])
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as exc:
+            raise FUSEError(exc.errno)
 
     async def release(self, fd):
         if self._fd_open_count[fd] > 1:
@@ -579,9 +824,21 @@ class Operations(pyfuse3.Operations):
         del self._fd_open_count[fd]
         inode = self._fd_inode_map[fd]
         path_to_file = self._inode_to_path(inode)
+        try:
+            self._flush_writes(fd)
+        except FUSEError as exc:
+            log.warning('writes to %s lost: %s', path_to_file, os.strerror(exc.errno))
+        self._dirty_bytes -= len(self._fd_write_buffer.pop(fd, b""))
 
         del self._inode_fd_map[inode]
         del self._fd_inode_map[fd]
+        unchanged = self._fd_tree_map.pop(fd, None) is not None
+        #an fsync may already have shielded everything that was written
+        if fd in self._fd_shielded and fd not in self._fd_dirty_ranges:
+            unchanged = True
+        self._fd_shielded.discard(fd)
+        self._fd_dirty_ranges.pop(fd, None)
+        self._fd_verified.pop(fd, None)
         try:
             os.close(fd)
             self.path_to_file = path_to_file
@@ -590,22 +847,21 @@ class Operations(pyfuse3.Operations):
             if not path_to_file.endswith(".sbx"):
                 if path_to_file.__contains__(".trashinfo"):
                     return
-                if check_if_sbx_file_exists(path_to_file):
-                    if get_hash_of_normal_file(path_to_file) != get_hash_of_sbx_file(path_to_file+".sbx",self.sbx_version, raid=self.raid):
-                        if not active_sbx_encodings.__contains__(path_to_file):
-                            print("HASHES DONT MATCH")
-                            active_sbx_encodings.append(path_to_file)
-                            create_shielded_version_of_file(path_to_file, self.sbx_version, self.raid, password=self.password)
-                            
-                        else:
-                            print("File is already being processed")
-                    else:
-                        print("File was released without changes, no need to create sbx file")
+                if unchanged:
+                    print("File was released without changes, no need to create sbx file")
+                elif not self._claim_shield(path_to_file):
+                    print("File is already being processed, it is shielded again after")
                 else:
-                    print("Threading")
-                    if not active_sbx_encodings.__contains__(path_to_file):
-                        active_sbx_encodings.append(path_to_file)
-                        create_shielded_version_of_file(path_to_file,self.sbx_version, raid=self.raid,password=self.password)
+                    try:
+                        shield_exists = check_if_sbx_file_exists(path_to_file)
+                        if shield_exists and self._matches_shield(path_to_file):
+                            print("File was released without changes, no need to create sbx file")
+                        else:
+                            print("HASHES DONT MATCH" if shield_exists else "Threading")
+                            create_shielded_version_of_file(path_to_file, self.sbx_version, self.raid, password=self.password)
+                            self._shielded(path_to_file)
+                    finally:
+                        self._unclaim_shield(path_to_file)
                         
         
         except OSError as exc:
@@ -645,21 +901,40 @@ def parse_args(args):
                         help="Take .raid files into consideration in encoding/decoding")
     parser.add_argument("-p", "--password", type=str, default="",
                         help="encrypt/decrypt sbx files with password", metavar="pass")
+    parser.add_argument("--fsync-shield", type=str, default="async", choices=["sync", "async"],
+                        help="sync: fsync returns once the shield of the file is up to date, "+
+                             "async: the shield is updated when the file is closed")
+    parser.add_argument("--warm-index", action="store_true", default=False,
+                        help="Verify the shield directory in the background after mounting, "+
+                             "so that the first opens do not hash the files")
+    parser.add_argument("--scrub", action="store_true", default=False,
+                        help="Scrub the shield directory in the background while mounted")
+    parser.add_argument("--scrub-mbps", type=float, default=10,
+                        help="Read bandwidth budget of the scrubber in MB/s", metavar="n")
+    parser.add_argument("--scrub-iops", type=float, default=100,
+                        help="Read operations per second budget of the scrubber", metavar="n")
     return parser.parse_args(args)
 
+async def run_filesystem(operations):
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(operations.flush_timer)
+        await pyfuse3.main()
+        nursery.cancel_scope.cancel()
+
 def main():
 
     options = parse_args(sys.argv[1:])
     print("VERSION",options.sbxver)
     
-    sbx_versions = [1,2]
+    sbx_versions = seqbox.supported_vers
     if not sbx_versions.__contains__(options.sbxver):
-        exit("Sbxversion "+ str(options.sbxver)+" not available. Version 1 : 512 Byte Blocks, Version 2 : 4096 Byte blocks")
+        exit("Sbxversion "+ str(options.sbxver)+" not available. Version 1 : 512 Byte Blocks, Version 2 : 4096 Byte blocks, Version 3 : 64 KiB blocks")
     
     init_logging(options.debug)
     
     
-    operations = Operations(options.source, options.sbxver, options.raid, options.password)
+    operations = Operations(options.source, options.sbxver, options.raid, options.password,
+                            fsync_shield=options.fsync_shield)
 
     log.debug('Mounting...')
 
@@ -675,12 +950,26 @@ def main():
   
     pyfuse3.init(operations, options.mountpoint, fuse_options)
 
+    if options.warm_index:
+        operations.warm_index = sbxwarm.WarmIndex(options.source, sbx_ver=options.sbxver, raid=options.raid,
+                                                  shield=operations._shield_in_background)
+        threading.Thread(target=operations.warm_index.run, name="warm index", daemon=True).start()
+
+    if options.scrub:
+        scrubber = sbxscrub.Scrubber(options.source, sbx_ver=options.sbxver, raid=options.raid,
+                                     password=options.password, mbps=options.scrub_mbps,
+                                     iops=options.scrub_iops, skip=operations._is_busy,
+                                     claim=operations._claim_if_idle,
+                                     release=operations._unclaim_shield)
+        threading.Thread(target=scrubber.run, kwargs={"forever":True},
+                         name="scrubber", daemon=True).start()
+
 
     try:
 
         log.debug('Entering main loop..')
 
-        trio.run(pyfuse3.main)
+        trio.run(run_filesystem, operations)
 
     except:
         pyfuse3.close(unmount=False)
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+
+#----------------------------------------------------------------------------------
+#MIT License
+#
+#Copyright (c) 2023 Lukas Gecas
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE.
+#----------------------------------------------------------------------------------
+
+#Benchmark of the Operations of Sbx_Rsc_filesystem without mounting anything.
+#The Operations object is driven directly under trio, the way the kernel would
+#through libfuse: paths are resolved with lookup(), files are created, opened,
+#written, read and released through their inodes and file handles. No
+#/dev/fuse is needed, only the pyfuse3 module.
+
+import os
+import sys
+import contextlib
+import json
+import random
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from os import fsencode
+
+import pyfuse3
+import trio
+import Sbx_Rsc_filesystem as shieldfs
+
+PROGRAM_VER = "1.0.0"
+
+WORKLOADS = ["small_files", "large_write", "small_writes", "random_read", "rename_storm", "db_commits"]
+
+class FakeCtx():
+    """Stands in for pyfuse3.RequestContext, which only libfuse can create"""
+    def __init__(self):
+        self.uid = os.getuid()
+        self.gid = os.getgid()
+        self.pid = os.getpid()
+        self.umask = 0o022
+
+class FakeSetattrFields():
+    """Stands in for pyfuse3.SetattrFields, only the given fields are updated"""
+    def __init__(self, **fields):
+        for name in ("update_atime", "update_mtime", "update_ctime", "update_mode",
+                     "update_uid", "update_gid", "update_size"):
+            setattr(self, name, fields.get(name, False))
+
+class Stats():
+    """Latency and bytes hashed/encoded/decoded per operation"""
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.bytes = defaultdict(lambda: defaultdict(int))
+        self.current = None
+
+    def count(self, kind, nbytes):
+        if self.current:
+            self.bytes[self.current][kind] += nbytes
+
+    def report(self):
+        report = {}
+        for op, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            def percentile(p):
+                return latencies[min(len(latencies)-1, int(len(latencies) * p / 100))] / 1000
+            report[op] = {"count":len(latencies),
+                          "p50_us":percentile(50),
+                          "p90_us":percentile(90),
+                          "p99_us":percentile(99),
+                          "max_us":latencies[-1] / 1000}
+            for kind in ("hashed", "encoded", "decoded"):
+                report[op][kind+"_bytes_per_op"] = self.bytes[op][kind] / len(latencies)
+        return report
+
+@contextlib.contextmanager
+def instrument(stats):
+    """Count the bytes going through the hashing and shielding helpers of the filesystem"""
+    saved = {name:getattr(shieldfs, name) for name in
+             ("get_hash_of_normal_file", "get_hash_of_sbx_file",
+              "create_shielded_version_of_file", "reshield_file", "unshield_file")}
+
+    def get_hash_of_normal_file(path_to_file):
+        stats.count("hashed", os.path.getsize(path_to_file))
+        return saved["get_hash_of_normal_file"](path_to_file)
+
+    def get_hash_of_sbx_file(path_to_file, sbx_version, raid):
+        #only the header block is read, the hash is stored there
+        if os.path.exists(path_to_file):
+            stats.count("hashed", shieldfs.seqbox.SbxBlock(ver=sbx_version).blocksize)
+        return saved["get_hash_of_sbx_file"](path_to_file, sbx_version, raid)
+
+    def create_shielded_version_of_file(path_to_file, sbx_version, raid, password=""):
+        if not path_to_file.endswith(".sbx"):
+            stats.count("encoded", os.path.getsize(path_to_file))
+        return saved["create_shielded_version_of_file"](path_to_file, sbx_version, raid,
+                                                        password=password)
+
+    def reshield_file(path_to_file, ranges, sbx_version, raid, password=""):
+        #the changed ranges are encoded again, the whole file is hashed again
+        stats.count("encoded", sum(length for offset, length in ranges))
+        stats.count("hashed", os.path.getsize(path_to_file))
+        return saved["reshield_file"](path_to_file, ranges, sbx_version, raid, password=password)
+
+    def unshield_file(path_to_file, sbx_version, raid, password=""):
+        stats.count("decoded", os.path.getsize(path_to_file+".sbx"))
+        return saved["unshield_file"](path_to_file, sbx_version, raid, password=password)
+
+    def hash_leaf(data):
+        #leaves of the Merkle tree checked by read()
+        stats.count("hashed", len(data))
+        return saved_hash_leaf(data)
+
+    def readdir_reply(token, name, attr, next_id):
+        #the token is a ReplyBuffer here instead of a libfuse request
+        if len(token) >= token.limit:
+            return False
+        token.append((name, attr, next_id))
+        return True
+
+    saved_readdir_reply = pyfuse3.readdir_reply
+    saved_hash_leaf = shieldfs.sbxmerkle.hash_leaf
+    for name, function in (("get_hash_of_normal_file", get_hash_of_normal_file),
+                           ("get_hash_of_sbx_file", get_hash_of_sbx_file),
+                           ("create_shielded_version_of_file", create_shielded_version_of_file),
+                           ("reshield_file", reshield_file),
+                           ("unshield_file", unshield_file)):
+        setattr(shieldfs, name, function)
+    pyfuse3.readdir_reply = readdir_reply
+    shieldfs.sbxmerkle.hash_leaf = hash_leaf
+    try:
+        yield stats
+    finally:
+        for name, function in saved.items():
+            setattr(shieldfs, name, function)
+        pyfuse3.readdir_reply = saved_readdir_reply
+        shieldfs.sbxmerkle.hash_leaf = saved_hash_leaf
+
+class ReplyBuffer(list):
+    """The entries of one readdir() reply, as many as fit into a kernel buffer"""
+    def __init__(self, limit=64):
+        super().__init__()
+        self.limit = limit
+
+class Client():
+    """Plays the part of the kernel: resolves paths to inodes and calls the Operations"""
+
+    def __init__(self, operations, stats):
+        self.ops = operations
+        self.stats = stats
+        self.ctx = FakeCtx()
+        self.inodes = {"":pyfuse3.ROOT_INODE}
+        self.handles = {}
+
+    async def call(self, op, *args):
+        self.stats.current = op
+        starttime = time.perf_counter_ns()
+        try:
+            return await getattr(self.ops, op)(*args)
+        finally:
+            self.stats.latencies[op].append(time.perf_counter_ns() - starttime)
+            self.stats.current = None
+
+    async def lookup(self, path):
+        if path in self.inodes:
+            return self.inodes[path]
+        parent, name = os.path.split(path)
+        attr = await self.call("lookup", await self.lookup(parent), fsencode(name), self.ctx)
+        self.inodes[path] = attr.st_ino
+        return attr.st_ino
+
+    async def mkdir(self, path):
+        parent, name = os.path.split(path)
+        attr = await self.call("mkdir", await self.lookup(parent), fsencode(name), 0o755, self.ctx)
+        self.inodes[path] = attr.st_ino
+
+    async def create(self, path):
+        parent, name = os.path.split(path)
+        info, attr = await self.call("create", await self.lookup(parent), fsencode(name),
+                                     0o644, os.O_RDWR, self.ctx)
+        self.inodes[path] = attr.st_ino
+        self.handles[path] = info.fh
+
+    async def open(self, path, flags=os.O_RDONLY):
+        info = await self.call("open", await self.lookup(path), flags, self.ctx)
+        self.handles[path] = info.fh
+
+    async def read(self, path, offset, length):
+        return await self.call("read", self.handles[path], offset, length)
+
+    async def write(self, path, offset, buf):
+        return await self.call("write", self.handles[path], offset, buf)
+
+    async def fsync(self, path):
+        await self.call("fsync", self.handles[path], False)
+
+    async def truncate(self, path, size):
+        #by path, like truncate(2) from another process
+        attr = pyfuse3.EntryAttributes()
+        attr.st_size = size
+        await self.call("setattr", await self.lookup(path), attr,
+                        FakeSetattrFields(update_size=True), None, self.ctx)
+
+    async def release(self, path):
+        await self.call("release", self.handles.pop(path))
+
+    async def getattr(self, path):
+        return await self.call("getattr", await self.lookup(path), self.ctx)
+
+    async def readdir(self, path):
+        inode = await self.lookup(path)
+        fh = await self.call("opendir", inode, self.ctx)
+        entries = []
+        off = 0
+        #like the kernel, continue from the offset of the last entry until
+        #a reply comes back empty
+        while True:
+            reply = ReplyBuffer()
+            await self.call("readdir", fh, off, reply)
+            if not reply:
+                break
+            entries += reply
+            off = reply[-1][2]
+        await self.call("releasedir", fh)
+        return entries
+
+    async def rename(self, path_old, path_new):
+        parent_old, name_old = os.path.split(path_old)
+        parent_new, name_new = os.path.split(path_new)
+        await self.call("rename", await self.lookup(parent_old), fsencode(name_old),
+                        await self.lookup(parent_new), fsencode(name_new), 0, self.ctx)
+        self.inodes[path_new] = self.inodes.pop(path_old, None)
+        if self.inodes[path_new] is None:
+            del self.inodes[path_new]
+
+    async def unlink(self, path):
+        parent, name = os.path.split(path)
+        await self.call("unlink", await self.lookup(parent), fsencode(name), self.ctx)
+        self.inodes.pop(path, None)
+
+    async def replay(self, trace):
+        """Run a list of {"op":..., "path":...} steps, as written by synthetic_trace()"""
+        for step in trace:
+            op = step["op"]
+            if op in ("read", "write"):
+                if op == "read":
+                    await self.read(step["path"], step["offset"], step["size"])
+                else:
+                    await self.write(step["path"], step["offset"],
+                                     random.Random(step["offset"]).randbytes(step["size"]))
+            elif op == "rename":
+                await self.rename(step["path"], step["to"])
+            elif op == "open":
+                await self.open(step["path"], step.get("flags", os.O_RDONLY))
+            else:
+                await getattr(self, op)(step["path"])
+
+def synthetic_trace(workload, files=100, size=1024*1024, ops=1000, iosize=4096, seed=0):
+    """The steps of one of the built-in workloads"""
+    rnd = random.Random(seed)
+    trace = []
+    def write_file(path, filesize, chunk):
+        trace.append({"op":"create", "path":path})
+        for offset in range(0, filesize, chunk):
+            trace.append({"op":"write", "path":path, "offset":offset,
+                          "size":min(chunk, filesize - offset)})
+        trace.append({"op":"release", "path":path})
+
+    if workload == "small_files":
+        trace.append({"op":"mkdir", "path":"small"})
+        for i in range(files):
+            write_file("small/f%05i" % i, iosize, iosize)
+        trace.append({"op":"readdir", "path":"small"})
+        for i in range(files):
+            path = "small/f%05i" % i
+            trace.append({"op":"getattr", "path":path})
+            trace.append({"op":"open", "path":path})
+            trace.append({"op":"read", "path":path, "offset":0, "size":iosize})
+            trace.append({"op":"release", "path":path})
+    elif workload == "large_write":
+        write_file("large.bin", size, 128*1024)
+    elif workload == "small_writes":
+        #the same amount of data as large_write, in records of 512 bytes
+        write_file("records.bin", size, 512)
+    elif workload == "random_read":
+        write_file("random.bin", size, 128*1024)
+        trace.append({"op":"open", "path":"random.bin"})
+        for i in range(ops):
+            trace.append({"op":"read", "path":"random.bin",
+                          "offset":rnd.randrange(0, max(1, size - iosize)), "size":iosize})
+        trace.append({"op":"release", "path":"random.bin"})
+    elif workload == "rename_storm":
+        trace.append({"op":"mkdir", "path":"storm"})
+        names = ["storm/r%05i" % i for i in range(files)]
+        for path in names:
+            write_file(path, iosize, iosize)
+        for i in range(ops):
+            j = rnd.randrange(files)
+            new_name = "storm/r%05i_%i" % (j, i)
+            trace.append({"op":"rename", "path":names[j], "to":new_name})
+            names[j] = new_name
+    elif workload == "db_commits":
+        #a database file: small records written in place, each one committed
+        write_file("db.bin", size, 128*1024)
+        trace.append({"op":"open", "path":"db.bin", "flags":os.O_RDWR})
+        for i in range(ops):
+            trace.append({"op":"write", "path":"db.bin",
+                          "offset":rnd.randrange(0, max(1, size - iosize)), "size":iosize})
+            trace.append({"op":"fsync", "path":"db.bin"})
+        trace.append({"op":"release", "path":"db.bin"})
+    else:
+        raise ValueError("unknown workload '%s'" % workload)
+    return trace
+
+def benchmark(trace, source=None, sbx_version=1, raid=False, password="", fsync_shield="async"):
+    """Replay a trace against a fresh Operations object, return the per-operation report"""
+    workdir = None
+    if source is None:
+        workdir = source = tempfile.mkdtemp(prefix="fusebench")
+    stats = Stats()
+    try:
+        operations = shieldfs.Operations(source, sbx_version, raid, password,
+                                         fsync_shield=fsync_shield)
+        client = Client(operations, stats)
+        with instrument(stats), open(os.devnull, "w") as devnull, \
+             contextlib.redirect_stdout(devnull):
+            trio.run(client.replay, trace)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return stats.report()
+
+def print_report(name, report):
+    print(name)
+    print("  %-10s %7s %10s %10s %10s %10s %12s %12s %12s" %
+          ("op", "count", "p50 us", "p90 us", "p99 us", "max us",
+           "hashed B/op", "encoded B/op", "decoded B/op"))
+    for op, values in report.items():
+        print("  %-10s %7i %10.1f %10.1f %10.1f %10.1f %12.0f %12.0f %12.0f" %
+              (op, values["count"], values["p50_us"], values["p90_us"], values["p99_us"],
+               values["max_us"], values["hashed_bytes_per_op"],
+               values["encoded_bytes_per_op"], values["decoded_bytes_per_op"]))
+
+def parse_args(args):
+    '''Parse command line'''
+
+    parser = ArgumentParser(description="Benchmark the filesystem operations without a mount")
+    parser.add_argument("-w", "--workloads", type=str, default=",".join(WORKLOADS),
+                        help="built-in workloads to run")
+    parser.add_argument("-t", "--trace", type=str, default=None,
+                        help="replay a recorded trace (JSON list of steps) instead")
+    parser.add_argument("--save-trace", type=str, default=None,
+                        help="write the steps of the built-in workloads as a trace")
+    parser.add_argument("-s", "--source", type=str, default=None,
+                        help="shield directory to work in (a temporary one by default)")
+    parser.add_argument("-f", "--files", type=int, default=100,
+                        help="number of files of small_files and rename_storm")
+    parser.add_argument("--size", type=int, default=4*1024*1024,
+                        help="file size of large_write, small_writes and random_read")
+    parser.add_argument("--ops", type=int, default=1000,
+                        help="number of reads, renames or commits")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random workloads")
+    parser.add_argument("-sv", "--sbxver", type=int, default=1,
+                        help="SBX blocks version", metavar="n")
+    parser.add_argument("-raid", "--raid", action="store_true", default=False,
+                        help="shield with .raid copies")
+    parser.add_argument("-p", "--password", type=str, default="",
+                        help="encrypt sbx files with password", metavar="pass")
+    parser.add_argument("--fsync-shield", type=str, default="async", choices=["sync", "async"],
+                        help="when fsync updates the shield, as in the filesystem")
+    parser.add_argument("-j", "--json", type=str, default=None,
+                        help="write the report as JSON")
+    return parser.parse_args(args)
+
+def main():
+    options = parse_args(sys.argv[1:])
+
+    if options.trace:
+        with open(options.trace) as fin:
+            traces = {os.path.basename(options.trace):json.load(fin)}
+    else:
+        traces = {}
+        for workload in options.workloads.split(","):
+            if workload not in WORKLOADS:
+                exit("unknown workload '%s'" % workload)
+            traces[workload] = synthetic_trace(workload, options.files, options.size,
+                                               options.ops, seed=options.seed)
+        if options.save_trace:
+            with open(options.save_trace, "w") as fout:
+                json.dump([step for trace in traces.values() for step in trace], fout)
+
+    reports = {}
+    for name, trace in traces.items():
+        reports[name] = benchmark(trace, options.source, options.sbxver, options.raid,
+                                  options.password, options.fsync_shield)
+        print_report(name, reports[name])
+
+    if options.json:
+        with open(options.json, "w") as fout:
+            json.dump({"program_ver":PROGRAM_VER, "sbxver":options.sbxver,
+                       "raid":options.raid, "workloads":reports}, fout, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ sudo apt install meson ninja-build
 pip install reedsolo
 pip install meson
 pip install pytest
+pip install numpy
 git clone https://github.com/libfuse/libfuse.git
 cd libfuse
 mkdir build; cd build
@@ -13,6 +14,7 @@ sudo ninja install
 sudo apt-get install fuse3 libfuse3-dev -y
 sudo apt-get install pkg-config -y
 
-# Install creedsolo (reedsolomon c module) with options
-pip install --upgrade reedsolo --no-binary "reedsolo" --no-cache --config-setting="--build-option=--cythonize" --use-pep517 --isolated --pre --verbose
+# Install creedsolo (reedsolomon c module) with options, the pure Python reedsolo
+# installed above is used if this build fails
+pip install --upgrade reedsolo --no-binary "reedsolo" --no-cache --config-setting="--build-option=--cythonize" --use-pep517 --isolated --pre --verbose || echo "creedsolo not built, using the pure Python reedsolo"
 pip install pyfuse3==3.2.3
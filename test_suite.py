@@ -25,9 +25,26 @@
 import RS_SeqBox.sbxenc as Encoder
 import RS_SeqBox.sbxdec as Decoder
 import RS_SeqBox.sbxcheck as sbxChecker
+import RS_SeqBox.sbxscrub as sbxScrubber
+import RS_SeqBox.sbxbench as sbxBench
+import RS_SeqBox.sbxscan as sbxScan
+import RS_SeqBox.sbxreco as sbxReco
+import RS_SeqBox.sbxpar as sbxPar
+import RS_SeqBox.sbxmerkle as sbxMerkle
+import RS_SeqBox.sbxcomp as sbxComp
+from RS_SeqBox.inodetable import InodeTable, InodeMap
+import RS_SeqBox.writeback as writeback
+import RS_SeqBox.sbxwarm as sbxWarm
+import RS_SeqBox.rsbatch as rsbatch
+import RS_SeqBox.seqbox as seqbox
 import os
+import sys
+import hashlib
+import contextlib
+import errno
+import sqlite3
 import pytest
-from reedsolo import ReedSolomonError 
+from RS_SeqBox.seqbox import ReedSolomonError
 import subprocess
 import time
 import shutil
@@ -186,6 +203,205 @@ def test_if_sbxcheck_recovers_data_with_password():
         first_byte = file.read(1)
         assert first_byte == b'H'
 
+def test_sbxcheck_incremental_skips_unchanged_files(monkeypatch):
+    os.mkdir("testfolder")
+    create_file("./testfolder/test_file.txt", 'Hello'*200)
+    Encoder.encode(filename="./testfolder/test_file.txt", sbxfilename="./testfolder/test_file.txt.sbx")
+    sbxChecker.check("./testfolder", auto=True, incremental=True)
+    assert os.path.exists("./testfolder/.sbxcheck.db3")
+    hashed = []
+    def counting_hash(path_to_file):
+        hashed.append(path_to_file)
+        return sbxChecker.get_hash_of_sbx_file(path_to_file+".sbx", sbx_version=1)
+    monkeypatch.setattr(sbxChecker, "get_hash_of_normal_file", counting_hash)
+    sbxChecker.check("./testfolder", auto=True, incremental=True)
+    assert hashed == []
+    sbxChecker.check("./testfolder", auto=True, incremental=True, max_age=0)
+    assert len(hashed) == 1
+
+def test_sbxcheck_incremental_repairs_changed_files():
+    os.mkdir("testfolder")
+    create_file("./testfolder/test_file.txt", 'Hello'*200)
+    Encoder.encode(filename="./testfolder/test_file.txt", sbxfilename="./testfolder/test_file.txt.sbx")
+    sbxChecker.check("./testfolder", auto=True, incremental=True)
+    create_file("./testfolder/test_file.txt", 'A'*1001)
+    sbxChecker.check("./testfolder", auto=True, incremental=True)
+    with open('./testfolder/test_file.txt', 'rb') as file:
+        assert file.read(1) == b'H'
+
+def test_sbxcheck_handles_version_3(monkeypatch):
+    os.mkdir("testfolder")
+    create_file("./testfolder/test_file.txt", 'Hello'*20000)
+    Encoder.encode(filename="./testfolder/test_file.txt", sbxfilename="./testfolder/test_file.txt.sbx",
+                   sbx_ver=3, raid=True)
+    sbxChecker.check("./testfolder", sbxver=3, auto=True, incremental=True, raid=True)
+    hashed = []
+    monkeypatch.setattr(sbxChecker, "get_hash_of_normal_file", lambda path_to_file: hashed.append(path_to_file))
+    sbxChecker.check("./testfolder", sbxver=3, auto=True, incremental=True, raid=True)
+    assert hashed == []
+    monkeypatch.undo()
+    with open("./testfolder/test_file.txt", "r+b") as file:
+        file.write(b'A'*100)
+    sbxChecker.check("./testfolder", sbxver=3, auto=True, incremental=True, raid=True)
+    with open('./testfolder/test_file.txt', 'rb') as file:
+        assert file.read() == b'Hello'*20000
+
+def test_scrubber_repairs_damaged_container():
+    os.mkdir("testfolder")
+    create_file("./testfolder/test_file.txt", 'Hello'*200)
+    Encoder.encode(filename="./testfolder/test_file.txt", sbxfilename="./testfolder/test_file.txt.sbx", raid=True)
+    with open("./testfolder/test_file.txt.sbx", "r+b") as file:
+        file.seek(512+20)
+        file.write(b'A'*10)
+    results = sbxScrubber.scrub("./testfolder", raid=True, mbps=0, iops=0)
+    assert results["repaired"] == 1
+    sbx = seqbox.SbxBlock(ver=1)
+    with open("./testfolder/test_file.txt.sbx", "rb") as file:
+        buffer = file.read()
+    for p in range(0, len(buffer), sbx.blocksize):
+        assert Decoder.check_block(sbx, buffer[p:p+sbx.blocksize]) == "clean"
+
+def test_scrubber_restores_damaged_file():
+    os.mkdir("testfolder")
+    create_file("./testfolder/test_file.txt", 'Hello'*200)
+    Encoder.encode(filename="./testfolder/test_file.txt", sbxfilename="./testfolder/test_file.txt.sbx")
+    with open("./testfolder/test_file.txt", "r+b") as file:
+        file.write(b'A'*100)
+    results = sbxScrubber.scrub("./testfolder", mbps=0, iops=0)
+    assert results["repaired"] == 1
+    with open('./testfolder/test_file.txt', 'rb') as file:
+        assert file.read(1) == b'H'
+    assert sbxScrubber.scrub("./testfolder", mbps=0, iops=0)["clean"] == 1
+
+def test_scrubber_resumes_inside_the_primary(tmp_path, monkeypatch):
+    (tmp_path / "data.bin").write_bytes(os.urandom(278 * 20))
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), raid=True)
+    # correctable damage early in the primary and early in the raid twin
+    for name, blocknum in (("data.bin.sbx", 3), ("data.bin.sbx.raid", 2)):
+        with open(tmp_path / name, "r+b") as fout:
+            fout.seek(512 * blocknum + 100)
+            fout.write(b"\xFF" * 10)
+    scrubber = sbxScrubber.Scrubber(str(tmp_path), raid=True, mbps=0, iops=0)
+    scrubber.blocks_per_read = 1
+    scrubber.checkpoint_interval = -1
+    check_block = Decoder.check_block
+    calls = []
+    def interrupted(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 8:
+            raise KeyboardInterrupt
+        return check_block(*args, **kwargs)
+    monkeypatch.setattr(Decoder, "check_block", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        scrubber.run_pass()
+    db = sbxChecker.Ledger(scrubber.ledger)
+    assert [int(db.GetState(key, 0)) for key in ("scrub_twin", "scrub_block", "scrub_damaged")] == [0, 7, 1]
+    db.close()
+    monkeypatch.setattr(Decoder, "check_block", check_block)
+    verified = []
+    verify_blocks = scrubber.verify_blocks
+    def record(path_to_file, sbx, startblock, *args, **kwargs):
+        verified.append((os.path.basename(path_to_file), startblock))
+        return verify_blocks(path_to_file, sbx, startblock, *args, **kwargs)
+    scrubber.verify_blocks = record
+    assert scrubber.run_pass()["repaired"] == 1
+    assert verified == [("data.bin.sbx", 7), ("data.bin.sbx.raid", 0)]
+    sbx = seqbox.SbxBlock(ver=1)
+    for name in ("data.bin.sbx", "data.bin.sbx.raid"):
+        buffer = (tmp_path / name).read_bytes()
+        assert all(Decoder.check_block(sbx, buffer[p:p+512]) == "clean" for p in range(0, len(buffer), 512))
+
+def test_scrubber_claims_the_file_for_a_repair(tmp_path, monkeypatch):
+    (tmp_path / "data.bin").write_bytes(os.urandom(3000))
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"))
+    (tmp_path / "data.bin").write_bytes(b"changed")
+    filename = str(tmp_path / "data.bin")
+    # opened while the container is verified, the repair is not started
+    opened = []
+    scrubber = sbxScrubber.Scrubber(str(tmp_path), mbps=0, iops=0, skip=lambda path: bool(opened))
+    verify_blocks = scrubber.verify_blocks
+    def verify_and_open(*args, **kwargs):
+        opened.append(True)
+        return verify_blocks(*args, **kwargs)
+    scrubber.verify_blocks = verify_and_open
+    assert scrubber.run_pass()["busy"] == 1
+    assert (tmp_path / "data.bin").read_bytes() == b"changed"
+    # the file stays registered for the whole repair
+    claimed = []
+    def restore(*args, **kwargs):
+        assert claimed == [filename]
+        return decode(*args, **kwargs)
+    decode = Decoder.decode
+    monkeypatch.setattr(Decoder, "decode", restore)
+    scrubber = sbxScrubber.Scrubber(str(tmp_path), mbps=0, iops=0, claim=lambda path: not claimed.append(path),
+                                    release=claimed.remove)
+    assert scrubber.run_pass()["repaired"] == 1
+    assert claimed == []
+    scrubber = sbxScrubber.Scrubber(str(tmp_path), mbps=0, iops=0, claim=lambda path: False)
+    (tmp_path / "data.bin").write_bytes(b"changed")
+    assert scrubber.run_pass()["busy"] == 1
+
+def test_scrubber_survives_a_locked_ledger(tmp_path, monkeypatch):
+    scrubber = sbxScrubber.Scrubber(str(tmp_path), mbps=0, iops=0)
+    passes = []
+    def locked():
+        passes.append(True)
+        if len(passes) <= 2:
+            raise sqlite3.OperationalError("database is locked")
+        raise KeyboardInterrupt
+    monkeypatch.setattr(scrubber, "run_pass", locked)
+    monkeypatch.setattr(sbxScrubber.time, "sleep", lambda seconds: None)
+    assert scrubber.run() is None
+    with pytest.raises(KeyboardInterrupt):
+        scrubber.run(forever=True)
+    assert len(passes) == 3
+
+def test_fast_test_reports_damage_map():
+    create_file("test_file.txt", 'Hello'*2000)
+    Encoder.encode("test_file.txt", raid=True, password="1234")
+    with open("test_file.txt.sbx", "r+b") as file:
+        file.seek(512*3+100)
+        file.write(b'A'*10)
+        file.seek(512*5)
+        file.write(b'A'*512)
+    report = Decoder.verify("test_file.txt.sbx", raid=True)
+    assert report["blocks"] == 37
+    assert report["primary"]["correctable"] == [3]
+    assert report["primary"]["lost"] == [5]
+    assert report["raid"]["clean"] == 37
+    assert report["recoverable"] and not report["healthy"]
+    os.remove("test_file.txt.sbx.raid")
+    report = Decoder.decode("test_file.txt.sbx", test=True, fast=True, raid=True)
+    assert report["unrecoverable"] == [5]
+
+def test_repair_rewrites_damaged_blocks_in_both_copies():
+    create_file("test_file.txt", 'Hello'*2000)
+    Encoder.encode("test_file.txt", raid=True)
+    with open("test_file.txt.sbx", "r+b") as file:
+        file.seek(512*3+100)
+        file.write(b'A'*10)
+        file.seek(512*5)
+        file.write(b'A'*512)
+    with open("test_file.txt.sbx.raid", "r+b") as file:
+        file.seek(512*7+10)
+        file.write(b'A'*10)
+    report = Decoder.repair_container("test_file.txt.sbx", raid=True)
+    assert report["repaired"] == [3, 5, 7]
+    assert Decoder.verify("test_file.txt.sbx", raid=True)["healthy"]
+    Decoder.decode("test_file.txt.sbx", "test_file_other.txt")
+    with open("test_file_other.txt", "r") as file:
+        assert file.read() == 'Hello'*2000
+
+def test_sbxcheck_repairs_containers():
+    os.mkdir("testfolder")
+    create_file("./testfolder/test_file.txt", 'Hello'*200)
+    Encoder.encode(filename="./testfolder/test_file.txt", sbxfilename="./testfolder/test_file.txt.sbx")
+    with open("./testfolder/test_file.txt.sbx", "r+b") as file:
+        file.seek(512+20)
+        file.write(b'A'*10)
+    sbxChecker.check("./testfolder", auto=True, repair=True)
+    assert Decoder.verify("./testfolder/test_file.txt.sbx")["healthy"]
+
 def test_if_password_encoding_works():
     create_file("test_file_encoding.txt", 'A'*500)
     Encoder.encode(filename="test_file_encoding.txt",sbxfilename="test_file_encoding.txt.sbx", password="1234")
@@ -201,6 +417,729 @@ def test_if_password_decoding_works():
         file.seek(0)  
         assert file.read(1) == b'A'            
 
+def test_password_xor_keeps_leading_zero_bytes():
+    encdec = seqbox.EncDec("1234", 278)
+    for first in range(256):
+        buffer = bytes([first]) + b'A'*277
+        masked = encdec.xor(buffer)
+        assert len(masked) == 278
+        assert encdec.xor(masked) == buffer
+
+def test_ver3_roundtrip_with_custom_geometry(tmp_path):
+    data = os.urandom(300000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), sbx_ver=3, raid=True, password="1234",
+                   blocksize=65536, redsym=40)
+    assert os.lstat(tmp_path / "data.bin.sbx").st_size % 65536 == 0
+    with open(tmp_path / "data.bin.sbx", "r+b") as file:
+        file.seek(65536*2+1000)
+        file.write(b'A'*4000)
+    assert Decoder.verify(str(tmp_path / "data.bin.sbx"), sbx_ver=3)["primary"]["correctable"] == [2]
+    with open(tmp_path / "data.bin.sbx", "r+b") as file:
+        file.seek(65536*3)
+        file.write(b'A'*65536)
+    Decoder.decode(str(tmp_path / "data.bin.sbx"), str(tmp_path / "out.bin"), sbx_ver=3,
+                   raid=True, password="1234")
+    assert (tmp_path / "out.bin").read_bytes() == data
+
+def test_ver3_rejects_unsupported_geometry():
+    with pytest.raises(seqbox.SbxError):
+        seqbox.SbxBlock(ver=3, blocksize=5000)
+    with pytest.raises(seqbox.SbxError):
+        seqbox.SbxBlock(ver=3, redsym=1)
+
+def test_ver3_scan_and_recover_from_image(tmp_path):
+    data = os.urandom(200000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), sbx_ver=3, blocksize=65536)
+    container = (tmp_path / "data.bin.sbx").read_bytes()
+    (tmp_path / "image.img").write_bytes(os.urandom(777) + container + os.urandom(3000))
+    os.mkdir(tmp_path / "out")
+    db = str(tmp_path / "scan.db3")
+    sbxScan.scan([str(tmp_path / "image.img")], dbfilename=db, sbx_ver=3)
+    sbxReco.recover(db, destpath=str(tmp_path / "out"), recover_all=True)
+    assert (tmp_path / "out" / "data.bin.sbx").read_bytes() == container
+
+def test_interleave_survives_burst_without_raid(tmp_path):
+    data = os.urandom(100000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), interleave=16)
+    with open(tmp_path / "data.bin.sbx", "r+b") as file:
+        file.seek(512*5+100)
+        file.write(b'A'*500)
+    report = Decoder.verify(str(tmp_path / "data.bin.sbx"))
+    assert report["primary"]["correctable"] == list(range(1, 17))
+    assert report["recoverable"]
+    Decoder.decode(str(tmp_path / "data.bin.sbx"), str(tmp_path / "out.bin"))
+    assert (tmp_path / "out.bin").read_bytes() == data
+    assert len(Decoder.repair_container(str(tmp_path / "data.bin.sbx"))["repaired"]) == 16
+    assert Decoder.verify(str(tmp_path / "data.bin.sbx"))["healthy"]
+
+def test_simulator_follows_interleaving():
+    pytest.importorskip("numpy")
+    import RS_SeqBox.sbxsim as sbxSim
+    container = sbxSim.Container(20000, sbx_ver=1, interleave=8)
+    fast = sbxSim.simulate(container, "burst", [0.01], trials=20, seed=1, burst=300)
+    exact = sbxSim.simulate(container, "burst", [0.01], trials=20, seed=1, burst=300, exact=True)
+    assert fast == exact
+
+def test_parity_rebuilds_lost_blocks(tmp_path):
+    data = os.urandom(100000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), parity=2, pargroup=10)
+    assert os.path.getsize(tmp_path / "data.bin.sbx.par") < os.path.getsize(tmp_path / "data.bin.sbx") * 0.25
+    with open(tmp_path / "data.bin.sbx", "r+b") as file:
+        file.seek(512*3)
+        file.write(bytes(1024))
+        file.seek(512*40)
+        file.write(b'A'*512)
+    report = Decoder.verify(str(tmp_path / "data.bin.sbx"))
+    assert report["parity"]["rebuildable"] == [3, 4, 40]
+    assert report["recoverable"]
+    Decoder.decode(str(tmp_path / "data.bin.sbx"), str(tmp_path / "out.bin"))
+    assert (tmp_path / "out.bin").read_bytes() == data
+    assert Decoder.repair_container(str(tmp_path / "data.bin.sbx"))["repaired"] == [3, 4, 40]
+    assert Decoder.verify(str(tmp_path / "data.bin.sbx"))["healthy"]
+
+def test_parity_added_to_existing_container(tmp_path):
+    data = os.urandom(50000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), sbx_ver=2)
+    sbxPar.add_parity(str(tmp_path / "data.bin.sbx"), group=8, parity=1, sbx_ver=2)
+    with open(tmp_path / "data.bin.sbx.par", "r+b") as file:
+        file.seek(100)
+        byte = file.read(1)[0]
+        file.seek(100)
+        file.write(bytes([byte ^ 0xFF]))
+    with open(tmp_path / "data.bin.sbx", "r+b") as file:
+        file.seek(4096*10)
+        file.write(bytes(4096))
+    report = Decoder.verify(str(tmp_path / "data.bin.sbx"), sbx_ver=2)
+    assert report["parity"] == {"lost":1, "rebuildable":[10]}
+    Decoder.repair_container(str(tmp_path / "data.bin.sbx"), sbx_ver=2)
+    assert Decoder.verify(str(tmp_path / "data.bin.sbx"), sbx_ver=2)["healthy"]
+
+def test_index_describes_container(tmp_path):
+    data = os.urandom(2500000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), index=True,
+                   interleave=8, parity=2)
+    sbx = seqbox.block_for_file(str(tmp_path / "data.bin.sbx"))
+    index = seqbox.read_index(str(tmp_path / "data.bin.sbx"), sbx)
+    assert index.datablocks == -(-len(data) // 278) and index.interleave == 8
+    assert os.path.getsize(tmp_path / "data.bin.sbx") == (1 + index.datablocks + index.indexblocks) * 512
+    for hashnum, digest in enumerate(index.hashes):
+        blocks = index.hash_blocks(hashnum)
+        assert digest == hashlib.sha256(data[(blocks[0]-1)*278:blocks[-1]*278]).digest()
+    assert index.locate(278*5+10) == (6, 10)
+    assert Decoder.verify(str(tmp_path / "data.bin.sbx"))["healthy"]
+    Decoder.decode(str(tmp_path / "data.bin.sbx"), str(tmp_path / "out.bin"))
+    assert (tmp_path / "out.bin").read_bytes() == data
+
+def test_index_is_read_from_the_copy_that_exists(tmp_path):
+    (tmp_path / "data.bin").write_bytes(os.urandom(50000))
+    sbxfilename = str(tmp_path / "data.bin.sbx")
+    Encoder.encode(str(tmp_path / "data.bin"), sbxfilename, index=True, interleave=4, raid=True)
+    sbx = seqbox.block_for_file(sbxfilename)
+    index = seqbox.read_index(sbxfilename, sbx, raid=True)
+    # a primary cut short, then a primary that is gone
+    with open(sbxfilename, "r+b") as file:
+        file.truncate(os.path.getsize(sbxfilename) - 3 * 512)
+    assert seqbox.read_index(sbxfilename, sbx, raid=True).hashes == index.hashes
+    os.remove(sbxfilename)
+    assert seqbox.read_index(sbxfilename, sbx, raid=True).hashes == index.hashes
+    assert seqbox.read_index(sbxfilename, sbx) is None
+
+def test_index_replaces_lost_header_for_verification(tmp_path):
+    (tmp_path / "data.bin").write_bytes(os.urandom(50000))
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), index=True, interleave=4)
+    with open(tmp_path / "data.bin.sbx", "r+b") as file:
+        file.write(bytes(512))
+    sbx = seqbox.block_for_file(str(tmp_path / "data.bin.sbx"))
+    assert seqbox.read_metadata(str(tmp_path / "data.bin.sbx"), sbx)["interleave"] == 4
+    report = Decoder.verify(str(tmp_path / "data.bin.sbx"))
+    assert report["primary"]["lost"] == [0] and report["primary"]["clean"] == report["blocks"] - 1
+
+def test_merkle_tree_verifies_ranges(tmp_path):
+    data = os.urandom(3 * sbxMerkle.LEAF_SIZE + 1000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), merkle=True)
+    tree = sbxMerkle.load(str(tmp_path / "data.bin.sbx"))
+    assert len(tree.leaves) == 4 and tree.verify_range(str(tmp_path / "data.bin"), threads=4) == []
+    with open(tmp_path / "data.bin", "r+b") as file:
+        file.seek(sbxMerkle.LEAF_SIZE + 5)
+        file.write(bytes([data[sbxMerkle.LEAF_SIZE + 5] ^ 1]))
+    assert tree.verify_range(str(tmp_path / "data.bin"), threads=4) == [1]
+    assert tree.verify_range(str(tmp_path / "data.bin"), 0, sbxMerkle.LEAF_SIZE) == []
+    assert tree.verify_range(str(tmp_path / "data.bin"), sbxMerkle.LEAF_SIZE - 1, 2) == [1]
+    assert tree.verify_data(3 * sbxMerkle.LEAF_SIZE, data[3 * sbxMerkle.LEAF_SIZE:]) == []
+    (tmp_path / "data.bin.sbx.mkl").write_bytes(sbxMerkle.MerkleTree([bytes(32)] * 4, len(data)).encode())
+    assert sbxMerkle.load(str(tmp_path / "data.bin.sbx")) is None
+
+def test_merkle_tree_added_to_existing_container(tmp_path):
+    (tmp_path / "data.bin").write_bytes(b"")
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"))
+    assert sbxMerkle.load(str(tmp_path / "data.bin.sbx")) is None
+    sbxMerkle.add_merkle(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"))
+    tree = sbxMerkle.load(str(tmp_path / "data.bin.sbx"))
+    assert tree.filesize == 0 and tree.verify_range(str(tmp_path / "data.bin")) == []
+    assert Decoder.verify(str(tmp_path / "data.bin.sbx"))["healthy"]
+
+def test_decode_range_reads_only_the_covering_blocks(tmp_path):
+    data = os.urandom(200000)
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx"), interleave=4,
+                   password="secret", raid=True)
+    sbxfilename = str(tmp_path / "data.bin.sbx")
+    for offset, length in [(0, 1), (277, 2), (5000, 3000), (199990, 100), (300000, 5), (10, 0)]:
+        assert Decoder.decode_range(sbxfilename, offset, length, raid=True,
+                                    password="secret") == data[offset:offset+length]
+    #a block lost in the primary comes from the raid copy
+    with open(sbxfilename, "r+b") as file:
+        file.seek(512 * 20)
+        file.write(bytes(512 * 4))
+    with open(tmp_path / "part.bin", "wb") as fout:
+        assert Decoder.decode_range(sbxfilename, 278 * 15, 278 * 10, fout=fout, raid=True,
+                                    password="secret") == 2780
+    assert (tmp_path / "part.bin").read_bytes() == data[278*15:278*25]
+    with pytest.raises(seqbox.SbxDecodeError):
+        Decoder.decode_range(sbxfilename, 278 * 15, 278 * 10, password="secret")
+
+def test_stream_encode_from_stdin_and_decode_to_stdout(tmp_path):
+    data = os.urandom(1500000)
+    scripts = os.path.join(os.path.dirname(os.path.abspath(__file__)), "RS_SeqBox")
+    subprocess.run([sys.executable, os.path.join(scripts, "sbxenc.py"), "-", str(tmp_path / "data.sbx"),
+                    "-mk", "-il", "4"], input=data, check=True, capture_output=True)
+    header = seqbox.read_header(str(tmp_path / "data.sbx"), seqbox.block_for_file(str(tmp_path / "data.sbx")))
+    assert header.metadata["filesize"] == len(data)
+    assert header.metadata["hash"] == b"\x12\x20" + hashlib.sha256(data).digest()
+    assert sbxMerkle.load(str(tmp_path / "data.sbx")).verify_data(0, data) == []
+    result = subprocess.run([sys.executable, os.path.join(scripts, "sbxdec.py"), str(tmp_path / "data.sbx"), "-"],
+                            check=True, capture_output=True)
+    assert result.stdout == data and b"hash match!" in result.stderr
+
+@pytest.mark.parametrize("codec", sbxComp.available())
+def test_compressed_container_restores_transparently(tmp_path, codec):
+    data = b"".join(b"%i,line of a log file,%i\n" % (i, i % 7) for i in range(60000))
+    (tmp_path / "data.log").write_bytes(data)
+    Encoder.encode(str(tmp_path / "data.log"), str(tmp_path / "plain.sbx"))
+    Encoder.encode(str(tmp_path / "data.log"), str(tmp_path / "data.sbx"), compression=codec,
+                   chunksize=64*1024, merkle=True)
+    assert os.path.getsize(tmp_path / "data.sbx") * 4 < os.path.getsize(tmp_path / "plain.sbx")
+    Decoder.decode(str(tmp_path / "data.sbx"), str(tmp_path / "out.log"))
+    assert (tmp_path / "out.log").read_bytes() == data
+    assert Decoder.decode_range(str(tmp_path / "data.sbx"), 500000, 100000) == data[500000:600000]
+    assert sbxMerkle.load(str(tmp_path / "data.sbx")).verify_range(str(tmp_path / "data.log")) == []
+
+def test_inode_table_follows_hardlinks_and_renames():
+    table = InodeTable("/src", 1)
+    table.add(2, 1, "dir")
+    table.add(3, 2, "file")
+    table.add(3, 1, "link")
+    assert table.path(3) == os.path.join("/src", "dir", "file")
+    assert sorted(table.paths(3)) == sorted([os.path.join("/src", "dir", "file"), os.path.join("/src", "link")])
+    # renaming a directory moves the known paths below it
+    table.move(2, 1, "dir", 1, "moved")
+    assert table.path(3) == os.path.join("/src", "moved", "file")
+    # the other hardlink takes over once the first path is unlinked
+    table.remove(3, 2, "file")
+    assert table.paths(3) == [os.path.join("/src", "link")]
+    assert table.lookups(3) == 2
+    # a directory forgotten before its child stays until the child goes
+    assert table.forget(2, 1)
+    table.add(4, 1, "other")
+    assert table.forget(3, 2) and table.forget(4, 1)
+    assert len(table) == 1 and 3 not in table
+    assert table.path(1) == "/src"
+
+def test_inode_map_matches_dict():
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(7)
+    imap, ref = InodeMap(8), {}
+    for key, value, op in zip(rng.integers(1, 2000, 20000), rng.integers(0, 1 << 30, 20000), rng.random(20000)):
+        key, value = int(key), int(value)
+        if op < 0.6:
+            imap[key] = value
+            ref[key] = value
+        elif key in ref:
+            del imap[key]
+            del ref[key]
+        else:
+            assert key not in imap
+    assert len(imap) == len(ref)
+    assert all(imap[key] == value for key, value in ref.items())
+
+def test_rs_codecs_are_shared():
+    assert seqbox.rscodec(108) is seqbox.rscodec(108)
+    assert seqbox.rscodec(108) is not seqbox.rscodec(107)
+    assert seqbox.SbxBlock(ver=1).rsc_for_data_block is seqbox.SbxBlock(ver=1).rsc_for_data_block
+    assert sbxPar.codec(4) is seqbox.rscodec(4)
+    # a shared codec still corrects what it encoded
+    rsc = seqbox.rscodec(10)
+    codeword = rsc.encode(bytearray(b"shared codec"))
+    codeword[0] ^= 0xFF
+    assert bytes(rsc.decode(codeword)[0]) == b"shared codec"
+
+@pytest.mark.parametrize("ver", [1, 2, 3])
+def test_batch_encoder_matches_block_encode(ver):
+    pytest.importorskip("numpy")
+    single = seqbox.SbxBlock(ver=ver, uid=b"batch")
+    batch = seqbox.SbxBlock(ver=ver, uid=b"batch")
+    buffers = [os.urandom(single.raw_data_size_read_into_1_block) for _ in range(4)]
+    blocks = []
+    for buffer in buffers:
+        single.blocknum += 1
+        single.data = buffer
+        blocks.append(single.encode())
+    assert batch.encode_data_blocks(buffers) == blocks
+    assert batch.blocknum == 4
+    # shortened codewords are encoded like RSCodec does
+    messages = [os.urandom(300) for _ in range(3)]
+    assert rsbatch.encoder(40).encode(messages) == [bytes(seqbox.rscodec(40).encode(bytearray(m))) for m in messages]
+
+def test_encode_without_numpy_writes_the_same_container(tmp_path, monkeypatch):
+    (tmp_path / "data.bin").write_bytes(os.urandom(100000))
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "batch.sbx"), uid="abcdef", interleave=3, parity=2)
+    monkeypatch.setattr(rsbatch, "np", None)
+    Encoder.encode(str(tmp_path / "data.bin"), str(tmp_path / "single.sbx"), uid="abcdef", interleave=3, parity=2)
+    batch, single = (tmp_path / "batch.sbx").read_bytes(), (tmp_path / "single.sbx").read_bytes()
+    # block 0 holds the names and the time of encoding
+    assert batch[512:] == single[512:]
+    assert (tmp_path / "batch.sbx.par").read_bytes()[512:] == (tmp_path / "single.sbx.par").read_bytes()[512:]
+
+def test_rs_backends_are_interchangeable(monkeypatch):
+    monkeypatch.setattr(seqbox, "_backend", None)
+    monkeypatch.setattr(seqbox, "_rscodecs", {})
+    message = bytearray(os.urandom(200))
+    codewords = {}
+    for name in ("creedsolo", "reedsolo"):
+        pytest.importorskip(name)
+        assert seqbox.select_backend(name, batch="off") == name
+        rsc = seqbox.rscodec(20)
+        codewords[name] = bytes(rsc.encode(message))
+        damaged = bytearray(codewords[name])
+        damaged[5] ^= 0xFF
+        assert bytes(rsc.decode(damaged)[0]) == message
+        # every backend fails with the same error
+        with pytest.raises(seqbox.ReedSolomonError):
+            rsc.decode(bytearray(os.urandom(len(damaged))))
+    assert len(set(codewords.values())) == 1
+    # a backend that gives wrong codewords is never picked
+    class Broken():
+        def __init__(self, nsym, **kwargs):
+            self.nsym, self.nsize = nsym, 255
+        def encode(self, data):
+            return bytearray(len(data) + self.nsym)
+    monkeypatch.setitem(seqbox.RS_BACKENDS, "broken", lambda: (Broken, seqbox.ReedSolomonError))
+    assert seqbox.select_backend("auto") != "broken"
+    with pytest.raises(seqbox.SbxError):
+        seqbox.select_backend("missing")
+
+def test_long_names_are_stored_whole_or_not_at_all(tmp_path, capsys):
+    deep = tmp_path / ("d" * 30)
+    deep.mkdir(parents=True)
+    data = os.urandom(3000)
+    (deep / "file.bin").write_bytes(data)
+    path_to_file = str(deep / "file.bin")
+    Encoder.encode(path_to_file, path_to_file + ".sbx", merkle=True)
+    header = seqbox.read_sbx_header(path_to_file + ".sbx")
+    # the file name fits on its own, the container name is left out, nothing is cut
+    assert header.metadata["filename"] == path_to_file
+    assert "sbxname" not in header.metadata
+    assert "sbxname" in capsys.readouterr().out
+    # a header with a relative file name is decoded with a warning
+    os.chdir(tmp_path)
+    (tmp_path / "rel.bin").write_bytes(data)
+    Encoder.encode("rel.bin", "rel.bin.sbx")
+    os.remove("rel.bin")
+    Decoder.decode("rel.bin.sbx")
+    assert "not absolute" in capsys.readouterr().out
+    assert (tmp_path / "rel.bin").read_bytes() == data
+
+def test_parity_blocks_match_without_numpy(monkeypatch):
+    blocks = [os.urandom(4096) for _ in range(20)]
+    batch = sbxPar.parity_blocks(blocks, 4)
+    monkeypatch.setattr(rsbatch, "np", None)
+    assert sbxPar.parity_blocks(blocks, 4) == batch
+    # the parity still rebuilds lost blocks
+    assert sbxPar.rebuild([None, None] + blocks[2:], [None, None] + batch[2:]) == blocks
+
+def test_sbx_header_is_cached_until_the_container_changes(tmp_path, monkeypatch):
+    data = os.urandom(5000)
+    (tmp_path / "data.bin").write_bytes(data)
+    sbxfilename = str(tmp_path / "data.bin.sbx")
+    Encoder.encode(str(tmp_path / "data.bin"), sbxfilename, raid=True)
+    header = seqbox.read_sbx_header(sbxfilename, raid=True)
+    assert seqbox.header_digest(header.metadata) == hashlib.sha256(data).digest()
+    assert sbxChecker.get_hash_of_sbx_file(sbxfilename, sbx_version=1) == hashlib.sha256(data).digest()
+    # a hit does not decode block 0 again
+    decodes = []
+    real_rs_decode = seqbox.SbxBlock.rs_decode
+    monkeypatch.setattr(seqbox.SbxBlock, "rs_decode",
+                        lambda self, buffer: decodes.append(1) or real_rs_decode(self, buffer))
+    assert seqbox.read_sbx_header(sbxfilename, raid=True) is header
+    assert not decodes
+    # re-encoding replaces it, a destroyed header falls back to the raid copy
+    (tmp_path / "data.bin").write_bytes(data[:4000])
+    Encoder.encode(str(tmp_path / "data.bin"), sbxfilename, overwrite=True, raid=True)
+    with open(sbxfilename, "r+b") as fout:
+        fout.write(bytes(512))
+        fout.write(b"x")
+    header = seqbox.read_sbx_header(sbxfilename, raid=True)
+    assert decodes and header.metadata["filesize"] == 4000
+    assert seqbox.read_sbx_header(str(tmp_path / "missing.sbx")) is None
+
+def test_write_buffer_coalesces_small_writes(tmp_path):
+    fd = os.open(tmp_path / "data.bin", os.O_RDWR | os.O_CREAT)
+    try:
+        buffer = writeback.WriteBuffer(fd)
+        # adjacent records stay in memory until a whole aligned chunk is there
+        record = b"r" * 1024
+        written = [buffer.add(offset, record) for offset in range(0, writeback.FLUSH_SIZE + 1024, 1024)]
+        assert sum(written) == writeback.FLUSH_SIZE
+        assert os.fstat(fd).st_size == writeback.FLUSH_SIZE
+        assert buffer.start == writeback.FLUSH_SIZE and len(buffer) == 1024
+        # an overwrite inside the extent is merged, a write elsewhere flushes it
+        assert buffer.add(writeback.FLUSH_SIZE + 10, b"x") == 0
+        assert buffer.add(5, b"y") == 1024
+        buffer.flush()
+        expected = bytearray(record * (writeback.FLUSH_SIZE // 1024 + 1))
+        expected[writeback.FLUSH_SIZE + 10] = ord("x")
+        expected[5] = ord("y")
+        assert (tmp_path / "data.bin").read_bytes() == bytes(expected)
+        assert len(buffer) == 0 and buffer.since is None
+    finally:
+        os.close(fd)
+
+@pytest.mark.parametrize("sbx_ver,password", [(1, ""), (1, "secret"), (3, "")])
+def test_reshield_patches_only_the_changed_blocks(tmp_path, sbx_ver, password):
+    data = bytearray(os.urandom(300000))
+    filename, sbxfilename = str(tmp_path / "data.bin"), str(tmp_path / "data.bin.sbx")
+    (tmp_path / "data.bin").write_bytes(data)
+    Encoder.encode(filename, sbxfilename, sbx_ver=sbx_ver, raid=True, password=password, merkle=True)
+    sbx = seqbox.block_for_file(sbxfilename, ver=sbx_ver)
+    before = (tmp_path / "data.bin.sbx").read_bytes()
+    # a change in the middle, and the file grows
+    data[5000:5010] = b"x" * 10
+    data += os.urandom(1000)
+    (tmp_path / "data.bin").write_bytes(data)
+    assert Encoder.reshield(filename, sbxfilename, [(5000, 10), (300000, 1000)], sbx_ver=sbx_ver,
+                            raid=True, password=password)
+    after = (tmp_path / "data.bin.sbx").read_bytes()
+    changed = [blocknum for blocknum in range(len(before) // sbx.blocksize)
+               if before[blocknum*sbx.blocksize:(blocknum+1)*sbx.blocksize] !=
+                  after[blocknum*sbx.blocksize:(blocknum+1)*sbx.blocksize]]
+    raw = sbx.raw_data_size_read_into_1_block
+    assert changed == sorted({0, 5000 // raw + 1, 5009 // raw + 1, 300000 // raw + 1})
+    assert (tmp_path / "data.bin.sbx.raid").read_bytes() == after
+    assert sbxMerkle.load(sbxfilename, sbx_ver=sbx_ver, raid=True).verify_range(filename) == []
+    os.remove(filename)
+    Decoder.decode(sbxfilename, filename, password=password, sbx_ver=sbx_ver)
+    assert (tmp_path / "data.bin").read_bytes() == bytes(data)
+    # a shrunk file is cut back, a layout it can not patch is left alone
+    (tmp_path / "data.bin").write_bytes(data[:1000])
+    assert Encoder.reshield(filename, sbxfilename, [], sbx_ver=sbx_ver, raid=True, password=password)
+    assert Decoder.decode_range(sbxfilename, 0, 2000, sbx_ver=sbx_ver, password=password) == bytes(data[:1000])
+    Encoder.encode(filename, sbxfilename, overwrite=True, sbx_ver=sbx_ver, interleave=4)
+    assert not Encoder.reshield(filename, sbxfilename, [(0, 10)], sbx_ver=sbx_ver)
+
+def test_warm_index_tracks_the_shield_directory(tmp_path, monkeypatch):
+    for name in ("good.bin", "stale.bin", "bare.bin"):
+        (tmp_path / name).write_bytes(os.urandom(3000))
+    for name in ("good.bin", "stale.bin"):
+        Encoder.encode(str(tmp_path / name), str(tmp_path / (name + ".sbx")), merkle=name == "good.bin")
+    (tmp_path / "stale.bin").write_bytes(b"changed")
+    shielded = []
+    def shield(path_to_file):
+        shielded.append(path_to_file)
+        Encoder.encode(path_to_file, path_to_file + ".sbx")
+        return True
+    index = sbxWarm.WarmIndex(str(tmp_path), shield=shield)
+    assert index.scan() == {"shielded":2, "stale":1, "unshielded":0}
+    assert shielded == [str(tmp_path / "bare.bin")]
+    assert index.is_shielded(str(tmp_path / "good.bin")) and index.is_shielded(str(tmp_path / "bare.bin"))
+    assert index.lookup(str(tmp_path / "stale.bin"))["state"] == "stale"
+    # a change is noticed, a rename keeps the entry
+    os.rename(tmp_path / "good.bin", tmp_path / "moved.bin")
+    os.rename(tmp_path / "good.bin.sbx", tmp_path / "moved.bin.sbx")
+    os.rename(tmp_path / "good.bin.sbx.mkl", tmp_path / "moved.bin.sbx.mkl")
+    index.move(str(tmp_path / "good.bin"), str(tmp_path / "moved.bin"))
+    assert index.is_shielded(str(tmp_path / "moved.bin"))
+    with open(tmp_path / "moved.bin", "ab") as fout:
+        fout.write(b"x")
+    assert not index.is_shielded(str(tmp_path / "moved.bin"))
+    # the next mount trusts the ledger and hashes nothing
+    hashed = []
+    monkeypatch.setattr(sbxChecker, "get_hash_of_normal_file", lambda path: hashed.append(path))
+    monkeypatch.setattr(sbxMerkle.MerkleTree, "verify_range", lambda *args, **kwargs: hashed.append(args))
+    index = sbxWarm.WarmIndex(str(tmp_path))
+    index.scan()
+    assert index.is_shielded(str(tmp_path / "bare.bin"))
+    assert len(hashed) == 2
+
+def test_warm_index_does_not_hold_the_ledger_while_shielding(tmp_path):
+    for name in ("a.bin", "b.bin"):
+        (tmp_path / name).write_bytes(os.urandom(3000))
+    index = sbxWarm.WarmIndex(str(tmp_path))
+    def shield(path_to_file):
+        # the scrubber writes to the same ledger meanwhile
+        db = sbxChecker.Ledger(index.ledger)
+        db.connection.execute("PRAGMA busy_timeout = 0")
+        db.SetState("scrub_file", path_to_file)
+        db.commit()
+        db.close()
+        Encoder.encode(path_to_file, path_to_file + ".sbx")
+        return True
+    index.shield = shield
+    assert index.scan() == {"shielded":2, "stale":0, "unshielded":0}
+
+def test_benchmark_measures_every_operation(tmp_path):
+    cases = sbxBench.build_cases(sbxBench.OPERATIONS, [4096], [1], [False, True], [False], [0, 1])
+    results = sbxBench.benchmark(cases, warmup=0, repetitions=1, tempdir=str(tmp_path))
+    assert len(results) == 12
+    for result in results:
+        assert "error" not in result
+        assert result["ok"]
+        assert result["mbps"] > 0 and result["peak_rss_kb"] > 0
+
+def test_benchmark_damage_spreads_over_the_file(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 100)
+    (tmp_path / "data.bin").write_bytes(data)
+    sbxBench.damage_file(str(tmp_path / "data.bin"), 1, 1)
+    damaged = (tmp_path / "data.bin").read_bytes()
+    assert len(damaged) == len(data)
+    # a byte can be overwritten with the value it had
+    changed = [pos for pos in range(len(data)) if data[pos] != damaged[pos]]
+    assert len(data) // 100 * 0.95 < len(changed) <= len(data) // 100
+    assert changed[0] < 1024 * 1024 and changed[-1] > 2 * 1024 * 1024
+
+def test_benchmark_baseline_flags_regressions():
+    case = {"op":"encode", "size":1024, "version":1, "password":False, "raid":False, "damage":0}
+    baseline = {"results":[dict(case, mbps=10.0)]}
+    assert sbxBench.compare([dict(case, mbps=9.5)], baseline, 10) == []
+    assert len(sbxBench.compare([dict(case, mbps=8.0)], baseline, 10)) == 1
+
+def test_simulator_damage_models():
+    np = pytest.importorskip("numpy")
+    import RS_SeqBox.sbxsim as sbxSim
+    rng = np.random.default_rng(0)
+    sectors = sbxSim.damage_masks("sector", 0.5, 20, 4096, rng, sector=512)
+    assert (sectors.reshape(20, 8, 512).all(axis=2) == sectors.reshape(20, 8, 512).any(axis=2)).all()
+    bursts = sbxSim.damage_masks("burst", 0.1, 20, 4096, rng, burst=64)
+    assert 0.05 < bursts.mean() < 0.15
+    assert not sbxSim.damage_masks("random", 0, 20, 4096, rng).any()
+
+def test_simulator_matches_decoding_every_block():
+    pytest.importorskip("numpy")
+    import RS_SeqBox.sbxsim as sbxSim
+    container = sbxSim.Container(3000, sbx_ver=1)
+    for model in ("random", "sector"):
+        fast = sbxSim.simulate(container, model, [0.15, 0.2], trials=20, raid=True, seed=1)
+        exact = sbxSim.simulate(container, model, [0.15, 0.2], trials=20, raid=True, seed=1, exact=True)
+        assert fast == exact
+    assert sbxSim.simulate(container, "random", [0], trials=5)[0]["probability"] == 1
+
+def test_fuse_benchmark_without_mount(tmp_path):
+    pytest.importorskip("pyfuse3")
+    import fusebench
+    trace = fusebench.synthetic_trace("small_files", files=5)
+    trace += fusebench.synthetic_trace("rename_storm", files=5, ops=10)
+    report = fusebench.benchmark(trace, source=str(tmp_path))
+    assert report["create"]["count"] == 10
+    assert report["rename"]["count"] == 10
+    assert report["release"]["encoded_bytes_per_op"] > 0
+    # the Merkle tree is checked leaf by leaf on read, not on open
+    assert report["open"]["hashed_bytes_per_op"] == 0
+    assert report["read"]["hashed_bytes_per_op"] > 0
+
+def test_fuse_fsync_updates_the_shield_in_place(tmp_path):
+    pytest.importorskip("pyfuse3")
+    import fusebench
+    trace = fusebench.synthetic_trace("db_commits", size=100000, ops=5)
+    report = fusebench.benchmark(trace, source=str(tmp_path), fsync_shield="sync")
+    # each commit re-encodes what it wrote, the close after them nothing
+    assert report["fsync"]["count"] == 5
+    assert report["fsync"]["encoded_bytes_per_op"] == 4096
+    assert report["release"]["encoded_bytes_per_op"] == 100000 / 2
+    data = (tmp_path / "db.bin").read_bytes()
+    os.rename(tmp_path / "db.bin", tmp_path / "db.old")
+    Decoder.decode(str(tmp_path / "db.bin.sbx"), str(tmp_path / "db.bin"))
+    assert (tmp_path / "db.bin").read_bytes() == data
+
+def test_fuse_rename_link_unlink_carry_the_shield(tmp_path):
+    pytest.importorskip("pyfuse3")
+    import trio
+    import fusebench
+    import Sbx_Rsc_filesystem as shieldfs
+    operations = shieldfs.Operations(str(tmp_path), 1, True)
+    data = os.urandom(20000)
+    async def run(client):
+        await client.mkdir("sub")
+        await client.create("a.bin")
+        await client.write("a.bin", 0, data)
+        await client.release("a.bin")
+        await client.rename("a.bin", "sub/b.bin")
+        await client.open("sub/b.bin")
+        await client.read("sub/b.bin", 0, 100)
+        await client.release("sub/b.bin")
+        await client.call("link", await client.lookup("sub/b.bin"),
+                          await client.lookup("sub"), b"c.bin", client.ctx)
+        await client.unlink("sub/b.bin")
+    with fusebench.instrument(fusebench.Stats()) as stats, \
+         open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        trio.run(run, fusebench.Client(operations, stats))
+    # encoded once, when the file was written, never for the rename
+    assert sum(stats.bytes[op]["encoded"] for op in stats.bytes) == len(data)
+    assert sorted(os.listdir(tmp_path / "sub")) == ["c.bin", "c.bin.sbx", "c.bin.sbx.mkl", "c.bin.sbx.raid"]
+    assert os.listdir(tmp_path) == ["sub"]
+    header = seqbox.read_sbx_header(str(tmp_path / "sub" / "c.bin.sbx"), raid=True)
+    assert header.metadata["filename"] == str(tmp_path / "sub" / "b.bin")
+    assert seqbox.header_digest(header.metadata) == hashlib.sha256(data).digest()
+
+def test_fuse_unshield_restores_long_paths(tmp_path):
+    pytest.importorskip("pyfuse3")
+    import Sbx_Rsc_filesystem as shieldfs
+    deep = tmp_path / ("d" * 30)
+    deep.mkdir(parents=True)
+    data = os.urandom(3000)
+    path_to_file = str(deep / "file.bin")
+    with open(path_to_file, "wb") as fout:
+        fout.write(data)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        shieldfs.active_sbx_encodings.append(path_to_file)
+        shieldfs.create_shielded_version_of_file(path_to_file, 1, True)
+        with open(path_to_file, "r+b") as fout:
+            fout.write(b"damaged")
+        shieldfs.unshield_file(path_to_file, 1, True)
+    with open(path_to_file, "rb") as fin:
+        assert fin.read() == data
+
+def test_fuse_truncate_of_an_open_file_is_shielded(tmp_path):
+    pytest.importorskip("pyfuse3")
+    import trio
+    import fusebench
+    import Sbx_Rsc_filesystem as shieldfs
+    operations = shieldfs.Operations(str(tmp_path), 1, False)
+    data = os.urandom(20000)
+    async def run(client):
+        await client.create("log")
+        await client.write("log", 0, data)
+        await client.release("log")
+        # a reader has it open, with its tree, when it is truncated
+        await client.open("log")
+        await client.read("log", 0, 100)
+        await client.truncate("log", 0)
+        await client.release("log")
+        await client.open("log")
+        await client.release("log")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        trio.run(run, fusebench.Client(operations, fusebench.Stats()))
+    assert (tmp_path / "log").read_bytes() == b""
+    header = seqbox.read_sbx_header(str(tmp_path / "log.sbx"))
+    assert seqbox.header_digest(header.metadata) == hashlib.sha256(b"").digest()
+
+def test_fuse_fsync_reports_a_failed_shield(tmp_path, monkeypatch):
+    pytest.importorskip("pyfuse3")
+    import trio
+    import fusebench
+    import Sbx_Rsc_filesystem as shieldfs
+    operations = shieldfs.Operations(str(tmp_path), 1, False, fsync_shield="sync")
+    monkeypatch.setattr(Encoder, "reshield", lambda *args, **kwargs: False)
+    def failing_encode(*args, **kwargs):
+        raise SystemExit(1)
+    async def run(client):
+        await client.create("db.bin")
+        await client.write("db.bin", 0, os.urandom(5000))
+        await client.release("db.bin")
+        await client.open("db.bin", os.O_RDWR)
+        await client.write("db.bin", 0, b"commit")
+        monkeypatch.setattr(Encoder, "encode", failing_encode)
+        with pytest.raises(shieldfs.FUSEError) as err:
+            await client.fsync("db.bin")
+        assert err.value.errno == errno.EIO
+        # the ranges wait for the next fsync or the close
+        assert operations._fd_dirty_ranges[client.handles["db.bin"]] == [[0, 6]]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        trio.run(run, fusebench.Client(operations, fusebench.Stats()))
+
+def test_fuse_release_during_a_background_shield_shields_again(tmp_path, monkeypatch):
+    pytest.importorskip("pyfuse3")
+    import threading
+    import trio
+    import fusebench
+    import Sbx_Rsc_filesystem as shieldfs
+    operations = shieldfs.Operations(str(tmp_path), 1, False)
+    path_to_file = str(tmp_path / "bare.bin")
+    with open(path_to_file, "wb") as fout:
+        fout.write(os.urandom(5000))
+    started, go_on = threading.Event(), threading.Event()
+    encode_shield = shieldfs.encode_shield
+    def slow_encode(*args, **kwargs):
+        started.set()
+        go_on.wait(10)
+        encode_shield(*args, **kwargs)
+    monkeypatch.setattr(shieldfs, "encode_shield", slow_encode)
+    results = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        thread = threading.Thread(target=lambda: results.append(operations._shield_in_background(path_to_file)))
+        thread.start()
+        started.wait(10)
+        data = os.urandom(6000)
+        async def run(client):
+            await client.open("bare.bin", os.O_RDWR)
+            await client.write("bare.bin", 0, data)
+            await client.release("bare.bin")
+        trio.run(run, fusebench.Client(operations, fusebench.Stats()))
+        go_on.set()
+        thread.join(10)
+    assert results == [True]
+    assert shieldfs.active_sbx_encodings == [] and not shieldfs.shield_pending
+    header = seqbox.read_sbx_header(path_to_file + ".sbx")
+    assert seqbox.header_digest(header.metadata) == hashlib.sha256(data).digest()
+
+def test_fuse_size_counts_buffered_writes(tmp_path):
+    pyfuse3 = pytest.importorskip("pyfuse3")
+    import trio
+    import fusebench
+    import Sbx_Rsc_filesystem as shieldfs
+    from os import fsencode
+    operations = shieldfs.Operations(str(tmp_path), 1, False)
+    sizes = []
+    async def run(client):
+        await client.create("log")
+        await client.write("log", 0, b"x" * 1000)
+        await client.write("log", 1000, b"x" * 24)
+        # the writes are still in memory, the file on disk is empty
+        sizes.append(os.path.getsize(tmp_path / "log"))
+        attr = await operations.lookup(pyfuse3.ROOT_INODE, fsencode("log"))
+        sizes.append(attr.st_size)
+        sizes.extend(attr.st_size for name, attr, off in await client.readdir("") if name == b"log")
+        sizes.append((await client.getattr("log")).st_size)
+        await client.release("log")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with fusebench.instrument(fusebench.Stats()) as stats:
+            trio.run(run, fusebench.Client(operations, stats))
+    assert sizes == [0, 1024, 1024, 1024]
+
+def test_fuse_readdir_continues_from_offsets(tmp_path):
+    pytest.importorskip("pyfuse3")
+    import trio
+    import fusebench
+    import Sbx_Rsc_filesystem as shieldfs
+    os.mkdir(tmp_path / "big")
+    for i in range(300):
+        (tmp_path / "big" / ("f%03i" % i)).touch()
+    (tmp_path / "big" / "f000.sb.rs").touch()
+    operations = shieldfs.Operations(str(tmp_path), 1, False)
+    with fusebench.instrument(fusebench.Stats()) as stats:
+        client = fusebench.Client(operations, stats)
+        entries = trio.run(client.readdir, "big")
+    # several replies of 64 entries, each name once, the .sb.rs hidden
+    assert len(stats.latencies["readdir"]) == 6
+    assert sorted(name for name, attr, off in entries) == [os.fsencode("f%03i" % i) for i in range(300)]
+    assert [off for name, attr, off in entries] == list(range(1, 301))
+    assert not operations._dir_handles
+
 @pytest.fixture(autouse=True)
 def cleanup():
     yield
@@ -228,6 +1167,9 @@ def cleanup():
     
     if os.path.exists("./testfolder/test_file.txt.sbx.raid"):
         os.remove("./testfolder/test_file.txt.sbx.raid")
+
+    if os.path.exists("./testfolder/.sbxcheck.db3"):
+        os.remove("./testfolder/.sbxcheck.db3")
     
     if os.path.exists("testfolder"):
         os.removedirs("testfolder")